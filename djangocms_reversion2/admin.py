@@ -8,17 +8,23 @@ from django.conf.urls import url
 from django.contrib import admin, messages
 from django.contrib.admin.options import IS_POPUP_VAR
 from django.urls import reverse
-from django.http.response import Http404
+from django.http.response import Http404, StreamingHttpResponse
 from django.shortcuts import redirect, render_to_response, get_object_or_404, render
+from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 from sekizai.context import SekizaiContext
 
-from djangocms_reversion2.diff import create_placeholder_contents
+from djangocms_reversion2.batch import revise_pages
+from djangocms_reversion2.diff import create_placeholder_contents, get_precomputed_diffs, iter_placeholder_contents
 from djangocms_reversion2.forms import PageVersionForm
+from djangocms_reversion2.instrumentation import DIFF, instrument
 from djangocms_reversion2.models import PageVersion
+from djangocms_reversion2.plugin_diff import diff_page_attributes
 from djangocms_reversion2.signals import make_page_version_dirty
-from djangocms_reversion2.utils import revert_page, revise_all_pages
-from djangocms_reversion2.views import view_revision
+from djangocms_reversion2.storage import materialize
+from djangocms_reversion2.settings import BATCH_ADD_REQUEST_LIMIT, REVERSION2_DIFF_MODE, REVERSION2_STREAM_DIFFS
+from djangocms_reversion2.utils import revert_page
+from djangocms_reversion2.views import version_history, view_revision
 
 
 # Admin for Page Versions
@@ -30,6 +36,9 @@ class PageVersionAdmin(admin.ModelAdmin):
     )
     list_display_links = None
     diff_view_template = 'admin/diff.html'
+    diff_placeholder_template = 'admin/diff_placeholder.html'
+    # the streamed placeholders replace this comment of the rendered diff view
+    stream_marker = '<!-- reversion2:placeholders -->'
     view_revision_template = 'admin/view_revision.html'
 
     def get_urls(self):
@@ -39,6 +48,8 @@ class PageVersionAdmin(admin.ModelAdmin):
             url(r'^revert/page/(?P<page_pk>\d+)/to/(?P<version_pk>\d+)$', self.revert, name='djangocms_reversion2_revert_page'),
             url(r'^batch-add/(?P<pk>\w+)$', self.batch_add, name='djangocms_reversion2_pagerevision_batch_add'),
             url(r'^view-revision/(?P<revision_pk>\d+)$', view_revision, name='djangocms_reversion2_view_revision'),
+            url(r'^history/page/(?P<page_pk>\d+)/$', self.admin_site.admin_view(version_history),
+                name='djangocms_reversion2_history'),
         ]
         return admin_urls + urls
 
@@ -80,7 +91,6 @@ class PageVersionAdmin(admin.ModelAdmin):
         messages.info(request, _(u'You have succesfully reverted to {rev}').format(rev=page_version))
         return self.render_close_frame()
 
-    # Not currently used - TODO
     def batch_add(self, request, **kwargs):
         # only superusers are allowed to trigger this
 
@@ -88,8 +98,14 @@ class PageVersionAdmin(admin.ModelAdmin):
         if not user.is_superuser:
             messages.error(request, _('Only superusers are allowed to use the batch page revision creation mode'))
         else:
-            num = revise_all_pages()
-            messages.info(request, _(u'{num} unversioned pages have been versioned.').format(num=num))
+            # a request only handles a limited number of pages, the next request continues the run
+            # (use the reversion2_version_pages command for large sites)
+            run = revise_pages(name='batch_add', limit=BATCH_ADD_REQUEST_LIMIT)
+            if run.finished:
+                messages.info(request, _(u'{num} unversioned pages have been versioned.').format(num=run.created))
+            else:
+                messages.info(request, _(u'{num} unversioned pages have been versioned so far. Run the batch again '
+                                         u'to continue.').format(num=run.created))
 
         pk = kwargs.get('pk')
         language = request.GET.get('language')
@@ -147,7 +163,7 @@ class PageVersionAdmin(admin.ModelAdmin):
         # -> else: fetch the page
         if int(left_pk) == 0:
             page_draft_versions = PageVersion.objects.filter(draft=page_draft, active=True, language=language)\
-                .order_by('-hidden_page__changed_date')[:1]
+                .order_by('-created_at')[:1]
 
             if page_draft_versions.count() > 0:
                 left_page = page_draft_versions.first()
@@ -159,28 +175,37 @@ class PageVersionAdmin(admin.ModelAdmin):
             left = 'pageVersion'
             left_page = PageVersion.objects.get(pk=left_pk)
 
-        # list of page's revisions to show as the left sidebar
-        revision_list = PageVersion.objects.filter(draft=page_draft, language=language)
-        # group the revisions by date
-        grouped_revisions = {}
-        for rev in revision_list.iterator():
-            key = rev.hidden_page.changed_date.strftime("%Y-%m-%d")
-            if key not in grouped_revisions.keys():
-                grouped_revisions[key] = []
-            grouped_revisions[key].insert(0, rev)
-        sorted_grouped_revisions = sorted(grouped_revisions.items(), key=lambda i: i[0], reverse=True)
+        # the page's revisions in the left sidebar are loaded from the version_history view
 
         # differences between the placeholders
-        if left == 'pageVersion':
-            l_page = left_page.hidden_page
-        else:
-            l_page = left_page
-        if right == 'pageVersion':
-            r_page = right_page.hidden_page
-        else:
-            r_page = right_page
-
-        diffs = create_placeholder_contents(l_page, r_page, request, language)
+        # (streamed diffs are computed while the response is sent, only their preparation is measured)
+        with instrument(DIFF, page=page_draft.pk, left=left_pk, right=right_pk, language=language):
+            diffs = None
+            if left == 'pageVersion' and right == 'pageVersion':
+                # 'what changed in this version' is computed after the snapshot if PRECOMPUTE_DIFFS is set
+                diffs = get_precomputed_diffs(left_page, right_page)
+            if diffs is None:
+                if left == 'pageVersion':
+                    l_page = materialize(left_page, user)
+                else:
+                    l_page = left_page
+                if right == 'pageVersion':
+                    r_page = materialize(right_page, user)
+                else:
+                    r_page = right_page
+
+                if REVERSION2_STREAM_DIFFS:
+                    diffs = iter_placeholder_contents(l_page, r_page, request, language)
+                else:
+                    diffs = create_placeholder_contents(l_page, r_page, request, language)
+            elif REVERSION2_STREAM_DIFFS:
+                diffs = iter(sorted(diffs.items()))
+
+            page_changes = []
+            if REVERSION2_DIFF_MODE == 'structure':
+                page_changes = diff_page_attributes(left_page.hidden_page if left == 'pageVersion' else left_page,
+                                                    right_page.hidden_page if right == 'pageVersion' else right_page,
+                                                    language)
 
         left_page_absolute_url = left_page.hidden_page.get_draft_url(language=language)
 
@@ -193,17 +218,41 @@ class PageVersionAdmin(admin.ModelAdmin):
             'page': page_draft.pk,
             'active_left_page_version_pk': left_page.pk,
             'request': request,
-            'sorted_grouped_revisions': sorted_grouped_revisions,
             'active_language': language,
             'all_languages': page_draft.languages.split(','),
             'diffs': diffs,
+            'page_changes': page_changes,
             'left_page_absolute_url': left_page_absolute_url,
-            'right_page_is_active_page': right_page_is_active_page
+            'right_page_is_active_page': right_page_is_active_page,
+            'stream_diffs': REVERSION2_STREAM_DIFFS,
+            'stream_marker': self.stream_marker,
         })
 
+        if REVERSION2_STREAM_DIFFS:
+            return self.stream_diff_view(request, context.flatten(), diffs)
 
         return render(request, self.diff_view_template, context=context.flatten())
 
+    def stream_diff_view(self, request, context, diffs):
+        """
+        Sends the diff view up to the placeholders, then every placeholder as soon as it has been diffed
+        :param diffs: iterator of (slot, content), only one placeholder is kept in memory at a time
+        """
+        html = render_to_string(self.diff_view_template, context=context, request=request)
+        if self.stream_marker not in html:
+            # nothing to compare (see diff.html)
+            return StreamingHttpResponse([html])
+        head, tail = html.split(self.stream_marker, 1)
+
+        def stream():
+            yield head
+            for placeholder, content in diffs:
+                yield render_to_string(self.diff_placeholder_template,
+                                       context={'placeholder': placeholder, 'content': content}, request=request)
+            yield tail
+
+        return StreamingHttpResponse(stream())
+
 
     def add_view(self, request, form_url='', extra_context=None):
         language = request.GET.get('language')
@@ -292,7 +341,7 @@ class PageVersionAdmin(admin.ModelAdmin):
     user.short_description = _('By')
 
     def date(self, obj):
-        return obj.hidden_page.changed_date.strftime('%d.%m.%Y %H:%M')
+        return obj.created_at.strftime('%d.%m.%Y %H:%M')
     date.short_description = _('Date')
 
 
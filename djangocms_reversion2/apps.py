@@ -16,6 +16,11 @@ class CMSReversion2Config(AppConfig):
     verbose_name = 'Django-CMS Reversion2'
 
     def ready(self):
+        from .instrumentation import aggregator
+        from .settings import AGGREGATE_MEASUREMENTS
+
         connect_all_plugins()
+        if AGGREGATE_MEASUREMENTS:
+            aggregator.connect()
 
 
@@ -0,0 +1,336 @@
+import logging
+import multiprocessing
+import random
+import time
+from collections import defaultdict
+
+from cms.models import Page, Title
+from cms.utils.permissions import current_user, get_current_user
+from django.contrib.sites.models import Site
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from . import registry
+from .settings import ADD_VERSION_ON_PUBLISH, BATCH_ADD_UNVERSIONED_ONLY, BATCH_CHUNK_SIZE, VERSION_START_VALUE
+
+# attempts to create a version when concurrent workers collide on tree paths
+VERSION_RETRIES = 5
+# version bucket of each worker process of revise_pages_parallel (see utils.get_or_create_version_bucket)
+BUCKET_NAME = 'batch {}'
+
+# the version bucket of this worker process, set by the pool initializer
+_worker_bucket = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_special_paths(site=None):
+    """
+    Returns the node paths of the version and bin roots
+    """
+    site_ids = [getattr(site, 'pk', site)] if site else Site.objects.values_list('pk', flat=True)
+    return [path for site_id in site_ids for path in registry.get_special_paths(site_id)]
+
+
+def get_pages_to_version(site=None, partition=None):
+    """
+    Returns all drafts which are neither versions nor in the bin, ordered by pk
+    :param partition: only the drafts of this partition (see get_partitions)
+    """
+    pages = Page.objects.drafts()
+    if site:
+        pages = pages.filter(node__site=site)
+    if partition:
+        pages = pages.filter(node__site=partition['site'])
+        if partition['descendants']:
+            pages = pages.filter(node__path__startswith=partition['path'])
+        else:
+            pages = pages.filter(node__path=partition['path'])
+
+    exclude = Q()
+    for path in get_special_paths(site=site):
+        exclude |= Q(node__path__startswith=path)
+    if exclude:
+        pages = pages.exclude(exclude)
+    return pages.order_by('pk')
+
+
+def get_partitions(site=None, workers=1):
+    """
+    Splits the drafts into independent page tree branches per site.
+    Each top level page with its descendants is a partition; branches with more than their share of pages are
+    split into the branch root and the branches of its children.
+    :return: list of {'site': site id, 'path': node path, 'descendants': bool} with the largest partitions first
+    """
+    from cms.models import TreeNode
+
+    steplen = TreeNode.steplen
+    special_paths = get_special_paths(site=site)
+    nodes = TreeNode.objects.filter(cms_pages__publisher_is_draft=True)
+    if site:
+        nodes = nodes.filter(site=site)
+
+    sizes = defaultdict(int)
+    children = defaultdict(list)
+    num_nodes = 0
+    for site_id, path in nodes.values_list('site_id', 'path').iterator():
+        if any(path.startswith(special_path) for special_path in special_paths):
+            continue
+        num_nodes += 1
+        children[(site_id, path[:-steplen])].append(path)
+        for depth in range(steplen, len(path) + 1, steplen):
+            sizes[(site_id, path[:depth])] += 1
+
+    share = max(1, num_nodes // (workers * 4))
+    pending = [(site_id, path) for (site_id, parent), paths in children.items() if not parent for path in paths]
+    partitions = []
+    while pending:
+        site_id, path = pending.pop()
+        if sizes[(site_id, path)] > share and children[(site_id, path)]:
+            partitions.append({'site': site_id, 'path': path, 'descendants': False, 'size': 1})
+            pending.extend((site_id, child) for child in children[(site_id, path)])
+        else:
+            partitions.append({'site': site_id, 'path': path, 'descendants': True,
+                               'size': sizes[(site_id, path)]})
+    return sorted(partitions, key=lambda partition: partition['size'], reverse=True)
+
+
+def get_languages_to_version(page_ids, languages=None):
+    """
+    Returns {page_id: [language, ...]} of the translations which need an initial version
+    """
+    from .models import PageVersion
+
+    titles = Title.objects.filter(page__in=page_ids)
+    if languages:
+        titles = titles.filter(language__in=languages)
+    if ADD_VERSION_ON_PUBLISH:
+        # only published pages are versioned
+        titles = titles.filter(published=True)
+
+    versioned = set()
+    if BATCH_ADD_UNVERSIONED_ONLY:
+        versioned = set(PageVersion.objects.filter(draft__in=page_ids).values_list('draft_id', 'language'))
+
+    page_languages = defaultdict(list)
+    for page_id, language in titles.values_list('page_id', 'language').order_by('page_id', 'language'):
+        if (page_id, language) not in versioned:
+            page_languages[page_id].append(language)
+    return page_languages
+
+
+def get_run(name, restart=False):
+    """
+    Returns the checkpoint of the batch run with the given name, a finished run starts over
+    """
+    from .models import BatchRun
+
+    run, created = BatchRun.objects.get_or_create(name=name)
+    if restart or run.finished:
+        run.reset()
+    return run
+
+
+def version_page(draft, language, user, title='Initial', comment='Initial Revision - batch created',
+                 version_id=VERSION_START_VALUE, bucket=None):
+    """
+    Creates a version of the draft in its own savepoint
+    :param bucket: name of the version bucket for the hidden page (see utils.get_or_create_version_bucket)
+    :return: the new PageVersion or None if the page does not need a version
+    """
+    from .models import PageVersion
+
+    for attempt in range(VERSION_RETRIES):
+        try:
+            # cms.api.create_page (i.e. for the version root) clears the current user
+            with current_user(user), transaction.atomic():
+                return PageVersion.create_version(draft=draft,
+                                                  language=language,
+                                                  version_parent=None,
+                                                  title=title,
+                                                  comment=comment,
+                                                  version_id=version_id,
+                                                  bucket=bucket)
+        except AssertionError as e:
+            logger.info('Skipped %s (%s): %s', draft.pk, language, e)
+            return None
+        except IntegrityError:
+            # another worker added a node with the same tree path at the same time
+            if attempt == VERSION_RETRIES - 1:
+                raise
+            time.sleep(random.random() * 0.1 * (attempt + 1))
+
+
+def process_chunk(run, pages, languages=None, user=None, bucket=None):
+    """
+    Versions a chunk of drafts and moves the checkpoint behind them in one transaction
+    """
+    user = user or get_current_user()
+    page_languages = get_languages_to_version([page.pk for page in pages], languages=languages)
+    with transaction.atomic():
+        for page in pages:
+            for language in page_languages.get(page.pk, []):
+                try:
+                    if version_page(page, language, user, bucket=bucket):
+                        run.created += 1
+                    else:
+                        run.skipped += 1
+                except IntegrityError as e:
+                    logger.warning('Integrity Error - %s (%s): %s', page.pk, language, e)
+                    run.errors += 1
+            run.processed += 1
+        run.last_page_id = pages[-1].pk
+        run.save()
+
+
+def revise_pages(name='default', site=None, languages=None, chunk_size=BATCH_CHUNK_SIZE, limit=None,
+                 restart=False, callback=None, partition=None, bucket=None):
+    """
+    Creates an initial version for all unversioned pages (exclude the bin and versioned pages).
+    The drafts are processed in chunks of chunk_size pages; after each chunk the checkpoint of the run is
+    saved, so an interrupted run resumes behind the last completed chunk.
+    :param limit: stop after (about) this many pages, the run can be continued later
+    :param callback: called with the run, the number of pages processed by this call and the elapsed seconds
+                     after every chunk
+    :param bucket: add the hidden pages to this version bucket instead of the version root
+    :return: the BatchRun
+    """
+    run = get_run(name, restart=restart)
+    user = get_current_user()
+    started = time.time()
+    processed = 0
+
+    pages = get_pages_to_version(site=site, partition=partition).filter(pk__gt=run.last_page_id)
+    chunk = []
+    for page in pages.iterator():
+        chunk.append(page)
+        if len(chunk) >= chunk_size:
+            process_chunk(run, chunk, languages=languages, user=user, bucket=bucket)
+            processed += len(chunk)
+            chunk = []
+            if callback:
+                callback(run, processed, time.time() - started)
+            if limit and processed >= limit:
+                return run
+    if chunk:
+        process_chunk(run, chunk, languages=languages, user=user, bucket=bucket)
+        processed += len(chunk)
+        if callback:
+            callback(run, processed, time.time() - started)
+
+    run.finished = timezone.now()
+    run.save(update_fields=['finished'])
+    return run
+
+
+def _init_worker(buckets):
+    global _worker_bucket
+
+    # every worker process needs its own database connections
+    connections.close_all()
+    _worker_bucket = buckets.get()
+
+
+def get_pool(workers):
+    """
+    Returns a pool of worker processes, each of which adds its hidden pages to its own version bucket
+    """
+    context = multiprocessing.get_context('fork')
+    buckets = context.Queue()
+    for i in range(workers):
+        buckets.put(BUCKET_NAME.format(i + 1))
+    # forked workers must not share the connections of this process
+    connections.close_all()
+    return context.Pool(workers, initializer=_init_worker, initargs=(buckets,))
+
+
+def _revise_partition(args):
+    """
+    Versions the drafts of one partition in the version bucket of this worker
+    :return: (partition name, number of processed pages or None if the partition failed)
+    """
+    from .models import BatchRun
+
+    name, partition, languages, chunk_size, user_id = args
+    finished = BatchRun.objects.filter(name=name, finished__isnull=False).first()
+    if finished:
+        # this partition has been completed by an earlier, interrupted parallel run
+        return name, 0
+
+    user = None
+    if user_id:
+        from django.contrib.auth import get_user_model
+        user = get_user_model().objects.get(pk=user_id)
+
+    try:
+        with current_user(user):
+            run = revise_pages(name=name, languages=languages, chunk_size=chunk_size, partition=partition,
+                               bucket=_worker_bucket)
+    except Exception:
+        # the checkpoint of the partition is kept, the next run continues it
+        logger.exception('Versioning of partition %s failed', name)
+        return name, None
+    return name, run.processed
+
+
+def revise_pages_parallel(name='default', site=None, languages=None, chunk_size=BATCH_CHUNK_SIZE, workers=2,
+                          restart=False, callback=None):
+    """
+    Like revise_pages, but the partitions of the page tree (see get_partitions) are versioned in a pool of worker
+    processes. Every partition has its own checkpoint named '<name>/<site>/<path>'.
+    Every worker adds the hidden pages to its own bucket under the version root of the site, so the workers
+    neither wait for each other on the version root's tree node nor collide on tree paths.
+    :param callback: called with the run, the number of pages processed by this call and the elapsed seconds
+                     after every partition
+    :return: the BatchRun with the totals of all partitions
+    """
+    from .models import BatchRun
+    from .utils import get_or_create_version_bucket
+
+    run, created = BatchRun.objects.get_or_create(name=name)
+    partition_runs = BatchRun.objects.filter(name__startswith='{}/'.format(name))
+    if restart or run.finished:
+        run.reset()
+        partition_runs.delete()
+
+    user = get_current_user()
+    partitions = get_partitions(site=site, workers=workers)
+    workers = min(workers, len(partitions)) or 1
+
+    # create the version roots and buckets up front, so the workers do not have to
+    sites = Site.objects.filter(pk__in=set(partition['site'] for partition in partitions))
+    for partition_site in sites:
+        with current_user(user):
+            for i in range(workers):
+                get_or_create_version_bucket(partition_site, BUCKET_NAME.format(i + 1), user)
+
+    # the largest partitions first (see get_partitions)
+    tasks = [('{}/{}/{}{}'.format(name, partition['site'], partition['path'], '' if partition['descendants'] else '.'),
+              partition, languages, chunk_size, getattr(user, 'pk', None)) for partition in partitions]
+
+    started = time.time()
+    processed = 0
+    failed = 0
+    pool = get_pool(workers)
+    try:
+        for partition_name, partition_processed in pool.imap_unordered(_revise_partition, tasks):
+            if partition_processed is None:
+                failed += 1
+            else:
+                processed += partition_processed
+            totals = partition_runs.aggregate(processed=Sum('processed'), created=Sum('created'),
+                                              skipped=Sum('skipped'), errors=Sum('errors'))
+            for key, value in totals.items():
+                setattr(run, key, value or 0)
+            run.save()
+            if callback:
+                callback(run, processed, time.time() - started)
+    finally:
+        pool.close()
+        pool.join()
+
+    if not failed:
+        run.finished = timezone.now()
+        run.save(update_fields=['finished'])
+    return run
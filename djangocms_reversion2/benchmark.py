@@ -0,0 +1,304 @@
+"""
+Benchmarks of the snapshot, revert, diff and tree operations on a synthetic site (see the reversion2_benchmark
+management command).
+Every operation is measured for its wall time, its number of queries and the peak of the memory it allocates.
+tracemalloc slows down the allocations, so the operations run twice: once timed and once with tracemalloc.
+The report is a JSON document which can be compared with the report of an earlier run (see compare_reports).
+"""
+import platform
+import random
+import time
+import tracemalloc
+
+from cms.api import add_plugin, create_page, create_title
+from cms.models import Page, Title
+from cms.utils.conf import get_cms_setting
+from cms.utils.i18n import get_language_list
+from cms.utils.permissions import current_user
+from django.db import connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .synthetic import random_text
+
+# metrics of a sample which are summarized and compared
+METRICS = ('wall_time', 'queries', 'peak_memory')
+
+# larger sites are seeded with the bulk generator of synthetic.py instead of cms.api
+BULK_SEED_PAGES = 50
+
+
+def seed_site(site, user, pages=10, languages=1, plugins=5, versions=3, seed=0):
+    """
+    Creates pages with text plugins in every placeholder and versions of every page and language;
+    between two versions a random plugin of each placeholder is changed
+    :return: the drafts of the created pages
+    """
+    from .models import PageVersion
+    from .signals import make_page_version_dirty
+
+    rng = random.Random(seed)
+    site_languages = get_language_list(site.pk)[:languages]
+    template = get_cms_setting('TEMPLATES')[0][0]
+    drafts = []
+    for i in range(pages):
+        draft = create_page('benchmark {}'.format(i), template, site_languages[0], site=site, created_by=user)
+        for language in site_languages[1:]:
+            create_title(language, 'benchmark {} {}'.format(i, language), draft)
+        placeholders = list(draft.rescan_placeholders().values())
+        for language in site_languages:
+            texts = [[add_plugin(placeholder, 'TextPlugin', language, body=random_text(rng))
+                      for j in range(plugins)] for placeholder in placeholders]
+            for version in range(versions):
+                if version:
+                    for placeholder_texts in texts:
+                        change_text(rng.choice(placeholder_texts), rng)
+                    make_page_version_dirty(draft, language)
+                # cms.api.create_page resets the thread local user
+                with current_user(user):
+                    PageVersion.create_version(draft, language, version_parent=None)
+        drafts.append(draft)
+    return drafts
+
+
+def bulk_seed_site(site, user, pages=10, languages=1, plugins=5, versions=3, seed=0):
+    """
+    Like seed_site, but the rows are written in bulk (see synthetic.Generator)
+    :return: the drafts of the created pages
+    """
+    from . import registry
+    from .synthetic import Generator
+
+    generator = Generator(user, languages=languages, plugins=plugins, pictures=0, versions=versions, seed=seed)
+    generator.add_site(site, pages=pages, deleted=0)
+    generator.writer.sync()
+    drafts = Page.objects.drafts().filter(node__site=site, title_set__title__startswith='Synthetic page')
+    return list(registry.exclude_special_pages(drafts).distinct().order_by('pk'))
+
+
+def change_text(plugin, rng):
+    plugin = plugin.get_bound_plugin()
+    plugin.body = random_text(rng)
+    plugin.save()
+
+
+def measure(func, *args, **kwargs):
+    """
+    Calls func once and times it
+    :return: (the result of func, {'wall_time': seconds, 'queries': number})
+    """
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        result = func(*args, **kwargs)
+        wall_time = time.time() - start
+    return result, {'wall_time': wall_time, 'queries': len(queries)}
+
+
+def measure_memory(func, *args, **kwargs):
+    """
+    Calls func once with tracemalloc, which slows it down (see measure)
+    :return: (the result of func, {'peak_memory': bytes})
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, {'peak_memory': peak_memory}
+
+
+def summarize(samples):
+    """
+    :return: {metric: {'total', 'mean', 'median', 'min', 'max'}} of a list of samples
+    """
+    summary = {'samples': len(samples)}
+    for metric in METRICS:
+        values = sorted(sample[metric] for sample in samples if metric in sample)
+        if not values:
+            continue
+        summary[metric] = {
+            'total': sum(values),
+            'mean': float(sum(values)) / len(values),
+            'median': values[len(values) // 2],
+            'min': values[0],
+            'max': values[-1],
+        }
+    return summary
+
+
+def get_request(user, language, path='/', data=None):
+    request = RequestFactory().get(path, data or {})
+    request.user = user
+    request.session = {}
+    request.LANGUAGE_CODE = language
+    return request
+
+
+class Benchmark(object):
+    """
+    Runs the benchmarks on a site which has been seeded with seed_site
+    """
+
+    def __init__(self, site, user, drafts):
+        self.site = site
+        self.user = user
+        self.drafts = drafts
+        self.languages = get_language_list(site.pk)
+        self.rng = random.Random(len(drafts))
+        self.samples = {}
+        # the memory pass adds the peak memory to the samples of the timed pass
+        self.memory_pass = False
+        self.memory_samples = {}
+
+    def run(self, name, func, *args, **kwargs):
+        if not self.memory_pass:
+            result, sample = measure(func, *args, **kwargs)
+            self.samples.setdefault(name, []).append(sample)
+            return result
+        result, memory = measure_memory(func, *args, **kwargs)
+        index = self.memory_samples.get(name, 0)
+        self.memory_samples[name] = index + 1
+        self.samples[name][index].update(memory)
+        return result
+
+    def run_all(self):
+        for memory_pass in (False, True):
+            self.memory_pass = memory_pass
+            for name in ('create_version', 'diff_view', 'revert_page', 'template_tags', 'get_tree_rows',
+                         'search_index_queryset'):
+                getattr(self, 'benchmark_{}'.format(name))()
+        return {name: summarize(samples) for name, samples in self.samples.items()}
+
+    def get_languages(self, draft):
+        return [language for language in self.languages if language in draft.get_languages()]
+
+    def benchmark_create_version(self):
+        from .models import PageVersion
+        from .signals import make_page_version_dirty
+
+        with current_user(self.user):
+            for draft in self.drafts:
+                for language in self.get_languages(draft):
+                    plugin = draft.placeholders.first().get_plugins(language).first()
+                    change_text(plugin, self.rng)
+                    make_page_version_dirty(draft, language)
+                    self.run('create_version', PageVersion.create_version, draft, language, version_parent=None)
+
+    def benchmark_diff_view(self):
+        from django.contrib import admin
+        from .models import PageVersion
+
+        model_admin = admin.site._registry[PageVersion]
+        for draft in self.drafts:
+            for language in self.get_languages(draft):
+                # the oldest version against the draft
+                version = PageVersion.objects.filter(draft=draft, language=language).order_by('pk').first()
+                request = get_request(self.user, language, data={'language': language})
+                with current_user(self.user):
+                    response = self.run('diff_view', model_admin.diff_view, request, page_pk=draft.pk,
+                                        left_pk=version.pk, right_pk=0)
+                if response.status_code != 200:
+                    raise RuntimeError('The diff view of page {} responded with {}'.format(
+                        draft.pk, response.status_code))
+
+    def benchmark_revert_page(self):
+        from .models import PageVersion
+        from .utils import revert_page
+
+        with current_user(self.user):
+            for draft in self.drafts:
+                for language in self.get_languages(draft):
+                    version = PageVersion.objects.filter(draft=draft, language=language).order_by('pk').first()
+                    self.run('revert_page', revert_page, version, language)
+
+    def benchmark_template_tags(self):
+        from .templatetags import reversion2_tags
+
+        for draft in self.drafts:
+            for language in self.get_languages(draft):
+                request = get_request(self.user, language)
+                request.current_page = draft
+                context = {'request': request}
+
+                def render_tags():
+                    list(reversion2_tags.page_version_list(context)['page_versions'])
+                    list(reversion2_tags.page_versions(context))
+                    reversion2_tags.has_page_versions(context)
+                    reversion2_tags.current_page_version(context)
+
+                self.run('template_tags', render_tags)
+
+    def benchmark_get_tree_rows(self):
+        from django.contrib import admin
+        from .pageadmin import PageAdmin2
+
+        model_admin = PageAdmin2(Page, admin.site)
+        for language in self.languages[:1]:
+            request = get_request(self.user, language, path='/admin/cms/page/get-tree/')
+            pages = Page.objects.drafts().filter(node__site=self.site).select_related('node')
+
+            def render_rows():
+                return ''.join(model_admin.get_tree_rows(request, model_admin._prefetch_tree_titles(pages, self.site),
+                                                         language))
+
+            with current_user(self.user):
+                self.run('get_tree_rows', render_rows)
+
+    def benchmark_search_index_queryset(self):
+        from . import registry
+
+        # the queryset of search_indexes.NEW_TitleIndex without aldryn_search's base queryset
+        for language in self.languages:
+            titles = Title.objects.filter(language=language, publisher_is_draft=False)
+            self.run('search_index_queryset', lambda: list(
+                registry.exclude_special_pages(titles, node_field='page__node').values_list('pk', flat=True)))
+
+
+def run_benchmarks(site, user, pages=10, languages=1, plugins=5, versions=3, seed=0):
+    """
+    Seeds the site and runs the benchmarks
+    :return: the report
+    """
+    bulk_seed = pages > BULK_SEED_PAGES
+    drafts, seed_sample = measure(bulk_seed_site if bulk_seed else seed_site, site, user, pages=pages,
+                                  languages=languages, plugins=plugins, versions=versions, seed=seed)
+    return {
+        'meta': get_meta(),
+        'size': {'pages': pages, 'languages': languages, 'plugins': plugins, 'versions': versions, 'seed': seed,
+                 'bulk_seed': bulk_seed},
+        'seed_site': seed_sample,
+        'operations': Benchmark(site, user, drafts).run_all(),
+    }
+
+
+def get_meta():
+    import cms
+    import django
+    from . import __version__
+
+    return {
+        'date': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'cms': cms.__version__,
+        'reversion2': __version__,
+    }
+
+
+def compare_reports(old, new, statistic='median'):
+    """
+    :return: list of (operation, metric, old value, new value, new / old) of the operations in both reports
+    """
+    comparison = []
+    for name in sorted(set(old['operations']) & set(new['operations'])):
+        for metric in METRICS:
+            old_value = old['operations'][name].get(metric, {}).get(statistic)
+            new_value = new['operations'][name].get(metric, {}).get(statistic)
+            if old_value is None or new_value is None:
+                continue
+            ratio = float(new_value) / old_value if old_value else None
+            comparison.append((name, metric, old_value, new_value, ratio))
+    return comparison
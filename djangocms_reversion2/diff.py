@@ -1,10 +1,30 @@
+import hashlib
+import json
 import re
+import time
 
 from bs4 import BeautifulSoup
-from cms.models import Placeholder
 from cms.plugin_rendering import ContentRenderer
+from django.core.cache import cache
+from django.db.models import Q
 from sekizai.context import SekizaiContext
-from .settings import REVERSION2_DIFF_TEXT_ONLY, REVERSION2_IGNORE_WHITESPACE
+
+from . import registry, text_diff
+from .settings import (REVERSION2_DIFF_ENGINE, REVERSION2_DIFF_MAX_COST, REVERSION2_DIFF_MAX_SIZE,
+                       REVERSION2_DIFF_MODE, REVERSION2_DIFF_PLACEHOLDER_TIMEOUT, REVERSION2_DIFF_TEXT_ONLY,
+                       REVERSION2_DIFF_TIME_BUDGET, REVERSION2_IGNORE_WHITESPACE)
+from .storage import EMPTY_FINGERPRINT, get_page_fingerprints
+
+# rendered placeholders of pages which are not versions (i.e. drafts) are kept in the django cache
+RENDER_CACHE_KEY = 'djangocms_reversion2:placeholder:{page}:{generation}:{digest}'
+RENDER_GENERATION_KEY = 'djangocms_reversion2:placeholder-generation:{page}'
+# the html of a page depends on other pages as well (e.g. links), every saved page or title invalidates all drafts
+RENDER_PAGES_GENERATION_KEY = 'djangocms_reversion2:placeholder-generation:pages'
+RENDER_CACHE_TIMEOUT = 60 * 60
+FINGERPRINT_CACHE_KEY = 'djangocms_reversion2:fingerprints:{page}:{generation}:{language}'
+
+# content of a placeholder whose plugins are the same on both pages
+UNCHANGED_CONTENT = {'left': '', 'right': '', 'diff_right_to_left': '', 'unchanged': True}
 
 # import diff_match_patch as dmp
 # from tablib.packages import markup
@@ -22,44 +42,323 @@ def revert_escape(txt, transform=True):
     return html
 
 
-def create_placeholder_contents(left_page, right_page, request, language):
-    # persist rendered html content for each placeholder for later use in diff
-    placeholders_a = Placeholder.objects.filter(page=left_page.pk).order_by('slot')
-    placeholders_b = Placeholder.objects.filter(page=right_page.pk).order_by('slot')
-    slots = set()
-    for p in placeholders_a or placeholders_b:
-        slots.add(p.slot)
-    placeholders = {x: (placeholders_a.get(slot=x) if placeholders_a.filter(slot=x).exists() else None,
-                        placeholders_b.get(slot=x) if placeholders_b.filter(slot=x).exists() else None)
-                    for x in slots}
+def create_placeholder_contents(left_page, right_page, request, language, mode=None, time_budget=None):
+    """
+    :param time_budget: see diff_slots, defaults to REVERSION2_DIFF_TIME_BUDGET
+    """
+    if (mode or REVERSION2_DIFF_MODE) == 'structure':
+        from .plugin_diff import diff_pages
+        return diff_pages(left_page, right_page, request, language)
+
+    placeholders_a, placeholders_b, slots, unchanged = get_slots(left_page, right_page, language)
+    html_a = render_placeholders(left_page, [placeholder for slot, placeholder in placeholders_a.items()
+                                             if slot not in unchanged], language)
+    html_b = render_placeholders(right_page, [placeholder for slot, placeholder in placeholders_b.items()
+                                              if slot not in unchanged], language)
+    texts = {key: (html_a.get(key, ''), html_b.get(key, '')) for key in slots if key not in unchanged}
+    slot_diffs = diff_slots(texts, time_budget=time_budget)
     diffs = {}
-    for key, (p1, p2) in placeholders.items():
-        body1 = placeholder_html(p1, request, language)
-        body2 = placeholder_html(p2, request, language)
-        diff = diff_texts(body1, body2)
+    for key in slots:
+        if key in unchanged:
+            diffs[key] = dict(UNCHANGED_CONTENT)
+            continue
+        body1, body2 = texts[key]
         diffs[key] = {'left': body1, 'right': body2,
-                      'diff_right_to_left': diff}
+                      'diff_right_to_left': slot_diffs.get(key, body2),
+                      'timed_out': key not in slot_diffs}
+
+    return diffs
+
+
+def iter_placeholder_contents(left_page, right_page, request, language, mode=None, time_budget=None):
+    """
+    Like create_placeholder_contents, but the placeholders are rendered and diffed one at a time
+    :return: iterator of (slot, content), in slot order
+    """
+    if (mode or REVERSION2_DIFF_MODE) == 'structure':
+        from .plugin_diff import diff_pages
+        for slot, content in sorted(diff_pages(left_page, right_page, request, language).items()):
+            yield slot, content
+        return
+
+    if time_budget is None:
+        time_budget = REVERSION2_DIFF_TIME_BUDGET
+    started = time.time()
+    placeholders_a, placeholders_b, slots, unchanged = get_slots(left_page, right_page, language)
+    # the plugins are small compared to the html, they are loaded up front
+    left_request = get_render_request(left_page, language)
+    right_request = get_render_request(right_page, language)
+    prefetch_plugins(left_page, [placeholders_a[slot] for slot in placeholders_a if slot not in unchanged],
+                     left_request, language)
+    prefetch_plugins(right_page, [placeholders_b[slot] for slot in placeholders_b if slot not in unchanged],
+                     right_request, language)
+    for slot in slots:
+        if slot in unchanged:
+            yield slot, dict(UNCHANGED_CONTENT)
+            continue
+        body1 = render_placeholders(left_page, [placeholders_a[slot]] if slot in placeholders_a else [],
+                                    language, request=left_request).get(slot, '')
+        body2 = render_placeholders(right_page, [placeholders_b[slot]] if slot in placeholders_b else [],
+                                    language, request=right_request).get(slot, '')
+        timed_out = bool(time_budget) and time.time() - started > time_budget
+        deadline = started + time_budget if time_budget else None
+        yield slot, {'left': body1, 'right': body2,
+                     'diff_right_to_left': body2 if timed_out else diff_texts(body1, body2, deadline=deadline),
+                     'timed_out': timed_out}
+
+
+def get_slots(left_page, right_page, language):
+    """
+    :return: ({slot: left placeholder}, {slot: right placeholder}, sorted slots of both pages,
+              set of the slots whose plugins are the same on both pages)
+    """
+    placeholders_a = {placeholder.slot: placeholder for placeholder in left_page.placeholders.all()}
+    placeholders_b = {placeholder.slot: placeholder for placeholder in right_page.placeholders.all()}
+    # slots which exist on one side only are compared with an empty placeholder
+    slots = sorted(set(placeholders_a.keys()) | set(placeholders_b.keys()))
+
+    # placeholders with the same plugins are neither rendered nor diffed
+    fingerprints_a = get_fingerprints(left_page, language)
+    fingerprints_b = get_fingerprints(right_page, language)
+    unchanged = set()
+    if fingerprints_a is not None and fingerprints_b is not None:
+        for slot in slots:
+            fingerprint = fingerprints_a.get(slot, EMPTY_FINGERPRINT)
+            # the placeholders with plugins of custom relations have no fingerprint and are always diffed
+            if fingerprint is not None and fingerprint == fingerprints_b.get(slot, EMPTY_FINGERPRINT):
+                unchanged.add(slot)
+    return placeholders_a, placeholders_b, slots, unchanged
+
 
+def get_fingerprints(page, language):
+    """
+    Returns the placeholder fingerprints of a page (see storage.fingerprint_plugins).
+    Versions store them when they are created, the fingerprints of other pages are cached like their html.
+    :return: {slot: fingerprint} or None if they are not known (i.e. versions which have not been materialized)
+    """
+    from .models import PageVersion
+
+    if registry.classify_page(page) == registry.VERSION_ROOT:
+        page_version = PageVersion.objects.filter(hidden_page=page).only('pk', 'fingerprints', 'materialized')\
+            .first()
+        if not page_version:
+            return None
+        if page_version.fingerprints:
+            return json.loads(page_version.fingerprints)
+        if not page_version.materialized:
+            return None
+        # versions created before the fingerprints
+        fingerprints = get_page_fingerprints(page, language)
+        PageVersion.objects.filter(pk=page_version.pk).update(fingerprints=json.dumps(fingerprints))
+        return fingerprints
+
+    generation = get_generation(RENDER_GENERATION_KEY.format(page=page.pk))
+    key = FINGERPRINT_CACHE_KEY.format(page=page.pk, generation=generation, language=language)
+    fingerprints = cache.get(key)
+    if fingerprints is None:
+        fingerprints = get_page_fingerprints(page, language)
+        cache.set(key, fingerprints, RENDER_CACHE_TIMEOUT)
+    return fingerprints
+
+
+def diff_slots(texts, time_budget=None):
+    """
+    Diffs the rendered placeholders of two pages, one after another.
+    :param texts: {slot: (left html, right html)}
+    :param time_budget: seconds, the slots which are not diffed by then are left out (0: no limit).
+        The token and block diff stop at the end of the budget as well (see diff_texts), htmldiff cannot be
+        interrupted and finishes the slot it has started.
+    :return: {slot: diff html}
+    """
+    if time_budget is None:
+        time_budget = REVERSION2_DIFF_TIME_BUDGET
+    deadline = time.time() + time_budget if time_budget else None
+
+    diffs = {}
+    for key, (body1, body2) in texts.items():
+        if deadline and time.time() > deadline:
+            break
+        diffs[key] = diff_texts(body1, body2, deadline=deadline)
     return diffs
 
 
-def placeholder_html(placeholder, request, language):
+def placeholder_html(placeholder, request, language, page=None):
+    """
+    :param page: the page of the placeholder, its plugins have been prefetched (see prefetch_plugins)
+    """
     if not placeholder:
         return ''
-    if hasattr(placeholder, '_plugins_cache'):
-        del placeholder._plugins_cache
+    if page is None:
+        if hasattr(placeholder, '_plugins_cache'):
+            del placeholder._plugins_cache
+        page = placeholder.page
 
     renderer = ContentRenderer(request)
     context = SekizaiContext({
         'request': request,
         'cms_content_renderer': renderer,
-        'CMS_TEMPLATE': placeholder.page.get_template
+        'CMS_TEMPLATE': page.get_template
     })
 
     return renderer.render_placeholder(placeholder, context, language=language).strip()
 
 
-def diff_texts(text1, text2):
+def prefetch_plugins(page, placeholders, request, language):
+    """
+    Loads the downcasted plugin trees of all placeholders with one query per plugin type
+    """
+    from cms.utils.plugins import assign_plugins
+
+    placeholders = [placeholder for placeholder in placeholders if not hasattr(placeholder, '_plugins_cache')]
+    assign_plugins(request, placeholders, page.get_template(), language)
+
+
+def render_placeholders(page, placeholders, language, request=None):
+    """
+    Renders the placeholders of a page (see placeholder_html) through a cache.
+    The hidden page of a version never changes: its html is rendered once and stored in the database.
+    The html of other pages is kept in the django cache until their placeholders change
+    (see invalidate_rendered_placeholders) or any page or title is saved (see invalidate_rendered_drafts).
+    The plugins of all placeholders which are not cached are prefetched together.
+    The html is shared by all users, so it is rendered anonymously without the toolbar of the view.
+    :param request: an anonymous request of the page (see get_render_request)
+    :return: {slot: html}
+    """
+    from .models import RenderedPlaceholder
+
+    template = page.get_template()
+    request = request or get_render_request(page, language)
+    if registry.classify_page(page) == registry.VERSION_ROOT:
+        rendered = dict(RenderedPlaceholder.objects.filter(page=page, language=language, template=template)
+                        .values_list('slot', 'html'))
+        missing = [placeholder for placeholder in placeholders if placeholder.slot not in rendered]
+        prefetch_plugins(page, missing, request, language)
+        new_rows = []
+        for placeholder in missing:
+            html = placeholder_html(placeholder, request, language, page=page)
+            new_rows.append(RenderedPlaceholder(page=page, slot=placeholder.slot, language=language,
+                                                template=template, html=html))
+            rendered[placeholder.slot] = html
+        # rows rendered by a concurrent request are kept
+        RenderedPlaceholder.objects.bulk_create(new_rows, ignore_conflicts=True)
+        return rendered
+
+    generation = '{}-{}'.format(get_generation(RENDER_GENERATION_KEY.format(page=page.pk)),
+                                get_generation(RENDER_PAGES_GENERATION_KEY))
+    keys = {}
+    for placeholder in placeholders:
+        digest = hashlib.md5('{}:{}:{}'.format(placeholder.slot, language, template).encode('utf-8')).hexdigest()
+        keys[RENDER_CACHE_KEY.format(page=page.pk, generation=generation, digest=digest)] = placeholder
+    rendered = cache.get_many(keys.keys())
+    missing = [key for key in keys if key not in rendered]
+    prefetch_plugins(page, [keys[key] for key in missing], request, language)
+    missing = {key: placeholder_html(keys[key], request, language, page=page) for key in missing}
+    if missing:
+        cache.set_many(missing, RENDER_CACHE_TIMEOUT)
+        rendered.update(missing)
+    return {keys[key].slot: html for key, html in rendered.items()}
+
+
+def get_generation(key):
+    """
+    A generation counter starts at the current time in microseconds, so that it never restarts at a generation of
+    cached entries after its key has been evicted (see registry.get_roots)
+    """
+    return cache.get_or_set(key, lambda: int(time.time() * 1000000), None)
+
+
+def invalidate_rendered_drafts():
+    """
+    Drops the cached html of the placeholders of all drafts, e.g. after a page or title has been saved
+    """
+    try:
+        cache.incr(RENDER_PAGES_GENERATION_KEY)
+    except ValueError:
+        # nothing has been cached yet
+        pass
+
+
+def invalidate_rendered_placeholders(page):
+    """
+    Drops the cached html of the placeholders of a page
+    """
+    from .models import PageVersionDiff, RenderedPlaceholder
+
+    try:
+        cache.incr(RENDER_GENERATION_KEY.format(page=page.pk))
+    except ValueError:
+        # nothing has been cached yet
+        pass
+    # only the hidden pages of versions have rendered rows and stored diffs, drafts are not looked up
+    if registry.classify_page(page) == registry.VERSION_ROOT:
+        RenderedPlaceholder.objects.filter(page=page).delete()
+        PageVersionDiff.objects.filter(Q(page_version__hidden_page=page) | Q(base__hidden_page=page)).delete()
+
+
+def get_render_request(page, language):
+    """
+    Anonymous request to render the placeholders of a page for the cache (see render_placeholders) or outside of a
+    view (i.e. in a worker)
+    """
+    from django.contrib.auth.models import AnonymousUser
+    from django.test.client import RequestFactory
+
+    request = RequestFactory().get(page.get_absolute_url(language=language) or '/')
+    request.user = AnonymousUser()
+    request.session = {}
+    request.current_page = page
+    request.LANGUAGE_CODE = language
+    return request
+
+
+def compute_version_diff(page_version, request=None):
+    """
+    Computes and stores the diff between a page version and its parent
+    :return: the PageVersionDiff or None for a version without parent
+    """
+    from .models import PageVersionDiff
+    from .storage import materialize
+
+    base = page_version.parent
+    if not base:
+        return None
+    left_page = materialize(base)
+    right_page = materialize(page_version)
+    request = request or get_render_request(right_page, page_version.language)
+    # the stored diff is complete, the time budget is for the views
+    diffs = create_placeholder_contents(left_page, right_page, request, page_version.language, time_budget=0)
+
+    changed = [diff['diff_right_to_left'] for diff in diffs.values() if diff['left'] != diff['right']]
+    precomputed_diff, created = PageVersionDiff.objects.update_or_create(page_version=page_version, defaults={
+        'base': base,
+        'diffs': json.dumps(diffs),
+        'changed_slots': len(changed),
+        'insertions': sum(diff.count('<ins>') for diff in changed),
+        'deletions': sum(diff.count('<del>') for diff in changed),
+    })
+    return precomputed_diff
+
+
+def get_precomputed_diffs(base, page_version):
+    """
+    Returns the stored diffs between two page versions (see create_placeholder_contents)
+    or None if they have not been computed
+    """
+    from .models import PageVersionDiff
+
+    precomputed_diff = PageVersionDiff.objects.filter(page_version=page_version, base=base).first()
+    if precomputed_diff:
+        return precomputed_diff.get_diffs()
+    return None
+
+
+def diff_texts(text1, text2, engine=None, deadline=None):
+    """
+    :param engine: 'htmldiff' or 'tokens', defaults to REVERSION2_DIFF_ENGINE
+    :param deadline: time.time() by which the diff has to be done (i.e. the end of the time budget of the view).
+        htmldiff cannot be stopped, so the token diff is used instead, which degrades to a block diff and finally
+        to the replaced html when the time is up.
+    """
     # differ = dmp.diff_match_patch()
 
     # Remove HTML tags and duplicate \n if specified (helps to ignore diff plugin ids)
@@ -76,6 +375,15 @@ def diff_texts(text1, text2):
     #
     # diffs = revert_escape(differ.diff_prettyHtml(diffs))
 
+    engine = engine or REVERSION2_DIFF_ENGINE
+    if REVERSION2_DIFF_PLACEHOLDER_TIMEOUT:
+        placeholder_deadline = time.time() + REVERSION2_DIFF_PLACEHOLDER_TIMEOUT
+        deadline = min(deadline, placeholder_deadline) if deadline else placeholder_deadline
+    if len(text1) + len(text2) > REVERSION2_DIFF_MAX_SIZE:
+        return text_diff.block_diff(text1, text2, max_cost=REVERSION2_DIFF_MAX_COST, deadline=deadline)
+    if engine == 'tokens':
+        return text_diff.token_diff(text1, text2, max_cost=REVERSION2_DIFF_MAX_COST, deadline=deadline)
+
     from lxml.html.diff import htmldiff
     diffs = htmldiff(text1, text2)
 
@@ -1,14 +1,11 @@
 
-from __future__ import unicode_literals
-
 from cms.api import publish_page
 from cms.models import User
 from django import forms
-from six import string_types
 from versionfield.widgets import VersionWidget
 
-from djangocms_reversion2.settings import VERSION_START_VALUE, ALLOW_BLANK_TITLE, BIN_ROOT_TITLE, \
-    VERSION_ROOT_TITLE, ALLOW_VERSION_EDIT
+from djangocms_reversion2 import registry
+from djangocms_reversion2.settings import VERSION_START_VALUE, ALLOW_BLANK_TITLE, ALLOW_VERSION_EDIT
 from djangocms_reversion2.models import PageVersion
 
 
@@ -49,14 +46,14 @@ class PageVersionForm(forms.ModelForm):
         language = data.get('language', '')
 
         # Detect case when editing version
-        is_version_page = draft.get_root().title_set.filter(title__in=[BIN_ROOT_TITLE, VERSION_ROOT_TITLE]).exists()
+        is_version_page = registry.classify_page(draft) is not None
         if not is_version_page:
 
             # Publish page first...
             if hasattr(self, 'publish_on_save') and self.publish_on_save:
                 from cms.utils.permissions import get_current_user
                 user = get_current_user()
-                if isinstance(user, string_types):
+                if isinstance(user, str):
                     user = User.objects.get(username=user)
                 publish_page(draft, user, language)
 
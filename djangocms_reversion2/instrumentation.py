@@ -0,0 +1,145 @@
+"""
+Instrumentation of the main operations (snapshot, copy and publish of the hidden page, revert, diff, bin move and
+tree render): every operation is timed and its queries and written rows are counted.
+The measurements are logged to this module's logger and sent with the operation_measured signal; an Aggregator
+collects their totals per operation in memory (see REVERSION2_AGGREGATE_MEASUREMENTS).
+Operations may be nested, the queries of the inner operations are counted by the outer ones as well.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT = 'snapshot'
+COPY_HIDDEN_PAGE = 'copy_hidden_page'
+PUBLISH_HIDDEN_PAGE = 'publish_hidden_page'
+REVERT = 'revert'
+DIFF = 'diff'
+BIN_MOVE = 'bin_move'
+TREE_RENDER = 'tree_render'
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+# sent after every instrumented operation, also if it failed
+operation_measured = Signal(providing_args=['measurement'])
+
+
+class Measurement(object):
+    """
+    The duration, the number of queries and of written rows of one operation.
+    It is the execute wrapper of the connection while the operation runs.
+    """
+
+    def __init__(self, operation, context):
+        self.operation = operation
+        self.context = context
+        self.duration = 0.0
+        self.queries = 0
+        self.rows_written = 0
+        self.failed = False
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        result = execute(sql, params, many, context)
+        if sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+            # -1 if the database does not know
+            self.rows_written += max(context['cursor'].rowcount, 0)
+        return result
+
+    def as_dict(self):
+        return {
+            'operation': self.operation,
+            'context': self.context,
+            'duration': self.duration,
+            'queries': self.queries,
+            'rows_written': self.rows_written,
+            'failed': self.failed,
+        }
+
+    def __str__(self):
+        context = ', '.join('{}={}'.format(key, value) for key, value in sorted(self.context.items()))
+        return '{}{} took {:.1f} ms, {} queries, {} rows written{}'.format(
+            self.operation, ' ({})'.format(context) if context else '', self.duration * 1000, self.queries,
+            self.rows_written, ' and failed' if self.failed else '')
+
+
+@contextmanager
+def instrument(operation, **context):
+    """
+    Measures the enclosed operation, can be used as decorator as well:
+
+        with instrument(SNAPSHOT, page=draft.pk, language=language) as measurement:
+            ...
+    """
+    measurement = Measurement(operation, context)
+    start = time.time()
+    try:
+        with connection.execute_wrapper(measurement):
+            yield measurement
+    except Exception:
+        measurement.failed = True
+        raise
+    finally:
+        measurement.duration = time.time() - start
+        logger.info('%s', measurement, extra={'measurement': measurement.as_dict()})
+        operation_measured.send(sender=Measurement, measurement=measurement)
+
+
+class Aggregator(object):
+    """
+    Sums up the measurements per operation while it is connected to operation_measured:
+
+        with Aggregator() as aggregator:
+            ...
+        aggregator.summary()
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def receive(self, sender, measurement, **kwargs):
+        with self.lock:
+            totals = self.totals.setdefault(measurement.operation, {
+                'count': 0, 'failed': 0, 'duration': 0.0, 'max_duration': 0.0, 'queries': 0, 'rows_written': 0})
+            totals['count'] += 1
+            totals['failed'] += int(measurement.failed)
+            totals['duration'] += measurement.duration
+            totals['max_duration'] = max(totals['max_duration'], measurement.duration)
+            totals['queries'] += measurement.queries
+            totals['rows_written'] += measurement.rows_written
+
+    def connect(self):
+        operation_measured.connect(self.receive, sender=Measurement, weak=False, dispatch_uid=id(self))
+
+    def disconnect(self):
+        operation_measured.disconnect(sender=Measurement, dispatch_uid=id(self))
+
+    def reset(self):
+        with self.lock:
+            self.totals = {}
+
+    def summary(self):
+        """
+        :return: {operation: {'count', 'failed', 'duration', 'max_duration', 'mean_duration', 'queries',
+                 'rows_written'}}, the durations are in seconds
+        """
+        with self.lock:
+            return {operation: dict(totals, mean_duration=totals['duration'] / totals['count'])
+                    for operation, totals in self.totals.items()}
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disconnect()
+
+
+# the aggregator of the process if REVERSION2_AGGREGATE_MEASUREMENTS is set (connected in apps.py)
+aggregator = Aggregator()
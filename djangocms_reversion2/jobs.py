@@ -0,0 +1,186 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from cms.utils.permissions import current_user
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# how many pending jobs are looked at when claiming the next job
+CLAIM_WINDOW = 20
+
+
+def enqueue_snapshot(draft, language, title='', comment='', version_id=None, user=None, published=False):
+    """
+    Records a request to create a PageVersion, which is processed by process_jobs
+    (i.e. with the reversion2_process_snapshots management command).
+    A pending job of the same draft and language is updated instead of recording another one, both would
+    snapshot the same state.
+    :param published: snapshot the public page when the job runs, so that changes made to the draft after the
+        publish are not part of the version
+    """
+    from .models import SnapshotJob
+
+    if user is not None and not getattr(user, 'pk', None):
+        # cms sets the username as current user while publishing
+        from cms.models import User
+        user = User.objects.filter(username=user).first()
+
+    draft = draft.get_draft_object()
+    values = dict(title=title, comment=comment, version_id=version_id, user=user, published=published)
+    pending = SnapshotJob.objects.filter(kind=SnapshotJob.SNAPSHOT, draft=draft, language=language,
+                                         state=SnapshotJob.PENDING).order_by('-pk').first()
+    # the job might have been claimed by a worker in the meantime
+    if pending and SnapshotJob.objects.filter(pk=pending.pk, state=SnapshotJob.PENDING).update(**values):
+        pending.refresh_from_db()
+        return pending
+    return SnapshotJob.objects.create(draft=draft, language=language, **values)
+
+
+def enqueue_snapshot_on_commit(draft, language, **kwargs):
+    transaction.on_commit(lambda: enqueue_snapshot(draft, language, **kwargs))
+
+
+def enqueue_diff(page_version):
+    """
+    Records a request to compute the diff between the page version and its parent
+    """
+    from .models import SnapshotJob
+
+    return SnapshotJob.objects.create(kind=SnapshotJob.DIFF, draft_id=page_version.draft_id,
+                                      language=page_version.language, page_version=page_version)
+
+
+def enqueue_diff_on_commit(page_version):
+    transaction.on_commit(lambda: enqueue_diff(page_version))
+
+
+def claim_next_job():
+    """
+    Marks the oldest pending job as running and returns it.
+    Jobs of the same draft and language are processed in the order they have been recorded: a job is only
+    claimed if there is neither a running nor an older pending job for its draft and language.
+    """
+    from .models import SnapshotJob
+
+    with transaction.atomic():
+        running = set(SnapshotJob.objects.filter(state=SnapshotJob.RUNNING).values_list('draft_id', 'language'))
+        pending = SnapshotJob.objects.filter(state=SnapshotJob.PENDING).order_by('pk')
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+
+        for job in pending[:CLAIM_WINDOW]:
+            if (job.draft_id, job.language) in running:
+                continue
+            # an older job might be locked by another worker
+            older = SnapshotJob.objects.filter(draft_id=job.draft_id, language=job.language,
+                                               state=SnapshotJob.PENDING, pk__lt=job.pk)
+            if older.exists():
+                continue
+            job.state = SnapshotJob.RUNNING
+            job.started = timezone.now()
+            job.attempts += 1
+            job.save(update_fields=['state', 'started', 'attempts'])
+            return job
+
+
+def run_job(job):
+    from .models import SnapshotJob
+
+    if job.kind == SnapshotJob.DIFF:
+        return run_diff_job(job)
+
+    from .models import PageVersion
+    from .signals import make_page_version_dirty
+
+    try:
+        source = None
+        if job.published:
+            source = job.draft.publisher_public
+            if not source or not job.draft.is_published(job.language):
+                raise AssertionError('page is not published')
+        with current_user(job.user), transaction.atomic():
+            page_version = PageVersion.create_version(job.draft, job.language,
+                                                      version_parent=None,
+                                                      title=job.title,
+                                                      comment=job.comment,
+                                                      version_id=job.version_id,
+                                                      source=source)
+            make_page_version_dirty(job.draft, job.language)
+    except AssertionError as e:
+        # AssertionError page is not dirty
+        job.state = SnapshotJob.SKIPPED
+        job.error = str(e)
+    except Exception:
+        logger.exception('Snapshot job %s failed', job.pk)
+        job.state = SnapshotJob.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.state = SnapshotJob.DONE
+        job.page_version = page_version
+    job.finished = timezone.now()
+    job.save(update_fields=['state', 'error', 'page_version', 'finished'])
+    return job
+
+
+def run_diff_job(job):
+    from .diff import compute_version_diff
+    from .models import SnapshotJob
+
+    try:
+        if not job.page_version:
+            raise AssertionError('page version has been deleted')
+        with transaction.atomic():
+            compute_version_diff(job.page_version)
+    except AssertionError as e:
+        job.state = SnapshotJob.SKIPPED
+        job.error = str(e)
+    except Exception:
+        logger.exception('Diff job %s failed', job.pk)
+        job.state = SnapshotJob.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.state = SnapshotJob.DONE
+    job.finished = timezone.now()
+    job.save(update_fields=['state', 'error', 'finished'])
+    return job
+
+
+def process_jobs(limit=None):
+    """
+    Processes pending snapshot jobs until there are none left (or limit jobs have been processed)
+    :return: number of processed jobs
+    """
+    num = 0
+    while limit is None or num < limit:
+        job = claim_next_job()
+        if not job:
+            break
+        run_job(job)
+        num += 1
+    return num
+
+
+def requeue_stale_jobs(timeout):
+    """
+    Resets jobs of crashed workers, which are running for longer than timeout seconds
+    """
+    from .models import SnapshotJob
+
+    started_before = timezone.now() - timedelta(seconds=timeout)
+    return SnapshotJob.objects.filter(state=SnapshotJob.RUNNING, started__lt=started_before)\
+        .update(state=SnapshotJob.PENDING)
+
+
+def run_worker(interval=5, limit=None, stale_timeout=None):
+    """
+    Polls for snapshot jobs until it is stopped
+    """
+    while True:
+        if stale_timeout:
+            requeue_stale_jobs(stale_timeout)
+        if not process_jobs(limit=limit):
+            time.sleep(interval)
@@ -0,0 +1,62 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from djangocms_reversion2 import registry
+from djangocms_reversion2.benchmark import compare_reports, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Seeds a synthetic site in a throwaway test database and times the snapshot, revert, diff and tree ' \
+           'operations. The report (wall time, queries and peak memory per operation) is written as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=10, help='Number of pages')
+        parser.add_argument('--languages', type=int, default=1, help='Number of languages of every page')
+        parser.add_argument('--plugins', type=int, default=5, help='Number of text plugins per placeholder')
+        parser.add_argument('--versions', type=int, default=3, help='Number of versions per page and language')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random contents')
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file')
+        parser.add_argument('--compare', default=None, metavar='REPORT',
+                            help='Compare the medians with the JSON report of an earlier run')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as report_file:
+                    previous = json.load(report_file)
+            except (IOError, ValueError) as e:
+                raise CommandError('Can not read the report "{}": {}'.format(options['compare'], e))
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # the cached registry belongs to the real database
+            registry.invalidate()
+            site = Site.objects.get_current()
+            user = get_user_model().objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+            report = run_benchmarks(site, user, pages=options['pages'], languages=options['languages'],
+                                    plugins=options['plugins'], versions=options['versions'], seed=options['seed'])
+        finally:
+            registry.invalidate()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                json.dump(report, report_file, indent=2, sort_keys=True)
+
+        self.stdout.write('{:<24}{:>10}{:>14}{:>10}{:>14}'.format('operation', 'samples', 'median [ms]',
+                                                                  'queries', 'memory [kB]'))
+        for name, summary in sorted(report['operations'].items()):
+            self.stdout.write('{:<24}{:>10}{:>14.1f}{:>10}{:>14.1f}'.format(
+                name, summary['samples'], summary['wall_time']['median'] * 1000, summary['queries']['median'],
+                summary['peak_memory']['median'] / 1024.0))
+
+        if previous:
+            self.stdout.write('\nChange of the medians since the earlier run:')
+            for name, metric, old_value, new_value, ratio in compare_reports(previous, report):
+                self.stdout.write('{:<24}{:<14}{:>10}'.format(
+                    name, metric, '{:+.0%}'.format(ratio - 1) if ratio is not None else 'n/a'))
@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from djangocms_reversion2.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = 'Generates synthetic pages with plugins, version histories and deleted pages in the bin for load tests ' \
+           'and profiling. The rows are written in batches to the current database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, default=1, help='Number of sites, missing sites are created')
+        parser.add_argument('--pages', type=int, default=100, help='Number of pages per site')
+        parser.add_argument('--depth', type=int, default=4, help='Maximal depth of the page trees')
+        parser.add_argument('--languages', type=int, default=1, help='Number of languages of every page')
+        parser.add_argument('--plugins', type=int, default=5, help='Number of text plugins per placeholder')
+        parser.add_argument('--pictures', type=float, default=0.2,
+                            help='Share of the text plugins with a nested picture plugin')
+        parser.add_argument('--versions', type=int, default=3, help='Number of versions per page and language')
+        parser.add_argument('--deleted', type=int, default=10, help='Number of deleted pages per site')
+        parser.add_argument('--buckets', type=int, default=1,
+                            help='The deleted pages are spread over the bin buckets of this many days')
+        parser.add_argument('--template', default=None, help='Template of the pages (default: the first template)')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random tree shapes and contents')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows per insert')
+        parser.add_argument('--user', default=None, help='Username of the author (default: the first superuser)')
+
+    def handle(self, *args, **options):
+        user_model = get_user_model()
+        if options['user']:
+            user = user_model.objects.filter(**{user_model.USERNAME_FIELD: options['user']}).first()
+        else:
+            user = user_model.objects.filter(is_superuser=True).order_by('pk').first()
+        if user is None:
+            raise CommandError('No user found, create a superuser or pass --user')
+        if options['buckets'] < 1:
+            raise CommandError('--buckets has to be at least 1')
+
+        def progress(site, num_pages):
+            self.stdout.write('{}: {} pages written'.format(site.domain, num_pages))
+
+        counts = generate(user, sites=options['sites'], pages=options['pages'], depth=options['depth'],
+                          languages=options['languages'], plugins=options['plugins'], pictures=options['pictures'],
+                          versions=options['versions'], deleted=options['deleted'], buckets=options['buckets'],
+                          template=options['template'], seed=options['seed'], batch_size=options['batch_size'],
+                          callback=progress)
+        for label, count in sorted(counts.items()):
+            self.stdout.write('{:<48}{:>10}'.format(label, count))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from djangocms_reversion2.jobs import process_jobs, requeue_stale_jobs, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Creates the page versions requested by deferred snapshot jobs (REVERSION2_DEFERRED_SNAPSHOTS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', default=False,
+                            help='Keep polling for new jobs instead of exiting when the queue is empty')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait between polls when the queue is empty (with --loop)')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Maximum number of jobs to process in one go')
+        parser.add_argument('--requeue-stale', type=int, default=None, metavar='SECONDS',
+                            help='Reset jobs which are running for longer than SECONDS (crashed workers)')
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            run_worker(interval=options['interval'], limit=options['limit'],
+                       stale_timeout=options['requeue_stale'])
+            return
+
+        if options['requeue_stale']:
+            requeued = requeue_stale_jobs(options['requeue_stale'])
+            self.stdout.write('{num} stale jobs requeued'.format(num=requeued))
+        num = process_jobs(limit=options['limit'])
+        self.stdout.write('{num} snapshot jobs processed'.format(num=num))
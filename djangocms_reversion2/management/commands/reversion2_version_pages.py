@@ -0,0 +1,73 @@
+from cms.utils.permissions import current_user
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from djangocms_reversion2.batch import revise_pages, revise_pages_parallel
+from djangocms_reversion2.settings import BATCH_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Creates an initial version of all unversioned pages. An interrupted run resumes where it stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default='command',
+                            help='Name of the run, the checkpoint is stored under this name')
+        parser.add_argument('--restart', action='store_true', default=False,
+                            help='Ignore the checkpoint and start from the first page')
+        parser.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE,
+                            help='Pages per transaction and checkpoint')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after this many pages (continue with the next call)')
+        parser.add_argument('--site', type=int, default=None, help='Only version the pages of this site id')
+        parser.add_argument('--language', action='append', dest='languages', default=None,
+                            help='Only version this language (can be given multiple times)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes which version branches of the page tree in parallel')
+        parser.add_argument('--user', default=None,
+                            help='Username of the versions owner, required to publish the hidden pages')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(**{get_user_model().USERNAME_FIELD: options['user']})
+            except get_user_model().DoesNotExist:
+                raise CommandError('User "{}" does not exist'.format(options['user']))
+        site = Site.objects.get(pk=options['site']) if options['site'] else None
+
+        if options['workers'] > 1:
+            if options['limit']:
+                raise CommandError('--limit can not be combined with --workers')
+            if connection.vendor == 'sqlite':
+                self.stderr.write('SQLite does not support concurrent writers, expect "database is locked" errors')
+            with current_user(user):
+                run = revise_pages_parallel(name=options['name'],
+                                            site=site,
+                                            languages=options['languages'],
+                                            chunk_size=options['chunk_size'],
+                                            workers=options['workers'],
+                                            restart=options['restart'],
+                                            callback=self.report)
+        else:
+            with current_user(user):
+                run = revise_pages(name=options['name'],
+                                   site=site,
+                                   languages=options['languages'],
+                                   chunk_size=options['chunk_size'],
+                                   limit=options['limit'],
+                                   restart=options['restart'],
+                                   callback=self.report)
+
+        if run.finished:
+            self.stdout.write('Finished: {created} versions created for {processed} pages'.format(
+                created=run.created, processed=run.processed))
+        else:
+            self.stdout.write('Stopped before all pages have been processed, run the command again to continue')
+
+    def report(self, run, processed, elapsed):
+        self.stdout.write('{processed} pages, {created} versions, {skipped} skipped, {errors} errors '
+                          '- {rate:.1f} pages/s'.format(processed=run.processed, created=run.created,
+                                                        skipped=run.skipped, errors=run.errors,
+                                                        rate=processed / elapsed if elapsed else 0))
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0007_auto_20180830_1549'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PluginBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=40, unique=True, verbose_name='Digest')),
+                ('plugin_type', models.CharField(max_length=50, verbose_name='Plugin type')),
+                ('data', models.TextField(help_text='JSON encoded plugin fields and child digests', verbose_name='Data')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddField(
+            model_name='pageversion',
+            name='materialized',
+            field=models.BooleanField(default=True, editable=False, help_text='The hidden page holds the plugins of this version.', verbose_name='Materialized'),
+        ),
+        migrations.AddField(
+            model_name='pageversion',
+            name='storage',
+            field=models.CharField(choices=[('copy', 'copy'), ('blob', 'blob')], default='copy', editable=False, help_text='How the plugins of this version are stored.', max_length=10, verbose_name='Storage'),
+        ),
+        migrations.CreateModel(
+            name='PageVersionPlaceholder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.CharField(max_length=255, verbose_name='Slot')),
+                ('plugins', models.TextField(default='[]', help_text='JSON encoded root plugin digests', verbose_name='Plugins')),
+                ('page_version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='placeholder_snapshots', to='djangocms_reversion2.PageVersion', verbose_name='Page Version')),
+            ],
+            options={
+                'default_permissions': (),
+                'unique_together': {('page_version', 'slot')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0008_pluginblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageversion',
+            name='keyframe',
+            field=models.BooleanField(default=True, editable=False, help_text='All placeholders are stored on this version. Delta versions only store the placeholders which differ from their parent.', verbose_name='Keyframe'),
+        ),
+        migrations.AlterField(
+            model_name='pageversion',
+            name='storage',
+            field=models.CharField(choices=[('copy', 'copy'), ('blob', 'blob'), ('delta', 'delta')], default='copy', editable=False, help_text='How the plugins of this version are stored.', max_length=10, verbose_name='Storage'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import versionfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0016_auto_20160608_1535'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('djangocms_reversion2', '0009_pageversion_keyframe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=20, verbose_name='Language')),
+                ('title', models.CharField(blank=True, max_length=63, verbose_name='Version Title')),
+                ('comment', models.TextField(blank=True, verbose_name='Version Comment')),
+                ('version_id', versionfield.fields.VersionField(blank=True, null=True, verbose_name='Version Id')),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('skipped', 'Skipped'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10, verbose_name='State')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Finished')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('draft', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot_jobs', to='cms.Page', verbose_name='Draft')),
+                ('page_version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='djangocms_reversion2.PageVersion', verbose_name='Page Version')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'default_permissions': (),
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0010_snapshotjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Name')),
+                ('last_page_id', models.PositiveIntegerField(default=0, help_text='All drafts up to this id have been processed.', verbose_name='Last page id')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Processed pages')),
+                ('created', models.PositiveIntegerField(default=0, verbose_name='Created versions')),
+                ('skipped', models.PositiveIntegerField(default=0, verbose_name='Skipped versions')),
+                ('errors', models.PositiveIntegerField(default=0, verbose_name='Errors')),
+                ('started', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Started')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Finished')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0011_batchrun'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='batchrun',
+            name='name',
+            field=models.CharField(max_length=255, unique=True, verbose_name='Name'),
+        ),
+    ]
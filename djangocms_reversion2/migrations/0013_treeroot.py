@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0016_auto_20160608_1535'),
+        ('sites', '0002_alter_domain_unique'),
+        ('djangocms_reversion2', '0012_batchrun_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TreeRoot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('version', 'version root'), ('bin', 'bin root'), ('bucket', 'bin bucket')], max_length=10, verbose_name='Kind')),
+                ('name', models.CharField(blank=True, default='', help_text='Title of a bin bucket.', max_length=255, verbose_name='Name')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cms.Page', verbose_name='Page')),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.Site', verbose_name='Site')),
+            ],
+            options={
+                'default_permissions': (),
+                'unique_together': {('site', 'kind', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0016_auto_20160608_1535'),
+        ('djangocms_reversion2', '0013_treeroot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderedPlaceholder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.CharField(max_length=255, verbose_name='Slot')),
+                ('language', models.CharField(max_length=20, verbose_name='Language')),
+                ('template', models.CharField(max_length=100, verbose_name='Template')),
+                ('html', models.TextField(blank=True, verbose_name='Html')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cms.Page', verbose_name='Page')),
+            ],
+            options={
+                'default_permissions': (),
+                'unique_together': {('page', 'slot', 'language', 'template')},
+            },
+        ),
+    ]
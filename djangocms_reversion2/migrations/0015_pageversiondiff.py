@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0014_renderedplaceholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snapshotjob',
+            name='kind',
+            field=models.CharField(choices=[('snapshot', 'Snapshot'), ('diff', 'Diff')], default='snapshot', max_length=10, verbose_name='Kind'),
+        ),
+        migrations.CreateModel(
+            name='PageVersionDiff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('diffs', models.TextField(help_text='json: {slot: {left, right, diff_right_to_left}}', verbose_name='Diffs')),
+                ('changed_slots', models.PositiveIntegerField(default=0, verbose_name='Changed placeholders')),
+                ('insertions', models.PositiveIntegerField(default=0, verbose_name='Insertions')),
+                ('deletions', models.PositiveIntegerField(default=0, verbose_name='Deletions')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('base', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djangocms_reversion2.PageVersion', verbose_name='Base Version')),
+                ('page_version', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_diff', to='djangocms_reversion2.PageVersion', verbose_name='Page Version')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+    ]
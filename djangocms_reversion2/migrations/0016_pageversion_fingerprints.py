@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0015_pageversiondiff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageversion',
+            name='fingerprints',
+            field=models.TextField(blank=True, default='', editable=False, help_text='JSON encoded content hash of every placeholder.', verbose_name='Fingerprints'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:31
+
+from django.db import migrations, models, transaction
+import django.utils.timezone
+
+# page versions updated per transaction
+CHUNK_SIZE = 500
+
+
+def copy_hidden_page_metadata(apps, schema_editor):
+    PageVersion = apps.get_model('djangocms_reversion2', 'PageVersion')
+    Title = apps.get_model('cms', 'Title')
+
+    last_pk = 0
+    while True:
+        chunk = list(PageVersion.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+            'pk', 'language', 'hidden_page_id', 'hidden_page__changed_date', 'hidden_page__changed_by')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        titles = {}
+        for page_id, language, title in Title.objects.filter(page__in=[entry[2] for entry in chunk])\
+                .values_list('page_id', 'language', 'title'):
+            titles[(page_id, language)] = title
+            titles.setdefault((page_id, None), title)
+
+        with transaction.atomic():
+            for pk, language, page_id, changed_date, changed_by in chunk:
+                PageVersion.objects.filter(pk=pk).update(
+                    created_at=changed_date,
+                    changed_by=changed_by,
+                    page_title=titles.get((page_id, language), titles.get((page_id, None), '')),
+                )
+        last_pk = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+    # the rows are updated in chunks, each in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('cms', '0016_auto_20160608_1535'),
+        ('djangocms_reversion2', '0016_pageversion_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageversion',
+            name='changed_by',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Changed by'),
+        ),
+        migrations.AddField(
+            model_name='pageversion',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False, verbose_name='Created at'),
+        ),
+        migrations.AddField(
+            model_name='pageversion',
+            name='page_title',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Page title'),
+        ),
+        migrations.RunPython(copy_hidden_page_metadata, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0017_pageversion_metadata'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pageversion',
+            index=models.Index(fields=['draft', 'language', '-id'], name='reversion2_draft_lang_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pageversion',
+            index=models.Index(fields=['draft', 'language', '-created_at', '-id'], name='reversion2_draft_lang_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pageversion',
+            index=models.Index(condition=models.Q(active=True), fields=['draft', 'language', 'dirty'], name='reversion2_active_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+import versionfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0016_auto_20160608_1535'),
+        ('djangocms_reversion2', '0018_pageversion_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageVersionCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=20, verbose_name='Language')),
+                ('version_id', versionfield.fields.VersionField(blank=True, null=True, verbose_name='Latest Version Id')),
+                ('num_versions', models.PositiveIntegerField(default=0, verbose_name='Number of versions')),
+                ('draft', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cms.Page', verbose_name='Draft')),
+            ],
+            options={
+                'default_permissions': (),
+                'unique_together': {('draft', 'language')},
+            },
+        ),
+    ]
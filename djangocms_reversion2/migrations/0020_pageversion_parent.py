@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:37
+
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+# page versions updated per transaction
+CHUNK_SIZE = 500
+# the step length of the materialized path tree the versions have been stored in (treebeard's MP_Node)
+STEPLEN = 4
+
+
+def copy_tree_parents(apps, schema_editor):
+    PageVersion = apps.get_model('djangocms_reversion2', 'PageVersion')
+
+    last_pk = 0
+    while True:
+        chunk = list(PageVersion.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'path')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        parent_paths = set(path[:-STEPLEN] for pk, path in chunk if len(path) > STEPLEN)
+        parents = dict(PageVersion.objects.filter(path__in=parent_paths).values_list('path', 'pk'))
+
+        with transaction.atomic():
+            for pk, path in chunk:
+                parent_id = parents.get(path[:-STEPLEN])
+                if parent_id:
+                    PageVersion.objects.filter(pk=pk).update(parent_id=parent_id)
+        last_pk = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+    # the rows are updated in chunks, each in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('djangocms_reversion2', '0019_pageversioncounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageversion',
+            name='parent',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='children', to='djangocms_reversion2.PageVersion', verbose_name='Parent version'),
+        ),
+        migrations.RunPython(copy_tree_parents, migrations.RunPython.noop),
+    ]
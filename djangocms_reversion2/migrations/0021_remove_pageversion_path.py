@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:37
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0020_pageversion_parent'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='pageversion',
+            name='depth',
+        ),
+        migrations.RemoveField(
+            model_name='pageversion',
+            name='numchild',
+        ),
+        migrations.RemoveField(
+            model_name='pageversion',
+            name='path',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0021_remove_pageversion_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageversion',
+            name='changed_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Changed at'),
+        ),
+    ]
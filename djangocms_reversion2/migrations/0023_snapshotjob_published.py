@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0022_pageversion_changed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snapshotjob',
+            name='published',
+            field=models.BooleanField(default=False, verbose_name='Published state'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_reversion2', '0023_snapshotjob_published'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='treeroot',
+            name='kind',
+            field=models.CharField(choices=[('version', 'version root'), ('bin', 'bin root'), ('bucket', 'bin bucket'), ('vbucket', 'version bucket')], max_length=10, verbose_name='Kind'),
+        ),
+        migrations.AlterField(
+            model_name='treeroot',
+            name='name',
+            field=models.CharField(blank=True, default='', help_text='Title of a bin bucket or name of a version bucket.', max_length=255, verbose_name='Name'),
+        ),
+    ]
@@ -1,27 +1,40 @@
 
 
+import json
+import threading
+from contextlib import contextmanager
+
 from cms import constants
+from django.conf import settings
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F
 from django.urls import reverse
-from django.utils.encoding import python_2_unicode_compatible, force_text
+from django.utils import timezone
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
-from six import string_types
-from treebeard.mp_tree import MP_Node
 from versionfield import VersionField
 
-from djangocms_reversion2.settings import ALLOW_BLANK_TITLE
+from djangocms_reversion2.settings import ALLOW_BLANK_TITLE, SNAPSHOT_STORAGE, DELTA_KEYFRAME_INTERVAL, \
+    PRECOMPUTE_DIFFS
+from .instrumentation import SNAPSHOT, instrument
+from .storage import STORAGE_BLOB, STORAGE_CHOICES, STORAGE_COPY, STORAGE_DELTA, can_store_blobs, \
+    get_delta_base, get_page_fingerprints, get_page_plugins, store_page_contents
+from .registry import KIND_CHOICES
 from .utils import revise_page
 
 
-@python_2_unicode_compatible
-class PageVersion(MP_Node):
+class PageVersion(models.Model):
     hidden_page = models.OneToOneField('cms.Page', on_delete=models.CASCADE, verbose_name=_('Hidden Page'),
                                        related_name='page_version', help_text=_('This Page object holds the versioned '
                                                                                 'contents of this PageVersion.'))
     draft = models.ForeignKey('cms.Page', on_delete=models.CASCADE, verbose_name=_('Draft'),
                               related_name='page_versions', help_text=_('Current active draft.'))
+    # the version history of a draft is a chain of versions, each pointing at the version it has been created from
+    # (the children of a deleted version are linked to its parent, see signals.handle_page_version_delete)
+    parent = models.ForeignKey('self', on_delete=models.DO_NOTHING, null=True, blank=True, editable=False,
+                               verbose_name=_('Parent version'), related_name='children')
 
     version_id = VersionField(verbose_name=_("Version Id"), null=True, blank=True)
     title = models.CharField(_('Version Title'), blank=True, max_length=63)
@@ -35,6 +48,22 @@ class PageVersion(MP_Node):
                                             'PageVersion.'))
     language = models.CharField(_('Language'), blank=True, max_length=20)
     owner = models.CharField(_("owner"), max_length=constants.PAGE_USERNAME_MAX_LENGTH, editable=False, default='script')
+    storage = models.CharField(_('Storage'), max_length=10, choices=STORAGE_CHOICES, default=STORAGE_COPY,
+                               editable=False, help_text=_('How the plugins of this version are stored.'))
+    materialized = models.BooleanField(_('Materialized'), default=True, editable=False,
+                                       help_text=_('The hidden page holds the plugins of this version.'))
+    keyframe = models.BooleanField(_('Keyframe'), default=True, editable=False,
+                                   help_text=_('All placeholders are stored on this version. Delta versions only store '
+                                               'the placeholders which differ from their parent.'))
+    fingerprints = models.TextField(_('Fingerprints'), blank=True, default='', editable=False,
+                                    help_text=_('JSON encoded content hash of every placeholder.'))
+    # copies of the hidden page's metadata, so that lists of versions do not need the hidden pages
+    created_at = models.DateTimeField(_('Created at'), default=timezone.now, db_index=True, editable=False)
+    changed_by = models.CharField(_('Changed by'), max_length=constants.PAGE_USERNAME_MAX_LENGTH, blank=True,
+                                  default='', editable=False)
+    page_title = models.CharField(_('Page title'), max_length=255, blank=True, default='', editable=False)
+    # last save, e.g. of the title or comment (the ETag of the version history, see views.version_history)
+    changed_at = models.DateTimeField(_('Changed at'), auto_now=True)
 
     @property
     def get_title(self):
@@ -42,7 +71,8 @@ class PageVersion(MP_Node):
 
     @property
     def get_full_title(self):
-        return '{page} - {lang} [{ver} - {title}]'.format(page=self.get_title,
+        # the denormalized title saves loading the hidden page (i.e. in the page tree)
+        return '{page} - {lang} [{ver} - {title}]'.format(page=self.page_title or self.get_title,
                                                           lang=self.language,
                                                           ver=self.version_id,
                                                           title=self.title[:30])
@@ -53,8 +83,10 @@ class PageVersion(MP_Node):
 
     @property
     def get_revision_public_url(self):
-        if self.hidden_page and self.hidden_page.get_public_object():
-            return self.hidden_page.get_public_url(language=self.language)
+        # the public page has the path of the draft, its titles do not have to be loaded
+        hidden_page = self.hidden_page
+        if hidden_page and hidden_page.publisher_public_id and hidden_page.is_published(self.language):
+            return hidden_page.get_absolute_url(language=self.language)
 
     @property
     def get_draft_url(self):
@@ -96,6 +128,11 @@ class PageVersion(MP_Node):
 
     @classmethod
     def get_latest_version_id(cls, language, hidden_page=None, draft=None):
+        if draft is not None and hidden_page is None:
+            # the id of the latest version is kept on the counter of the draft
+            if hasattr(draft, 'get_draft_object'):
+                draft = draft.get_draft_object()
+            return PageVersionCounter.get(draft, language).version_id or None
         latest_version = cls.get_latest_version(language, hidden_page=hidden_page, draft=draft)
         if latest_version and latest_version.version_id:
             return latest_version.version_id
@@ -104,7 +141,26 @@ class PageVersion(MP_Node):
     # Main Method to create a version
     # -------------------------------
     @classmethod
-    def create_version(cls, draft, language, version_parent=None, comment='', title='', version_id=None):
+    def create_version(cls, draft, language, version_parent=None, comment='', title='', version_id=None,
+                       storage=None, source=None, bucket=None):
+        # snapshots of the same draft and language are created one after another
+        # source: the page whose contents are stored instead of the draft's, i.e. draft.publisher_public
+        # bucket: the version bucket of a batch worker (see revise_page)
+        with instrument(SNAPSHOT, page=draft.pk, language=language), \
+                PageVersionCounter.locked(draft, language) as counter:
+            if version_id and counter.version_id and counter.version_id >= version_id:
+                raise AssertionError('Version Id is not increased')
+            page_version = cls._create_version(draft, language, version_parent=version_parent, comment=comment,
+                                               title=title, version_id=version_id, storage=storage,
+                                               source=source, bucket=bucket)
+            counter.version_id = page_version.version_id
+            counter.num_versions += 1
+            counter.save(update_fields=['version_id', 'num_versions'])
+        return page_version
+
+    @classmethod
+    def _create_version(cls, draft, language, version_parent=None, comment='', title='', version_id=None,
+                        storage=None, source=None, bucket=None):
         if draft.page_versions.filter(active=True, dirty=False, language=language).count() > 0:
             raise AssertionError('not dirty')
 
@@ -128,24 +184,51 @@ class PageVersion(MP_Node):
         else:
             owner = "script"
 
-        if isinstance(user, string_types):
+        if isinstance(user, str):
             from cms.models import User
             user = User.objects.get(username=user)
 
-        hidden_page = revise_page(draft, language, user, version_id)
+        # Blob and delta storage only copy the page itself, the plugins are stored content-addressed
+        storage = storage or SNAPSHOT_STORAGE
+        source = source or draft
+        plugins_by_slot = None
+        if storage in (STORAGE_BLOB, STORAGE_DELTA):
+            plugins_by_slot = get_page_plugins(source, language)
+            if not can_store_blobs(plugins_by_slot):
+                storage = STORAGE_COPY
+
+        fingerprints = get_page_fingerprints(source, language, plugins_by_slot=plugins_by_slot)
+        hidden_page = revise_page(draft, language, user, version_id, include_plugins=storage == STORAGE_COPY,
+                                  source=source, bucket=bucket)
 
         if not version_parent and draft.page_versions.filter(language=language).exists():
             version_parent = draft.page_versions.get(active=True, language=language)
 
+        base = None
+        if storage == STORAGE_DELTA:
+            base = get_delta_base(version_parent, DELTA_KEYFRAME_INTERVAL)
+
+        metadata = {
+            'created_at': hidden_page.changed_date,
+            'changed_by': hidden_page.changed_by,
+            'page_title': hidden_page.get_title(language=language) or '',
+        }
+        page_version = PageVersion.objects.create(parent=version_parent, hidden_page=hidden_page, draft=draft,
+                                                  comment=comment, title=title, version_id=version_id,
+                                                  active=version_parent.active if version_parent else True,
+                                                  language=language, owner=owner,
+                                                  storage=storage, materialized=storage == STORAGE_COPY,
+                                                  keyframe=base is None, fingerprints=json.dumps(fingerprints),
+                                                  **metadata)
         if version_parent:
-            page_version = version_parent.add_child(hidden_page=hidden_page, draft=draft, comment=comment, title=title,
-                                                    version_id=version_id,
-                                                    active=version_parent.active, language=language, owner=owner)
             version_parent.deactivate()
-        else:
-            page_version = PageVersion.add_root(hidden_page=hidden_page, draft=draft, comment=comment, title=title,
-                                                version_id=version_id,
-                                                active=True, language=language, owner=owner)
+
+        if storage in (STORAGE_BLOB, STORAGE_DELTA):
+            store_page_contents(page_version, plugins_by_slot, base=base)
+
+        if PRECOMPUTE_DIFFS and version_parent:
+            from .jobs import enqueue_diff_on_commit
+            enqueue_diff_on_commit(page_version)
 
         return page_version
 
@@ -160,9 +243,27 @@ class PageVersion(MP_Node):
     def generate_comment(self):
         return ''
 
+    def get_parent(self):
+        return self.parent
+
+    def get_children(self):
+        return self.children.all()
+
+    def get_ancestors(self):
+        """
+        Returns the versions this version has been derived from, the root first
+        """
+        ancestors = []
+        version = self.parent
+        while version is not None:
+            ancestors.append(version)
+            version = version.parent
+        ancestors.reverse()
+        return ancestors
+
     @property
     def username(self):
-        return self.hidden_page.changed_by
+        return self.changed_by
 
     def deactivate(self, commit=True):
         self.active = False
@@ -173,7 +274,7 @@ class PageVersion(MP_Node):
     def __str__(self):
         if self.title:
             return self.title
-        return self.hidden_page.get_title()
+        return self.page_title
 
     class Meta:
         # example: user.has_perm('djangocms_reversion2.view_page_version')
@@ -185,4 +286,276 @@ class PageVersion(MP_Node):
         #     ('revert_to_page_version', _('permission to revert a page to the page version')),
         # )
         default_permissions = () #'add', 'change', 'delete')
+        indexes = [
+            # get_versions: versions of a draft and language by id
+            models.Index(fields=['draft', 'language', '-id'], name='reversion2_draft_lang_id_idx'),
+            # version history (views.get_history_page): keyset on the creation time and id
+            models.Index(fields=['draft', 'language', '-created_at', '-id'], name='reversion2_draft_lang_date_idx'),
+            # the active version of a draft and language (i.e. the not dirty check of create_version)
+            # a partial index where the backend supports it
+            models.Index(fields=['draft', 'language', 'dirty'], name='reversion2_active_idx',
+                         condition=models.Q(active=True)),
+        ]
+
+
+class PluginBlob(models.Model):
+    """
+    A plugin and its children, stored once per distinct content
+    """
+    digest = models.CharField(_('Digest'), max_length=40, unique=True)
+    plugin_type = models.CharField(_('Plugin type'), max_length=50)
+    data = models.TextField(_('Data'), help_text=_('JSON encoded plugin fields and child digests'))
+
+    def get_data(self):
+        if not hasattr(self, '_data'):
+            self._data = json.loads(self.data)
+        return self._data
+
+    def __str__(self):
+        return '{} {}'.format(self.plugin_type, self.digest)
+
+    class Meta:
+        default_permissions = ()
+
+
+class PageVersionPlaceholder(models.Model):
+    """
+    References the plugin blobs of one placeholder of a blob or delta stored PageVersion
+    """
+    page_version = models.ForeignKey(PageVersion, on_delete=models.CASCADE, related_name='placeholder_snapshots',
+                                     verbose_name=_('Page Version'))
+    slot = models.CharField(_('Slot'), max_length=255)
+    plugins = models.TextField(_('Plugins'), default='[]', help_text=_('JSON encoded root plugin digests'))
+
+    def get_plugins(self):
+        return json.loads(self.plugins)
+
+    def __str__(self):
+        return self.slot
+
+    class Meta:
+        unique_together = ('page_version', 'slot')
+        default_permissions = ()
+
+
+# a fixed pool of process-local locks shared by the (draft id, language) pairs with the same hash,
+# see PageVersionCounter.locked (reentrant, a thread may snapshot two pages of the same stripe)
+LOCAL_LOCK_STRIPES = 64
+_local_locks = [threading.RLock() for i in range(LOCAL_LOCK_STRIPES)]
+
+
+class PageVersionCounter(models.Model):
+    """
+    The latest version id and the number of versions of a draft and language, kept up to date by
+    PageVersion.create_version. Its row lock serializes the snapshots of the draft and language.
+    """
+    draft = models.ForeignKey('cms.Page', on_delete=models.CASCADE, related_name='+', verbose_name=_('Draft'))
+    language = models.CharField(_('Language'), max_length=20)
+    version_id = VersionField(verbose_name=_('Latest Version Id'), null=True, blank=True)
+    num_versions = models.PositiveIntegerField(_('Number of versions'), default=0)
+
+    @classmethod
+    def get_current_values(cls, draft_id, language):
+        versions = PageVersion.objects.filter(draft_id=draft_id, language=language)
+        latest = versions.order_by('-id').only('version_id').first()
+        return {'version_id': latest.version_id if latest else None, 'num_versions': versions.count()}
+
+    @classmethod
+    def get(cls, draft, language):
+        """
+        Returns the counter of a draft and language, the counters of drafts which have been versioned by older
+        releases are created on first use
+        """
+        draft_id = getattr(draft, 'pk', draft)
+        counter = cls.objects.filter(draft_id=draft_id, language=language).first()
+        if counter is None:
+            counter, created = cls.objects.get_or_create(draft_id=draft_id, language=language,
+                                                         defaults=cls.get_current_values(draft_id, language))
+        return counter
+
+    @classmethod
+    def lock(cls, draft, language):
+        """
+        Returns the counter of a draft and language, locked until the end of the current transaction
+        """
+        counter = cls.get(draft, language)
+        if connection.features.has_select_for_update:
+            return cls.objects.select_for_update().get(pk=counter.pk)
+        # databases without row locks (sqlite) lock the counter when it is written to
+        cls.objects.filter(pk=counter.pk).update(num_versions=F('num_versions'))
+        counter.refresh_from_db()
+        return counter
+
+    @classmethod
+    @contextmanager
+    def locked(cls, draft, language):
+        """
+        Opens a transaction which holds the lock of the counter of a draft and language.
+        Without select_for_update the threads of a process wait for each other on a process-local lock,
+        so that they do not fail on the locked database.
+        """
+        local_lock = None
+        if not connection.features.has_select_for_update:
+            local_lock = _local_locks[hash((getattr(draft, 'pk', draft), language)) % LOCAL_LOCK_STRIPES]
+            local_lock.acquire()
+        try:
+            with transaction.atomic():
+                yield cls.lock(draft, language)
+        finally:
+            if local_lock:
+                local_lock.release()
+
+    @classmethod
+    def refresh(cls, draft_id, language):
+        cls.objects.filter(draft_id=draft_id, language=language).update(**cls.get_current_values(draft_id, language))
+
+    def __str__(self):
+        return '{} ({}): {}'.format(self.draft_id, self.language, self.version_id)
 
+    class Meta:
+        unique_together = ('draft', 'language')
+        default_permissions = ()
+
+
+class SnapshotJob(models.Model):
+    """
+    A deferred request to create a PageVersion or to precompute the diff of a PageVersion (see jobs.py)
+    """
+    SNAPSHOT = 'snapshot'
+    DIFF = 'diff'
+    KIND_CHOICES = (
+        (SNAPSHOT, _('Snapshot')),
+        (DIFF, _('Diff')),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    STATE_CHOICES = (
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (SKIPPED, _('Skipped')),
+        (FAILED, _('Failed')),
+    )
+
+    kind = models.CharField(_('Kind'), max_length=10, choices=KIND_CHOICES, default=SNAPSHOT)
+    draft = models.ForeignKey('cms.Page', on_delete=models.CASCADE, verbose_name=_('Draft'),
+                              related_name='snapshot_jobs')
+    language = models.CharField(_('Language'), max_length=20)
+    title = models.CharField(_('Version Title'), blank=True, max_length=63)
+    comment = models.TextField(_('Version Comment'), blank=True)
+    version_id = VersionField(verbose_name=_("Version Id"), null=True, blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                             verbose_name=_('User'))
+    # snapshot the public page instead of the draft, which might have been edited since the publish
+    published = models.BooleanField(_('Published state'), default=False)
+
+    state = models.CharField(_('State'), max_length=10, choices=STATE_CHOICES, default=PENDING, db_index=True)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+    started = models.DateTimeField(_('Started'), null=True, blank=True)
+    finished = models.DateTimeField(_('Finished'), null=True, blank=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    error = models.TextField(_('Error'), blank=True)
+    page_version = models.ForeignKey(PageVersion, on_delete=models.SET_NULL, null=True, blank=True,
+                                     verbose_name=_('Page Version'), related_name='+')
+
+    def __str__(self):
+        return '{} - {} ({})'.format(self.draft_id, self.language, self.state)
+
+    class Meta:
+        ordering = ('pk',)
+        default_permissions = ()
+
+
+class BatchRun(models.Model):
+    """
+    Checkpoint of a batch versioning run (see batch.py)
+    """
+    name = models.CharField(_('Name'), max_length=255, unique=True)
+    last_page_id = models.PositiveIntegerField(_('Last page id'), default=0,
+                                               help_text=_('All drafts up to this id have been processed.'))
+    processed = models.PositiveIntegerField(_('Processed pages'), default=0)
+    created = models.PositiveIntegerField(_('Created versions'), default=0)
+    skipped = models.PositiveIntegerField(_('Skipped versions'), default=0)
+    errors = models.PositiveIntegerField(_('Errors'), default=0)
+    started = models.DateTimeField(_('Started'), default=timezone.now)
+    updated = models.DateTimeField(_('Updated'), auto_now=True)
+    finished = models.DateTimeField(_('Finished'), null=True, blank=True)
+
+    def reset(self):
+        self.last_page_id = 0
+        self.processed = self.created = self.skipped = self.errors = 0
+        self.started = timezone.now()
+        self.finished = None
+        self.save()
+    reset.alters_data = True
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        default_permissions = ()
+
+
+class TreeRoot(models.Model):
+    """
+    Registry entry of the version root, the bin root or a bucket of either of a site (see registry.py)
+    """
+    site = models.ForeignKey('sites.Site', on_delete=models.CASCADE, verbose_name=_('Site'))
+    kind = models.CharField(_('Kind'), max_length=10, choices=KIND_CHOICES)
+    name = models.CharField(_('Name'), max_length=255, blank=True, default='',
+                            help_text=_('Title of a bin bucket or name of a version bucket.'))
+    page = models.ForeignKey('cms.Page', on_delete=models.CASCADE, verbose_name=_('Page'), related_name='+')
+
+    def __str__(self):
+        return '{} {}'.format(self.kind, self.name).strip()
+
+    class Meta:
+        unique_together = ('site', 'kind', 'name')
+        default_permissions = ()
+
+
+class RenderedPlaceholder(models.Model):
+    """
+    Rendered html of a placeholder of a version's hidden page, which never changes (see diff.py)
+    """
+    page = models.ForeignKey('cms.Page', on_delete=models.CASCADE, verbose_name=_('Page'), related_name='+')
+    slot = models.CharField(_('Slot'), max_length=255)
+    language = models.CharField(_('Language'), max_length=20)
+    template = models.CharField(_('Template'), max_length=100)
+    html = models.TextField(_('Html'), blank=True)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+
+    def __str__(self):
+        return '{} {} ({})'.format(self.page_id, self.slot, self.language)
+
+    class Meta:
+        unique_together = ('page', 'slot', 'language', 'template')
+        default_permissions = ()
+
+
+class PageVersionDiff(models.Model):
+    """
+    Diff between a page version and its parent, computed after the snapshot (see diff.compute_version_diff)
+    """
+    page_version = models.OneToOneField(PageVersion, on_delete=models.CASCADE, verbose_name=_('Page Version'),
+                                        related_name='precomputed_diff')
+    base = models.ForeignKey(PageVersion, on_delete=models.CASCADE, verbose_name=_('Base Version'),
+                             related_name='+')
+    diffs = models.TextField(_('Diffs'), help_text=_('json: {slot: {left, right, diff_right_to_left}}'))
+    changed_slots = models.PositiveIntegerField(_('Changed placeholders'), default=0)
+    insertions = models.PositiveIntegerField(_('Insertions'), default=0)
+    deletions = models.PositiveIntegerField(_('Deletions'), default=0)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+
+    def get_diffs(self):
+        return json.loads(self.diffs)
+
+    def __str__(self):
+        return '{} -> {}'.format(self.base_id, self.page_version_id)
+
+    class Meta:
+        default_permissions = ()
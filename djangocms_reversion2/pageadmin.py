@@ -5,7 +5,7 @@ from collections import defaultdict
 
 from cms import api, constants
 from cms.admin.pageadmin import PageAdmin
-from cms.models import Page, Title, EmptyTitle
+from cms.models import Page, Title, EmptyTitle, TreeNode
 from cms.utils import get_language_from_request
 from cms.utils import page_permissions
 from cms.utils.conf import get_cms_setting
@@ -24,8 +24,10 @@ from django.shortcuts import get_object_or_404, render
 from django.template.loader import get_template
 from sekizai.context import SekizaiContext
 
+from djangocms_reversion2 import registry
+from djangocms_reversion2.instrumentation import TREE_RENDER, instrument
 from djangocms_reversion2.models import PageVersion
-from djangocms_reversion2.settings import *
+from djangocms_reversion2.settings import TREE_PAGE_SIZE
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST
 
@@ -34,6 +36,14 @@ from djangocms_reversion2.utils import delete_page
 require_POST = method_decorator(require_POST)
 
 
+# node id of the row which loads the next entries of a lazy subtree: more-<parent node id>-<last node path>
+MORE_NODE_PREFIX = 'more-'
+
+
+def _draft_id(page):
+    return page.pk if page.publisher_is_draft else page.publisher_public_id
+
+
 # Override DjangoCMS Page Admin - remove from admin site, then re-register
 # -----------------------
 # admin.site._registry.pop(Page).__class__):
@@ -55,9 +65,9 @@ class PageAdmin2(PageAdmin):
     def delete_model(self, request, obj):
 
         # is the page already under the ~BIN folder?
-        page_query = obj.get_root().title_set.filter(title__in=[BIN_ROOT_TITLE, VERSION_ROOT_TITLE])
-        is_in_bin = page_query.filter(title=BIN_ROOT_TITLE).exists()
-        is_version = page_query.filter(title=VERSION_ROOT_TITLE).exists()
+        kind = registry.classify_page(obj)
+        is_in_bin = kind == registry.BIN_ROOT
+        is_version = kind == registry.VERSION_ROOT
 
         # if in bin -> delete it permanently
         if is_in_bin:
@@ -71,6 +81,93 @@ class PageAdmin2(PageAdmin):
         delete_page(obj)
 
 
+    @instrument(TREE_RENDER)
+    def get_tree(self, request):
+        """
+        Like PageAdmin.get_tree, but the version root, the bin root and the bin buckets are lazy nodes:
+        they are collapsed in the initial tree and their children are loaded in pages of TREE_PAGE_SIZE
+        when they are expanded (see get_lazy_tree)
+        """
+        site = self.get_site(request)
+        node_id = request.GET.get('nodeId') or ''
+
+        if node_id.startswith(MORE_NODE_PREFIX):
+            parent_id, after = node_id[len(MORE_NODE_PREFIX):].split('-', 1)
+            parent = get_object_or_404(TreeNode, pk=parent_id, site=site)
+            return self.get_lazy_tree(request, site, parent, after=after)
+
+        lazy_paths = registry.get_registered_paths(site.pk)
+        if node_id:
+            node = get_object_or_404(TreeNode, pk=node_id, site=site)
+            if node.path in lazy_paths:
+                return self.get_lazy_tree(request, site, node)
+
+        # the stored open nodes may contain 'more' rows
+        open_nodes = [int(pk) for pk in request.GET.getlist('openNodes[]') if pk.isdigit()]
+        pages = self.get_queryset(request)
+
+        if node_id:
+            page = get_object_or_404(pages, node_id=int(node_id))
+            pages = page.get_descendant_pages().filter(Q(node__in=open_nodes) | Q(node__parent__in=open_nodes))
+        else:
+            page = None
+            pages = pages.filter(
+                # get all root nodes
+                Q(node__depth=1)
+                # or children which were previously open
+                | Q(node__depth=2, node__in=open_nodes)
+                # or children of the open descendants
+                | Q(node__parent__in=open_nodes)
+            )
+            # the lazy nodes are always collapsed at first
+            for path in lazy_paths:
+                pages = pages.exclude(node__path__startswith=path, node__depth__gt=len(path) // TreeNode.steplen)
+
+        rows = self.get_tree_rows(
+            request,
+            pages=self._prefetch_tree_titles(pages, site),
+            language=get_site_language_from_request(request, site_id=site.pk),
+            depth=(page.node.depth + 1 if page else 1),
+            follow_descendants=True,
+        )
+        return HttpResponse(u''.join(rows))
+
+    def get_lazy_tree(self, request, site, node, after=None):
+        """
+        Renders the next TREE_PAGE_SIZE children of a lazy node, newest first.
+        The rows are paginated by node path, a 'more' row after the last child loads the following ones.
+        """
+        pages = self.get_queryset(request).filter(node__parent=node).order_by('-node__path')
+        if after:
+            pages = pages.filter(node__path__lt=after)
+        pages = list(self._prefetch_tree_titles(pages, site)[:TREE_PAGE_SIZE + 1])
+        has_more = len(pages) > TREE_PAGE_SIZE
+        pages = pages[:TREE_PAGE_SIZE]
+
+        rows = list(self.get_tree_rows(
+            request,
+            pages=pages,
+            language=get_site_language_from_request(request, site_id=site.pk),
+            depth=node.depth + 1,
+            follow_descendants=True,
+        ))
+        if has_more:
+            more_node_id = '{}{}-{}'.format(MORE_NODE_PREFIX, node.pk, pages[-1].node.path)
+            rows.append(get_template('admin/cms/page/tree/more_menu.html').render({
+                'more_node_id': more_node_id,
+                'page_size': TREE_PAGE_SIZE,
+            }))
+        return HttpResponse(u''.join(rows))
+
+    def _prefetch_tree_titles(self, pages, site):
+        return pages.prefetch_related(
+            Prefetch(
+                'title_set',
+                to_attr='filtered_translations',
+                queryset=Title.objects.filter(language__in=get_language_list(site.pk))
+            ),
+        )
+
     def get_tree_rows(self, request, pages, language, depth=1,
                       follow_descendants=True):
         """
@@ -88,6 +185,8 @@ class PageAdmin2(PageAdmin):
         # -------- bin/versions --------
         lang = get_language_from_request(request)
         bin_template = get_template('admin/cms/page/tree/bin_menu.html')
+        pages = list(pages)
+        kinds, page_versions = self.classify_tree_rows(pages, site, lang)
 
         def render_page_row(page):
             page.title_cache = {trans.language: trans for trans in page.filtered_translations}
@@ -107,16 +206,13 @@ class PageAdmin2(PageAdmin):
 
             # Get Bin/Version Context
             # ----------
-            page_query = page.get_root().title_set.filter(title__in=[BIN_ROOT_TITLE, VERSION_ROOT_TITLE])
-            is_in_bin = page_query.filter(title=BIN_ROOT_TITLE).exists()
-            is_version = page_query.filter(title=VERSION_ROOT_TITLE).exists()
+            kind = kinds[page.pk]
+            is_in_bin = kind == registry.BIN_ROOT
+            is_version = kind == registry.VERSION_ROOT
 
             if is_in_bin or is_version:
-                # Get the page version associated with the hidden page
-                page_version = PageVersion.objects.filter(hidden_page=page.get_draft_object(), language=lang)
-                # Need this as .~VERSIONS comes up as a 'version' but doesn't have a page_version
-                if page_version.exists():
-                    page_version = page_version.first()
+                # .~VERSIONS comes up as a 'version' but doesn't have a page_version
+                page_version = page_versions.get(_draft_id(page))
 
                 # Use Sekizai context so we can render the page
                 context = SekizaiContext({
@@ -195,6 +291,31 @@ class PageAdmin2(PageAdmin):
                 page.node.__dict__['item'] = page
                 yield render_page_row(page)
 
+    def classify_tree_rows(self, pages, site, language):
+        """
+        Classifies all rows of the page tree in one pass
+        :return: ({page.pk: registry kind or None}, {hidden page id: PageVersion} of the version/bin rows)
+        """
+        # the descendants of a lazily loaded subtree come without their nodes
+        missing_nodes = [page for page in pages if not Page.node.is_cached(page)]
+        if missing_nodes:
+            nodes = TreeNode.objects.in_bulk([page.node_id for page in missing_nodes])
+            for page in missing_nodes:
+                page.node = nodes[page.node_id]
+
+        roots = registry.get_roots(site.pk)
+        kinds = {page.pk: registry.classify_page(page, roots=roots) for page in pages}
+        hidden_page_ids = [_draft_id(page) for page in pages if kinds[page.pk]]
+        # the draft rows are the hidden pages of their versions and come with their titles
+        hidden_pages = {page.pk: page for page in pages if kinds[page.pk] and page.publisher_is_draft}
+        page_versions = {}
+        if hidden_page_ids:
+            for page_version in PageVersion.objects.filter(hidden_page__in=hidden_page_ids, language=language):
+                if page_version.hidden_page_id in hidden_pages:
+                    page_version.hidden_page = hidden_pages[page_version.hidden_page_id]
+                page_versions[page_version.hidden_page_id] = page_version
+        return kinds, page_versions
+
 
     def actions_menu(self, request, object_id, extra_context=None):
         page = self.get_object(request, object_id=object_id)
@@ -223,12 +344,12 @@ class PageAdmin2(PageAdmin):
 
         # Bin/Version page
         # ----------------
-        page_query = page.get_root().title_set.filter(title__in=[BIN_ROOT_TITLE, VERSION_ROOT_TITLE])
-        is_in_bin = page_query.filter(title=BIN_ROOT_TITLE).exists()
-        is_version = page_query.filter(title=VERSION_ROOT_TITLE).exists()
+        roots = registry.get_roots(page.node.site_id)
+        kind = registry.classify_page(page, roots=roots)
+        is_in_bin = kind == registry.BIN_ROOT
+        is_version = kind == registry.VERSION_ROOT
 
-        is_version_root = (page.title_set.filter(title__in=[BIN_ROOT_TITLE, VERSION_ROOT_TITLE]) | \
-                          page.title_set.filter(title__startswith='.DELETED')).exists()
+        is_version_root = registry.is_registered_page(page, roots=roots)
 
         if is_in_bin or is_version:
             context.update({
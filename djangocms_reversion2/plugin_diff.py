@@ -0,0 +1,179 @@
+"""
+Structural diff: compares the plugin trees of two pages per placeholder instead of their rendered html.
+Plugins are matched by position and type, their field values are compared by a comparator per plugin type
+(see register_comparator) and only the changed plugins are rendered for display.
+"""
+from collections import defaultdict
+
+from cms.plugin_rendering import ContentRenderer
+from sekizai.context import SekizaiContext
+
+from .storage import NESTED_PLUGIN_ID, get_page_plugins, serialize_plugin
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+# attributes of Page._copy_attributes, which describe the page rather than the instance
+# (the publication date and the slug of a hidden page are its own)
+PAGE_ATTRIBUTES = ('publication_end_date', 'reverse_id', 'login_required', 'in_navigation', 'soft_root',
+                   'limit_visibility_in_menu', 'navigation_extenders', 'application_urls', 'application_namespace',
+                   'template', 'xframe_options')
+TITLE_ATTRIBUTES = ('title', 'menu_title', 'page_title', 'meta_description', 'redirect')
+
+# {plugin_type: comparator(old_fields, new_fields) -> list of changed field names}
+_comparators = {}
+
+
+def register_comparator(plugin_type, comparator=None):
+    """
+    Registers the comparator of a plugin type, can be used as decorator:
+
+        @register_comparator('MyPlugin')
+        def compare_my_plugin(old_fields, new_fields):
+            return [name for name in ('title', 'url') if old_fields[name] != new_fields[name]]
+
+    The fields are the serialized content fields of the plugins (see storage.serialize_plugin).
+    """
+    if comparator is None:
+        return lambda func: register_comparator(plugin_type, func)
+    _comparators[plugin_type] = comparator
+    return comparator
+
+
+def get_comparator(plugin_type):
+    return _comparators.get(plugin_type, compare_fields)
+
+
+def compare_fields(old_fields, new_fields):
+    names = set(old_fields.keys()) | set(new_fields.keys())
+    return sorted(name for name in names if old_fields.get(name) != new_fields.get(name))
+
+
+@register_comparator('TextPlugin')
+def compare_text(old_fields, new_fields):
+    old_fields = dict(old_fields, body=NESTED_PLUGIN_ID.sub(r'\1\2', old_fields.get('body') or ''))
+    new_fields = dict(new_fields, body=NESTED_PLUGIN_ID.sub(r'\1\2', new_fields.get('body') or ''))
+    return compare_fields(old_fields, new_fields)
+
+
+def diff_plugin_trees(old_plugins, new_plugins):
+    """
+    Walks both plugin trees of a placeholder in parallel
+    :param old_plugins: downcasted plugins in tree (path) order
+    :param new_plugins: downcasted plugins in tree (path) order
+    :return: list of (status, old plugin, new plugin, changed field names) in tree order
+    """
+    def get_children(plugins):
+        plugin_ids = set(plugin.pk for plugin in plugins)
+        children = defaultdict(list)
+        for plugin in plugins:
+            children[plugin.parent_id if plugin.parent_id in plugin_ids else None].append(plugin)
+        return children
+
+    old_children = get_children(old_plugins)
+    new_children = get_children(new_plugins)
+    changes = []
+
+    def walk(old_list, new_list):
+        for position in range(max(len(old_list), len(new_list))):
+            old = old_list[position] if position < len(old_list) else None
+            new = new_list[position] if position < len(new_list) else None
+            if old and new and old.plugin_type == new.plugin_type:
+                fields = get_comparator(old.plugin_type)(serialize_plugin(old), serialize_plugin(new))
+                if fields:
+                    changes.append((CHANGED, old, new, fields))
+                walk(old_children[old.pk], new_children[new.pk])
+                continue
+            # a removed or added plugin is shown with its subtree
+            if old:
+                changes.append((REMOVED, old, None, []))
+            if new:
+                changes.append((ADDED, None, new, []))
+
+    walk(old_children[None], new_children[None])
+    return changes
+
+
+def diff_page_attributes(left_page, right_page, language):
+    """
+    :return: list of (attribute, left value, right value) of the page and title attributes which differ
+    """
+    changes = []
+    for name in PAGE_ATTRIBUTES:
+        if getattr(left_page, name) != getattr(right_page, name):
+            changes.append((name, getattr(left_page, name), getattr(right_page, name)))
+    left_title = left_page.get_title_obj(language, fallback=False)
+    right_title = right_page.get_title_obj(language, fallback=False)
+    for name in TITLE_ATTRIBUTES:
+        if getattr(left_title, name, None) != getattr(right_title, name, None):
+            changes.append((name, getattr(left_title, name, None), getattr(right_title, name, None)))
+    return changes
+
+
+def render_plugin(plugin, request, page, renderer=None):
+    """
+    Renders a plugin with its subtree (see storage.get_page_plugins)
+    """
+    if not plugin:
+        return ''
+    renderer = renderer or ContentRenderer(request)
+    context = SekizaiContext({
+        'request': request,
+        'cms_content_renderer': renderer,
+        'CMS_TEMPLATE': page.get_template,
+    })
+    return renderer.render_plugin(plugin, context, placeholder=plugin.placeholder, editable=False).strip()
+
+
+class SubtreeRenderer(object):
+    """
+    Renders the plugins of the changes of one side; a plugin in the subtree of a rendered plugin is not rendered
+    again, it is shown as part of its ancestor
+    """
+
+    def __init__(self, request, page):
+        self.request = request
+        self.page = page
+        self.renderer = ContentRenderer(request)
+        self.rendered = set()
+
+    def render(self, plugin):
+        if not plugin or plugin.pk in self.rendered:
+            return ''
+        # the whole subtree, also the descendants of unchanged children (see storage.get_page_plugins)
+        subtree = [plugin]
+        while subtree:
+            descendant = subtree.pop()
+            self.rendered.add(descendant.pk)
+            subtree.extend(getattr(descendant, 'child_plugin_instances', None) or [])
+        return render_plugin(plugin, self.request, self.page, renderer=self.renderer)
+
+
+def diff_pages(left_page, right_page, request, language):
+    """
+    Structural counterpart of diff.create_placeholder_contents, only placeholders with changes are returned
+    :return: {slot: {'left': html, 'right': html, 'diff_right_to_left': html, 'changes': [...]}}
+    """
+    from .diff import diff_texts
+
+    left_plugins = get_page_plugins(left_page, language)
+    right_plugins = get_page_plugins(right_page, language)
+    diffs = {}
+    for slot in sorted(set(left_plugins.keys()) | set(right_plugins.keys())):
+        changes = diff_plugin_trees(left_plugins.get(slot, []), right_plugins.get(slot, []))
+        if not changes:
+            continue
+        lefts, rights, diffs_right_to_left, summary = [], [], [], []
+        left_renderer = SubtreeRenderer(request, left_page)
+        right_renderer = SubtreeRenderer(request, right_page)
+        for status, old, new, fields in changes:
+            left_html = left_renderer.render(old)
+            right_html = right_renderer.render(new)
+            lefts.append(left_html)
+            rights.append(right_html)
+            diffs_right_to_left.append(diff_texts(left_html, right_html))
+            summary.append({'status': status, 'plugin_type': (old or new).plugin_type, 'fields': fields})
+        diffs[slot] = {'left': ''.join(lefts), 'right': ''.join(rights),
+                       'diff_right_to_left': ''.join(diffs_right_to_left), 'changes': summary}
+    return diffs
@@ -0,0 +1,197 @@
+import time
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from .settings import BIN_ROOT_TITLE, VERSION_ROOT_TITLE
+
+# Kinds of registered pages
+VERSION_ROOT = 'version'
+BIN_ROOT = 'bin'
+BIN_BUCKET = 'bucket'
+VERSION_BUCKET = 'vbucket'
+
+KIND_CHOICES = (
+    (VERSION_ROOT, 'version root'),
+    (BIN_ROOT, 'bin root'),
+    (BIN_BUCKET, 'bin bucket'),
+    (VERSION_BUCKET, 'version bucket'),
+)
+
+CACHE_KEY = 'djangocms_reversion2:roots:{site}'
+GENERATION_KEY = 'djangocms_reversion2:roots-generation:{site}'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# in-process cache: {site_id: (generation, roots)}
+_local_cache = {}
+
+
+def _load_roots(site_id):
+    """
+    Reads the registered pages of a site from the database
+    :return: {'version': (page_id, node_path), 'bin': (page_id, node_path), 'buckets': {title: (page_id, node_path)},
+              'version_buckets': {name: (page_id, node_path)}}
+    """
+    from .models import TreeRoot
+
+    entries = TreeRoot.objects.filter(site_id=site_id).values_list('kind', 'name', 'page_id', 'page__node__path')
+    roots = {VERSION_ROOT: None, BIN_ROOT: None, 'buckets': {}, 'version_buckets': {}}
+    for kind, name, page_id, path in entries:
+        if kind == BIN_BUCKET:
+            roots['buckets'][name] = (page_id, path)
+        elif kind == VERSION_BUCKET:
+            roots['version_buckets'][name] = (page_id, path)
+        else:
+            roots[kind] = (page_id, path)
+
+    # installations from before the registry: find the roots by their title once
+    for kind, title in ((VERSION_ROOT, VERSION_ROOT_TITLE), (BIN_ROOT, BIN_ROOT_TITLE)):
+        if roots[kind] is None:
+            page = _find_by_title(site_id, title)
+            if page:
+                register(page, kind, invalidate_cache=False)
+                roots[kind] = (page.pk, page.node.path)
+    if roots[BIN_ROOT] and not roots['buckets']:
+        for page_id, title, path in _find_buckets(roots[BIN_ROOT][1]):
+            TreeRoot.objects.get_or_create(site_id=site_id, kind=BIN_BUCKET, name=title,
+                                           defaults={'page_id': page_id})
+            roots['buckets'][title] = (page_id, path)
+    return roots
+
+
+def _find_by_title(site_id, title):
+    from cms.models import Page
+    return Page.objects.drafts().filter(title_set__title=title, node__site=site_id).select_related('node').first()
+
+
+def _find_buckets(bin_root_path):
+    from cms.models import Page, TreeNode
+    buckets = Page.objects.drafts().filter(node__path__startswith=bin_root_path,
+                                           node__depth=len(bin_root_path) // TreeNode.steplen + 1)
+    return buckets.values_list('pk', 'title_set__title', 'node__path').distinct()
+
+
+def _start_generation(site_id):
+    """
+    Starts the generation counter of a site at the current time in microseconds: a counter recreated after its key
+    has expired or been evicted never restarts at a generation an in-process copy was loaded with
+    """
+    key = GENERATION_KEY.format(site=site_id)
+    generation = int(time.time() * 1000000)
+    # another process might have started it in the meantime
+    if not cache.add(key, generation, CACHE_TIMEOUT):
+        generation = cache.get(key, generation)
+    return generation
+
+
+def get_roots(site_id):
+    """
+    Returns the registered pages of a site (see _load_roots)
+    Cached in-process and in the django cache; a generation counter in the django cache invalidates the
+    in-process copies of all processes.
+    """
+    generation = cache.get(GENERATION_KEY.format(site=site_id))
+    local = _local_cache.get(site_id)
+    if local and generation is not None and local[0] == generation:
+        return local[1]
+
+    roots = cache.get(CACHE_KEY.format(site=site_id)) if generation is not None else None
+    if roots is None:
+        roots = _load_roots(site_id)
+        if generation is None:
+            generation = _start_generation(site_id)
+        cache.set(CACHE_KEY.format(site=site_id), roots, CACHE_TIMEOUT)
+    _local_cache[site_id] = (generation, roots)
+    return roots
+
+
+def invalidate(site_id=None):
+    """
+    Drops the cached registry of a site (of all sites if site_id is None)
+    """
+    from django.contrib.sites.models import Site
+
+    site_ids = [site_id] if site_id else list(Site.objects.values_list('pk', flat=True))
+    for pk in site_ids:
+        try:
+            cache.incr(GENERATION_KEY.format(site=pk))
+        except ValueError:
+            # no generation yet
+            pass
+        cache.delete(CACHE_KEY.format(site=pk))
+        _local_cache.pop(pk, None)
+
+
+def register(page, kind, name='', invalidate_cache=True):
+    from .models import TreeRoot
+
+    TreeRoot.objects.update_or_create(site_id=page.node.site_id, kind=kind, name=name, defaults={'page': page})
+    if invalidate_cache:
+        invalidate(page.node.site_id)
+
+
+def get_root_page_id(site_id, kind, name=''):
+    roots = get_roots(site_id)
+    if kind == BIN_BUCKET:
+        entry = roots['buckets'].get(name)
+    elif kind == VERSION_BUCKET:
+        entry = roots.get('version_buckets', {}).get(name)
+    else:
+        entry = roots[kind]
+    return entry[0] if entry else None
+
+
+def get_special_paths(site_id):
+    """
+    Returns {node path: kind} of the version and bin root of a site
+    """
+    roots = get_roots(site_id)
+    return {roots[kind][1]: kind for kind in (VERSION_ROOT, BIN_ROOT) if roots[kind]}
+
+
+def exclude_special_pages(queryset, node_field='node'):
+    """
+    Excludes the version and bin roots and their descendants of all sites from a queryset
+    :param node_field: the lookup of the TreeNode in the queryset, e.g. 'page__node' for titles
+    """
+    from django.contrib.sites.models import Site
+
+    exclude = Q()
+    for site_id in Site.objects.values_list('pk', flat=True):
+        for node_path in get_special_paths(site_id):
+            exclude |= Q(**{node_field + '__site': site_id, node_field + '__path__startswith': node_path})
+    if exclude:
+        queryset = queryset.exclude(exclude)
+    return queryset
+
+
+def classify_path(site_id, path, roots=None):
+    """
+    Returns VERSION_ROOT if the node path is in the version tree, BIN_ROOT if it is in the bin and None otherwise
+    """
+    roots = roots or get_roots(site_id)
+    for kind in (VERSION_ROOT, BIN_ROOT):
+        if roots[kind] and path.startswith(roots[kind][1]):
+            return kind
+    return None
+
+
+def classify_page(page, roots=None):
+    return classify_path(page.node.site_id, page.node.path, roots=roots)
+
+
+def get_registered_paths(site_id, roots=None):
+    """
+    Returns the node paths of the version root, the bin root and the buckets of both of a site
+    """
+    roots = roots or get_roots(site_id)
+    entries = [roots[VERSION_ROOT], roots[BIN_ROOT]] + list(roots['buckets'].values()) + \
+        list(roots.get('version_buckets', {}).values())
+    return set(entry[1] for entry in entries if entry)
+
+
+def is_registered_page(page, roots=None):
+    """
+    True if the page is the version root, the bin root or a bucket
+    """
+    return page.node.path in get_registered_paths(page.node.site_id, roots=roots)
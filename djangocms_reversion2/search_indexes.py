@@ -1,11 +1,8 @@
-from cms.models import Page
-from django.db.models import Q
-
 from .settings import EXCLUDE_VERSIONS_FROM_SEARCH
 
 if EXCLUDE_VERSIONS_FROM_SEARCH:
 
-    from djangocms_reversion2.settings import BIN_ROOT_TITLE, VERSION_ROOT_TITLE
+    from djangocms_reversion2 import registry
     from aldryn_search.search_indexes import TitleIndex
 
     # ----------------------------------
@@ -22,19 +19,11 @@ if EXCLUDE_VERSIONS_FROM_SEARCH:
         def get_index_queryset(self, language):
             queryset = super(NEW_TitleIndex, self).get_index_queryset(language)
 
-            bin_version_pages = Page.objects.filter(title_set__title__in=(VERSION_ROOT_TITLE, BIN_ROOT_TITLE))
-            if bin_version_pages.exists():
-                # Exclude bin/version root pages
-                queryset = queryset.exclude(page__in=bin_version_pages.all())
-                # Get root node paths
-                bin_version_paths = [page.node.path for page in bin_version_pages]
-                for node_path in bin_version_paths:
-                    queryset = queryset.exclude(page__node__path__startswith=node_path)
-
-            return queryset
+            # Exclude the bin/version root pages and their descendants
+            return registry.exclude_special_pages(queryset, node_field='page__node')
 
         def should_update(self, instance, **kwargs):
             update = super(NEW_TitleIndex, self).should_update(instance, **kwargs)
-            if instance.page.get_root().title_set.filter(title__in=[BIN_ROOT_TITLE, VERSION_ROOT_TITLE]).exists():
+            if registry.classify_page(instance.page) is not None:
                 update = False
             return update
\ No newline at end of file
@@ -12,16 +12,48 @@ ADD_VERSION_ON_PUBLISH = getattr(settings, 'REVERSION2_ADD_VERSION_ON_PUBLISH',
 PROMPT_VERSION_ON_PUBLISH = getattr(settings, 'REVERSION2_PROMPT_VERSION_ON_PUBLISH', True)
 ADD_VERSION_ON_REVERT = getattr(settings, 'REVERSION2_ADD_VERSION_ON_REVERT', False)
 BATCH_ADD_UNVERSIONED_ONLY = getattr(settings, 'REVERSION2_BATCH_ADD_UNVERSIONED_ONLY', True)
+# pages per transaction/checkpoint of the batch versioning
+BATCH_CHUNK_SIZE = getattr(settings, 'REVERSION2_BATCH_CHUNK_SIZE', 50)
+# pages per click on 'Create a snapshot of all unrevised pages', the next click continues
+BATCH_ADD_REQUEST_LIMIT = getattr(settings, 'REVERSION2_BATCH_ADD_REQUEST_LIMIT', 200)
 PUBLISH_HIDDEN_PAGE = getattr(settings, 'REVERSION2_PUBLISH_HIDDEN_PAGE', True)
+# create the automatic snapshot on publish with the reversion2_process_snapshots command instead of the request,
+# the worker copies the published page (see the Settings docs)
+DEFERRED_SNAPSHOTS = getattr(settings, 'REVERSION2_DEFERRED_SNAPSHOTS', False)
+# compute the diff to the parent version with the reversion2_process_snapshots command after each snapshot
+PRECOMPUTE_DIFFS = getattr(settings, 'REVERSION2_PRECOMPUTE_DIFFS', False)
+
+# Get Snapshot Storage Settings ('copy', 'blob' or 'delta', see storage.py)
+SNAPSHOT_STORAGE = getattr(settings, 'REVERSION2_SNAPSHOT_STORAGE', 'copy')
+# every n-th delta version stores all placeholders, this bounds the replay on view/revert
+DELTA_KEYFRAME_INTERVAL = getattr(settings, 'REVERSION2_DELTA_KEYFRAME_INTERVAL', 10)
 
 # Get User Interface Settings
 ALLOW_MANUAL_SNAPSHOTS = getattr(settings, 'REVERSION2_ALLOW_MANUAL_SNAPSHOTS', True)
 ALLOW_VERSION_EDIT = getattr(settings, 'REVERSION2_ALLOW_VERSION_EDIT', False)
 ALLOW_BLANK_TITLE = getattr(settings, 'REVERSION2_ALLOW_BLANK_TITLE', False)
+# versions/deleted pages loaded at a time when the version root or a bin bucket is expanded in the page tree
+TREE_PAGE_SIZE = getattr(settings, 'REVERSION2_TREE_PAGE_SIZE', 50)
+# versions loaded at a time by the sidebar of the diff view
+HISTORY_PAGE_SIZE = getattr(settings, 'REVERSION2_HISTORY_PAGE_SIZE', 50)
 
 # Get Application Settings
 REVERSION2_DIFF_TEXT_ONLY = getattr(settings, 'REVERSION2_DIFF_TEXT_ONLY', False)
 REVERSION2_IGNORE_WHITESPACE = getattr(settings, 'REVERSION2_IGNORE_WHITESPACE', False)
+# 'htmldiff' (lxml) or 'tokens' (see text_diff.py)
+REVERSION2_DIFF_ENGINE = getattr(settings, 'REVERSION2_DIFF_ENGINE', 'htmldiff')
+# placeholders with more characters (both sides) are compared by blocks
+REVERSION2_DIFF_MAX_SIZE = getattr(settings, 'REVERSION2_DIFF_MAX_SIZE', 100000)
+# inserted/deleted tokens (blocks) after which the token (block) diff gives up
+REVERSION2_DIFF_MAX_COST = getattr(settings, 'REVERSION2_DIFF_MAX_COST', 2000)
+# seconds after which the token and block diff of a placeholder give up and show it as replaced
+REVERSION2_DIFF_PLACEHOLDER_TIMEOUT = getattr(settings, 'REVERSION2_DIFF_PLACEHOLDER_TIMEOUT', 2)
+# 'html' diffs the rendered placeholders, 'structure' compares the plugin trees (see plugin_diff.py)
+REVERSION2_DIFF_MODE = getattr(settings, 'REVERSION2_DIFF_MODE', 'html')
+# seconds a diff may take, placeholders which are not diffed in time are shown without markup (None: no limit)
+REVERSION2_DIFF_TIME_BUDGET = getattr(settings, 'REVERSION2_DIFF_TIME_BUDGET', None)
+# the diff view sends the page first and then every placeholder as soon as it is diffed
+REVERSION2_STREAM_DIFFS = getattr(settings, 'REVERSION2_STREAM_DIFFS', False)
 
 # Get Version Settings
 VERSION_ROOT_TITLE = getattr(settings, 'DJANGOCMS_REVERSION2_VERSION_ROOT_TITLE', '.~VERSIONS')
@@ -32,3 +64,7 @@ BIN_ROOT_TITLE = getattr(settings, 'DJANGOCMS_REVERSION2_BIN_ROOT_TITLE', '.~DEL
 BIN_PAGE_LANGUAGE = getattr(settings, 'LANGUAGE_CODE')
 BIN_BUCKET_NAMING = getattr(settings, 'DJANGOCMS_REVERSION2_BIN_BUCKET_NAMING', '.DELETED_%Y-%m-%d')
 
+
+# Get Instrumentation Settings
+# sum up the measurements of the operations in instrumentation.aggregator (see instrumentation.py)
+AGGREGATE_MEASUREMENTS = getattr(settings, 'REVERSION2_AGGREGATE_MEASUREMENTS', False)
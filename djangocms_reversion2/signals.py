@@ -1,8 +1,8 @@
 
-from cms.operations import REVERT_PAGE_TRANSLATION_TO_LIVE
+from cms.operations import MOVE_PAGE, REVERT_PAGE_TRANSLATION_TO_LIVE
 from django.db.models import signals
 
-from djangocms_reversion2.settings import ADD_VERSION_ON_PUBLISH, PROMPT_VERSION_ON_PUBLISH
+from djangocms_reversion2.settings import ADD_VERSION_ON_PUBLISH, PROMPT_VERSION_ON_PUBLISH, DEFERRED_SNAPSHOTS
 
 
 def make_page_version_dirty(page, language):
@@ -17,9 +17,17 @@ def make_page_version_dirty(page, language):
 def mark_title_dirty(sender, instance, **kwargs):
     page = instance.page
     language = instance.language
+    from djangocms_reversion2.diff import invalidate_rendered_drafts
+    invalidate_rendered_drafts()
     make_page_version_dirty(page, language)
 
 
+def handle_page_save(sender, instance, **kwargs):
+    # the attributes, url or menu of a page might be rendered by the placeholders of any draft
+    from djangocms_reversion2.diff import invalidate_rendered_drafts
+    invalidate_rendered_drafts()
+
+
 def handle_placeholder_change(**kwargs):
     language = kwargs.get('language')
     placeholder = kwargs.get('placeholder')
@@ -31,6 +39,8 @@ def handle_placeholder_change(**kwargs):
         page = target_placeholder.page
 
     if page:
+        from djangocms_reversion2.diff import invalidate_rendered_placeholders
+        invalidate_rendered_placeholders(page)
         make_page_version_dirty(page, language)
 
 
@@ -42,6 +52,14 @@ def handle_page_publish(**kwargs):
     try:
         # Only trigger publish signal if not prompting for version
         if (ADD_VERSION_ON_PUBLISH and not PROMPT_VERSION_ON_PUBLISH) and not page.application_namespace:
+            if DEFERRED_SNAPSHOTS:
+                # the job is recorded once the publish is committed, the worker creates the version
+                from cms.utils.permissions import get_current_user
+                from djangocms_reversion2.jobs import enqueue_snapshot_on_commit
+                enqueue_snapshot_on_commit(page, language, title='auto', comment='Auto before publish',
+                                           user=get_current_user(), published=True)
+                return
+
             PageVersion.create_version(page, language,
                                        version_parent=None,
                                        title = 'auto',
@@ -93,6 +111,42 @@ def handle_page_delete(sender, instance, **kwargs):
         pv.delete()
 
 
+def handle_page_version_delete(sender, instance, **kwargs):
+    # delta versions depending on the deleted version have to store their full state first
+    from djangocms_reversion2.storage import promote_to_keyframe
+    for child in instance.children.filter(keyframe=False):
+        promote_to_keyframe(child)
+    # the chain continues at the parent of the deleted version, which is read again because it might have been
+    # deleted in the same batch
+    parent_id = sender.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+    instance.children.update(parent=parent_id)
+
+
+def handle_page_version_deleted(sender, instance, **kwargs):
+    # the deleted version might have been the latest one
+    from djangocms_reversion2.models import PageVersionCounter
+    PageVersionCounter.refresh(instance.draft_id, instance.language)
+
+
+def handle_tree_root_delete(sender, instance, **kwargs):
+    from djangocms_reversion2 import registry
+    registry.invalidate(instance.site_id)
+
+
+def handle_page_moved(**kwargs):
+    # the node paths of the registered roots may have changed
+    if kwargs.get('operation') == MOVE_PAGE:
+        from djangocms_reversion2 import registry
+        registry.invalidate()
+
+
+def handle_page_reverted(**kwargs):
+    # the draft has been replaced by the live page
+    if kwargs.get('operation') == REVERT_PAGE_TRANSLATION_TO_LIVE:
+        from djangocms_reversion2.diff import invalidate_rendered_placeholders
+        invalidate_rendered_placeholders(kwargs.get('obj'))
+
+
 # def delete_hidden_page(sender, **kwargs):
 #     # deleting a PageVersion deletes its hidden page in the PageTree
 #     # This signal handler deletes the hidden page associated to a PageVersion
@@ -108,14 +162,23 @@ def handle_page_delete(sender, instance, **kwargs):
 
 
 def connect_all_plugins():
-    from cms.signals import post_placeholder_operation, post_publish, pre_obj_operation
+    from cms.signals import post_obj_operation, post_placeholder_operation, post_publish, pre_obj_operation
 
     post_placeholder_operation.connect(handle_placeholder_change, dispatch_uid='reversion2_placeholder')
     signals.post_save.connect(mark_title_dirty, sender='cms.Title', dispatch_uid='reversion2_title')
+    signals.post_save.connect(handle_page_save, sender='cms.Page', dispatch_uid='reversion2_page_save')
     signals.pre_delete.connect(handle_page_delete, sender='cms.Page', dispatch_uid='reversion2_page')
+    signals.pre_delete.connect(handle_page_version_delete, sender='djangocms_reversion2.PageVersion',
+                               dispatch_uid='reversion2_page_version_delta')
+    signals.post_delete.connect(handle_page_version_deleted, sender='djangocms_reversion2.PageVersion',
+                                dispatch_uid='reversion2_page_version_counter')
+    signals.post_delete.connect(handle_tree_root_delete, sender='djangocms_reversion2.TreeRoot',
+                                dispatch_uid='reversion2_tree_root')
     # signals.pre_delete.connect(delete_hidden_page, sender='djangocms_reversion2.PageVersion',
     #                             dispatch_uid='reversion2_page_version')
     post_publish.connect(handle_page_publish, dispatch_uid='reversion2_page_publish')
     pre_obj_operation.connect(handle_page_reverted_to_live,
                                dispatch_uid='reversion2_page_revert_to_live')
+    post_obj_operation.connect(handle_page_moved, dispatch_uid='reversion2_page_moved')
+    post_obj_operation.connect(handle_page_reverted, dispatch_uid='reversion2_page_reverted')
 
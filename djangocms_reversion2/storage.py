@@ -0,0 +1,392 @@
+import hashlib
+import json
+import re
+from collections import defaultdict
+
+from cms.models import CMSPlugin
+from cms.utils.plugins import build_plugin_tree, get_bound_plugins
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils.encoding import is_protected_type
+
+# Snapshot storage modes
+# 'copy' keeps a full copy of every plugin on the hidden page (the classic behaviour)
+# 'blob' hashes each plugin subtree and stores identical subtrees only once
+# 'delta' is blob storage, but only the placeholders which differ from the parent version are referenced
+STORAGE_COPY = 'copy'
+STORAGE_BLOB = 'blob'
+STORAGE_DELTA = 'delta'
+
+STORAGE_CHOICES = (
+    (STORAGE_COPY, 'copy'),
+    (STORAGE_BLOB, 'blob'),
+    (STORAGE_DELTA, 'delta'),
+)
+
+# CMSPlugin bookkeeping fields: they describe where a plugin lives, not what it contains
+PLUGIN_TREE_FIELDS = ('id', 'placeholder', 'parent', 'position', 'language', 'plugin_type',
+                      'creation_date', 'changed_date', 'path', 'depth', 'numchild')
+
+
+# <cms-plugin ... id="12"> references of nested plugins, the ids change with every copy
+NESTED_PLUGIN_ID = re.compile(r'(<cms-plugin\b[^>]*?\bid=")\d+(")')
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+
+
+def get_plugin_fields(instance):
+    """
+    Returns the content fields of a (downcasted) plugin instance
+    """
+    fields = []
+    for field in instance._meta.concrete_fields:
+        if field.name in PLUGIN_TREE_FIELDS:
+            continue
+        if field.remote_field and field.remote_field.parent_link:
+            # cmsplugin_ptr
+            continue
+        fields.append(field)
+    return fields
+
+
+def serialize_plugin(instance):
+    data = {}
+    for field in get_plugin_fields(instance):
+        value = field.value_from_object(instance)
+        if not is_protected_type(value):
+            value = field.value_to_string(instance)
+        data[field.attname] = value
+    return data
+
+
+def deserialize_plugin(model, fields):
+    instance = model()
+    for field in get_plugin_fields(instance):
+        if field.attname in fields:
+            setattr(instance, field.attname, field.to_python(fields[field.attname]))
+    return instance
+
+
+def has_custom_relations(instance):
+    """
+    Plugins that copy their own relations (or have m2m fields) hold content outside of their own row,
+    which can not be captured in a blob.
+    """
+    model = type(instance)
+    return model.copy_relations is not CMSPlugin.copy_relations or bool(model._meta.many_to_many)
+
+
+def get_page_plugins(page, language):
+    """
+    Returns {slot: [plugin, ...]} with downcasted plugins in tree order for all placeholders of the page.
+    The plugins come with their placeholder and their children (child_plugin_instances), so they can be rendered
+    without further queries.
+    """
+    placeholders = {placeholder.pk: placeholder for placeholder in page.placeholders.all()}
+    plugins = CMSPlugin.objects.filter(placeholder__in=placeholders.keys(), language=language).order_by('path')
+    plugins_by_slot = {placeholder.slot: [] for placeholder in placeholders.values()}
+    for plugin in get_bound_plugins(list(plugins)):
+        plugin.placeholder = placeholders[plugin.placeholder_id]
+        plugins_by_slot[plugin.placeholder.slot].append(plugin)
+    for plugins in plugins_by_slot.values():
+        if plugins:
+            build_plugin_tree(plugins)
+    return plugins_by_slot
+
+
+def fingerprint_plugins(plugins):
+    """
+    Hashes the content of a placeholder's plugin tree, independent of the plugin ids
+    :param plugins: downcasted plugins of one placeholder in tree (path) order
+    :return: the fingerprint or None if a plugin holds content outside of its row (see has_custom_relations),
+             None never equals another fingerprint
+    """
+    sha = hashlib.sha1()
+    for plugin in plugins:
+        if has_custom_relations(plugin):
+            return None
+        fields = {name: NESTED_PLUGIN_ID.sub(r'\1\2', value) if isinstance(value, str) else value
+                  for name, value in serialize_plugin(plugin).items()}
+        sha.update(_dumps([plugin.plugin_type, plugin.depth, fields]).encode('utf-8'))
+    return sha.hexdigest()
+
+
+# fingerprint of a placeholder without plugins (or of a missing placeholder)
+EMPTY_FINGERPRINT = fingerprint_plugins([])
+
+
+def get_page_fingerprints(page, language, plugins_by_slot=None):
+    """
+    :param plugins_by_slot: the plugins of the page (see get_page_plugins) if they have been loaded already
+    :return: {slot: fingerprint}
+    """
+    if plugins_by_slot is None:
+        plugins_by_slot = get_page_plugins(page, language)
+    return {slot: fingerprint_plugins(plugins) for slot, plugins in plugins_by_slot.items()}
+
+
+def can_store_blobs(plugins_by_slot):
+    for plugins in plugins_by_slot.values():
+        for plugin in plugins:
+            if has_custom_relations(plugin):
+                return False
+    return True
+
+
+def build_blobs(plugins):
+    """
+    Hashes every subtree of a placeholder's plugin tree bottom-up.
+    :param plugins: downcasted plugins of one placeholder in tree (path) order
+    :return: (root entries, {digest: (plugin_type, data)})
+    """
+    children = defaultdict(list)
+    for plugin in plugins:
+        children[plugin.parent_id].append(plugin)
+
+    blobs = {}
+
+    def build(plugin):
+        entries = [build(child) for child in children[plugin.pk]]
+        data = _dumps({'fields': serialize_plugin(plugin), 'children': entries})
+        digest = hashlib.sha1('{}:{}'.format(plugin.plugin_type, data).encode('utf-8')).hexdigest()
+        blobs[digest] = (plugin.plugin_type, data)
+        # the source id is kept next to the digest so that nested plugin references (i.e. text plugins)
+        # can be rewritten on restore
+        return {'digest': digest, 'source_id': plugin.pk}
+
+    plugin_ids = set(plugin.pk for plugin in plugins)
+    roots = [build(plugin) for plugin in plugins if plugin.parent_id not in plugin_ids]
+    return roots, blobs
+
+
+def save_blobs(blobs):
+    """
+    Writes the blobs which are not stored yet
+    :return: number of newly stored blobs
+    """
+    from .models import PluginBlob
+
+    if not blobs:
+        return 0
+    existing = set()
+    for digests in _chunks(blobs.keys()):
+        existing.update(PluginBlob.objects.filter(digest__in=digests).values_list('digest', flat=True))
+    missing = [PluginBlob(digest=digest, plugin_type=plugin_type, data=data)
+               for digest, (plugin_type, data) in blobs.items() if digest not in existing]
+    try:
+        with transaction.atomic():
+            PluginBlob.objects.bulk_create(missing)
+    except IntegrityError:
+        # a concurrent snapshot stored some of the same blobs
+        for blob in missing:
+            PluginBlob.objects.get_or_create(digest=blob.digest,
+                                             defaults={'plugin_type': blob.plugin_type, 'data': blob.data})
+    return len(missing)
+
+
+def store_page_contents(page_version, plugins_by_slot, base=None):
+    """
+    Stores the plugin trees of all placeholders as blobs and references them from the page version
+    :param base: resolved placeholders of the parent version, only slots which differ from it are referenced
+    """
+    from .models import PageVersionPlaceholder
+
+    snapshots = []
+    blobs = {}
+    for slot, plugins in plugins_by_slot.items():
+        roots, slot_blobs = build_blobs(plugins)
+        if base is not None and base.get(slot) == roots:
+            continue
+        blobs.update(slot_blobs)
+        snapshots.append(PageVersionPlaceholder(page_version=page_version, slot=slot, plugins=_dumps(roots)))
+    if base is not None:
+        # placeholders which have been removed since the parent version
+        for slot in set(base.keys()) - set(plugins_by_slot.keys()):
+            snapshots.append(PageVersionPlaceholder(page_version=page_version, slot=slot, plugins='[]'))
+    save_blobs(blobs)
+    PageVersionPlaceholder.objects.bulk_create(snapshots)
+    return snapshots
+
+
+def get_version_chain(page_version):
+    """
+    Returns the page version and its ancestors up to the last keyframe, nearest first
+    """
+    chain = [page_version]
+    while not chain[-1].keyframe and chain[-1].parent_id:
+        chain.append(chain[-1].parent)
+    return chain
+
+
+def resolve_placeholders(page_version):
+    """
+    Replays the deltas from the last keyframe up to the page version
+    :return: {slot: root entries}
+    """
+    from .models import PageVersionPlaceholder
+
+    chain = get_version_chain(page_version)
+    by_version = defaultdict(dict)
+    for snapshot in PageVersionPlaceholder.objects.filter(page_version__in=[version.pk for version in chain]):
+        by_version[snapshot.page_version_id][snapshot.slot] = snapshot.get_plugins()
+
+    placeholders = {}
+    for version in reversed(chain):
+        placeholders.update(by_version[version.pk])
+    return placeholders
+
+
+def get_delta_base(version_parent, keyframe_interval):
+    """
+    Returns the resolved placeholders a new delta version is stored against,
+    or None if the new version has to be a keyframe
+    """
+    if not version_parent or version_parent.storage not in (STORAGE_BLOB, STORAGE_DELTA):
+        return None
+    if len(get_version_chain(version_parent)) >= keyframe_interval:
+        return None
+    return resolve_placeholders(version_parent)
+
+
+def promote_to_keyframe(page_version):
+    """
+    Stores the full placeholder state on a delta version, so that it no longer depends on its ancestors
+    """
+    from .models import PageVersionPlaceholder
+
+    if page_version.keyframe:
+        return
+    placeholders = resolve_placeholders(page_version)
+    with transaction.atomic():
+        page_version.placeholder_snapshots.all().delete()
+        PageVersionPlaceholder.objects.bulk_create([
+            PageVersionPlaceholder(page_version=page_version, slot=slot, plugins=_dumps(roots))
+            for slot, roots in placeholders.items()
+        ])
+        page_version.keyframe = True
+        page_version.save(update_fields=['keyframe'])
+
+
+def restore_plugins(roots, placeholder, language):
+    """
+    Recreates the plugin trees referenced by the root entries in the given placeholder
+    :return: list of the new plugins
+    """
+    from cms.plugin_pool import plugin_pool
+    from .models import PluginBlob
+
+    # fetch all blobs of the placeholder level by level
+    blobs = {}
+    digests = set(entry['digest'] for entry in roots)
+    while digests:
+        for chunk in _chunks(digests):
+            for blob in PluginBlob.objects.filter(digest__in=chunk):
+                blobs[blob.digest] = blob
+        digests = set(child['digest'] for digest in digests for child in blobs[digest].get_data()['children'])
+        digests -= set(blobs.keys())
+
+    plugin_pairs = []
+
+    def restore(entry, parent, position):
+        blob = blobs[entry['digest']]
+        data = blob.get_data()
+        model = plugin_pool.get_plugin(blob.plugin_type).model
+        new_plugin = deserialize_plugin(model, data['fields'])
+        new_plugin.plugin_type = blob.plugin_type
+        new_plugin.placeholder = placeholder
+        new_plugin.language = language
+        new_plugin.position = position
+        new_plugin.parent = parent
+        if parent:
+            new_plugin = parent.add_child(instance=new_plugin)
+        else:
+            new_plugin = CMSPlugin.add_root(instance=new_plugin)
+
+        # in-memory stand-in for the plugin this blob has been taken from
+        old_plugin = deserialize_plugin(model, data['fields'])
+        old_plugin.pk = entry['source_id']
+        old_plugin.plugin_type = blob.plugin_type
+        plugin_pairs.append((new_plugin, old_plugin))
+
+        for child_position, child in enumerate(data['children']):
+            restore(child, new_plugin, child_position)
+
+    for position, entry in enumerate(roots):
+        restore(entry, None, position)
+
+    for new_plugin, old_plugin in plugin_pairs:
+        new_plugin.post_copy(old_plugin, plugin_pairs)
+    return [pair[0] for pair in plugin_pairs]
+
+
+def restore_page_contents(page_version, target, language):
+    """
+    Replaces the plugins of the target page with the plugins stored for the page version
+    """
+    placeholders = {placeholder.slot: placeholder for placeholder in target._clear_placeholders(language)}
+    for slot, roots in resolve_placeholders(page_version).items():
+        placeholder = placeholders.get(slot)
+        if not placeholder:
+            placeholder = target.placeholders.create(slot=slot)
+        restore_plugins(roots, placeholder, language)
+
+
+def materialize(page_version, user=None):
+    """
+    Fills the hidden page of a blob or delta page version with its plugins, so that it can be rendered by the cms.
+    Page versions stored as copies are always materialized.
+    """
+    from cms.api import publish_page
+    from .diff import invalidate_rendered_placeholders
+    from .settings import PUBLISH_HIDDEN_PAGE
+
+    if page_version.materialized:
+        return page_version.hidden_page
+
+    hidden_page = page_version.hidden_page
+    with transaction.atomic():
+        restore_page_contents(page_version, hidden_page, page_version.language)
+        invalidate_rendered_placeholders(hidden_page)
+        page_version.materialized = True
+        page_version.save(update_fields=['materialized'])
+
+    if PUBLISH_HIDDEN_PAGE and user and hidden_page.publisher_public_id:
+        # the public hidden page was published without contents
+        publish_page(hidden_page, user, page_version.language)
+
+    hidden_page.clear_cache(menu=False)
+    return hidden_page
+
+
+def collect_garbage():
+    """
+    Deletes all blobs which are no longer referenced by any page version
+    :return: number of deleted blobs
+    """
+    from .models import PluginBlob, PageVersionPlaceholder
+
+    referenced = set()
+    pending = set()
+    for plugins in PageVersionPlaceholder.objects.values_list('plugins', flat=True).iterator():
+        pending.update(entry['digest'] for entry in json.loads(plugins))
+    while pending:
+        referenced.update(pending)
+        children = set()
+        for digests in _chunks(pending):
+            for data in PluginBlob.objects.filter(digest__in=digests).values_list('data', flat=True):
+                children.update(child['digest'] for child in json.loads(data)['children'])
+        pending = children - referenced
+
+    unreferenced = [pk for pk, digest in PluginBlob.objects.values_list('pk', 'digest').iterator()
+                    if digest not in referenced]
+    for pks in _chunks(unreferenced):
+        PluginBlob.objects.filter(pk__in=pks).delete()
+    return len(unreferenced)
@@ -0,0 +1,360 @@
+"""
+Bulk generator of synthetic cms data for load tests and profiling (see the reversion2_generate_data management
+command): page trees on several sites and languages with text and picture plugins, long version histories under the
+version root and deleted pages in the bin buckets.
+The rows are written with bulk_create instead of cms.api and PageVersion.create_version. Their primary keys and
+tree paths are assigned in advance, so nothing has to be read back while a page and its versions are written.
+"""
+import datetime
+import random
+from collections import Counter, OrderedDict
+
+from cms import api, constants
+from cms.models import CMSPlugin, Page, Placeholder, Title, TreeNode
+from cms.plugin_pool import plugin_pool
+from cms.utils.conf import get_cms_setting
+from cms.utils.i18n import get_language_list
+from cms.utils.permissions import current_user
+from cms.utils.placeholder import get_placeholders
+from django.contrib.sites.models import Site
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from . import registry
+from .settings import BIN_BUCKET_NAMING, BIN_PAGE_LANGUAGE
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do', 'eiusmod',
+         'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua', 'enim', 'ad', 'minim', 'veniam')
+
+PICTURE_PLUGIN = 'PicturePlugin'
+# the body of a text plugin refers to its nested plugins with this tag
+NESTED_PLUGIN_TAG = '<cms-plugin alt="Picture" title="Picture" id="{id}"></cms-plugin>'
+
+
+def random_text(rng, words=40):
+    return '<p>{}</p>'.format(' '.join(rng.choice(WORDS) for i in range(words)))
+
+
+class RowWriter(object):
+    """
+    Collects rows and writes them with bulk_create once batch_size rows are pending.
+    The models are written in the order they have been added first, which has to respect their foreign keys.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.rows = OrderedDict()
+        # {model: [values of the local fields]} of multi-table inherited plugin models
+        self.child_rows = OrderedDict()
+        self.next_ids = {}
+        self.pending = 0
+        self.counts = Counter()
+
+    def next_id(self, model):
+        if model not in self.next_ids:
+            self.next_ids[model] = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        pk = self.next_ids[model]
+        self.next_ids[model] += 1
+        return pk
+
+    def add(self, obj):
+        obj.pk = self.next_id(type(obj))
+        self.rows.setdefault(type(obj), []).append(obj)
+        self._added()
+        return obj
+
+    def add_child(self, model, plugin_id, **values):
+        """
+        Adds the row of a plugin model (e.g. Text), which bulk_create does not support (multi-table inheritance)
+        """
+        fields = model._meta.local_concrete_fields
+        values[model._meta.pk.attname] = plugin_id
+        self.child_rows.setdefault(model, []).append(
+            [field.get_db_prep_save(values[field.attname] if field.attname in values else field.get_default(),
+                                    connection) for field in fields])
+        self._added()
+
+    def _added(self):
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with transaction.atomic():
+            for model, objs in self.rows.items():
+                model.objects.bulk_create(objs, batch_size=self.batch_size)
+                self.counts[model._meta.label] += len(objs)
+            with connection.cursor() as cursor:
+                for model, rows in self.child_rows.items():
+                    fields = model._meta.local_concrete_fields
+                    cursor.executemany('INSERT INTO {table} ({columns}) VALUES ({values})'.format(
+                        table=connection.ops.quote_name(model._meta.db_table),
+                        columns=', '.join(connection.ops.quote_name(field.column) for field in fields),
+                        values=', '.join(['%s'] * len(fields))), rows)
+                    self.counts[model._meta.label] += len(rows)
+        self.rows = OrderedDict((model, []) for model in self.rows)
+        self.child_rows = OrderedDict((model, []) for model in self.child_rows)
+        self.pending = 0
+
+    def sync(self):
+        """
+        Writes the pending rows and moves the sequences of the primary keys past the assigned ones,
+        rows can be created the usual way afterwards
+        """
+        self.flush()
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(self.rows.keys())):
+                cursor.execute(sql)
+        self.next_ids = {}
+
+
+class TreeSteps(object):
+    """
+    Hands out the materialized paths of new nodes of a treebeard MP_Node tree (TreeNode or CMSPlugin)
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.last_steps = {}
+
+    def child_path(self, parent_path=''):
+        if parent_path not in self.last_steps:
+            depth = len(parent_path) // self.model.steplen + 1
+            last = self.model.objects.filter(path__startswith=parent_path, depth=depth).aggregate(last=Max('path'))
+            self.last_steps[parent_path] = self.model._str2int(last['last'][-self.model.steplen:]) \
+                if last['last'] else 0
+        self.last_steps[parent_path] += 1
+        step = self.model._int2str(self.last_steps[parent_path])
+        if len(step) > self.model.steplen:
+            raise ValueError('{} can not hold more than {} nodes under one parent'.format(
+                self.model.__name__, len(self.model.alphabet) ** self.model.steplen - 1))
+        return '{}{}{}'.format(parent_path, self.model.alphabet[0] * (self.model.steplen - len(step)), step)
+
+
+def get_picture_model():
+    """
+    :return: the model of the picture plugin or None if it is not installed or can not be filled in
+    """
+    if PICTURE_PLUGIN not in [plugin.__name__ for plugin in plugin_pool.get_all_plugins()]:
+        return None
+    model = plugin_pool.get_plugin(PICTURE_PLUGIN).model
+    required = [field for field in model._meta.local_concrete_fields
+                if not field.null and not field.has_default() and not field.primary_key and not field.blank]
+    return None if required else model
+
+
+def get_sites(num_sites):
+    sites = list(Site.objects.order_by('pk')[:num_sites])
+    for i in range(len(sites), num_sites):
+        sites.append(Site.objects.create(domain='synthetic-{}.example.com'.format(i), name='synthetic {}'.format(i)))
+    return sites
+
+
+def get_bin_buckets(site, num_buckets):
+    """
+    :return: the bin buckets of the last num_buckets days, created if necessary
+    """
+    from .utils import get_or_create_bin_page_root
+
+    buckets = [get_or_create_bin_page_root(site)]
+    bin_root = Page.objects.get(pk=registry.get_root_page_id(site.pk, registry.BIN_ROOT))
+    for days in range(1, num_buckets):
+        title = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime(BIN_BUCKET_NAMING)
+        page_id = registry.get_root_page_id(site.pk, registry.BIN_BUCKET, title)
+        if page_id:
+            buckets.append(Page.objects.get(pk=page_id))
+            continue
+        bucket = api.create_page(title, constants.TEMPLATE_INHERITANCE_MAGIC, BIN_PAGE_LANGUAGE, parent=bin_root,
+                                 site=site)
+        registry.register(bucket, registry.BIN_BUCKET, title)
+        buckets.append(bucket)
+    return buckets
+
+
+class Generator(object):
+    """
+    Writes the synthetic pages of one run (see generate)
+    """
+
+    def __init__(self, user, languages=1, plugins=5, pictures=0.2, versions=3, template=None, seed=0,
+                 batch_size=1000):
+        from djangocms_text_ckeditor.models import Text
+
+        self.user = user
+        self.username = force_text(user)[:constants.PAGE_USERNAME_MAX_LENGTH] if user else 'script'
+        self.text_model = Text
+        self.num_languages = languages
+        self.num_plugins = plugins
+        self.pictures = pictures
+        self.num_versions = versions
+        self.template = template or get_cms_setting('TEMPLATES')[0][0]
+        self.slots = [placeholder.slot for placeholder in get_placeholders(self.template)]
+        self.rng = random.Random(seed)
+        self.writer = RowWriter(batch_size)
+        self.nodes = TreeSteps(TreeNode)
+        self.plugins = TreeSteps(CMSPlugin)
+        self.picture_model = get_picture_model() if pictures else None
+        self.now = timezone.now()
+        self.num_pages = 0
+
+    def add_page(self, site, parent_node, languages, title, slug, parent_path='', numchild=0, in_navigation=True):
+        """
+        Adds a draft page with its titles and placeholders
+        :return: (page, node, {slot: placeholder id})
+        """
+        node_path = self.nodes.child_path(parent_node.path if parent_node else '')
+        node = self.writer.add(TreeNode(path=node_path, depth=len(node_path) // TreeNode.steplen, numchild=numchild,
+                                        parent_id=parent_node.pk if parent_node else None, site_id=site.pk))
+        page = self.writer.add(Page(node_id=node.pk, publisher_is_draft=True, template=self.template,
+                                    created_by=self.username, changed_by=self.username, in_navigation=in_navigation,
+                                    languages=','.join(languages)))
+        for language in languages:
+            self.writer.add(Title(page_id=page.pk, language=language, title=title, menu_title=title, slug=slug,
+                                  path='{}/{}'.format(parent_path, slug) if parent_path else slug))
+        placeholders = {}
+        for slot in self.slots:
+            placeholder = self.writer.add(Placeholder(slot=slot))
+            self.writer.add(Page.placeholders.through(page_id=page.pk, placeholder_id=placeholder.pk))
+            placeholders[slot] = placeholder.pk
+        self.num_pages += 1
+        return page, node, placeholders
+
+    def add_plugins(self, placeholder_id, language, contents):
+        """
+        :param contents: list of (text, with picture)
+        """
+        for position, (text, with_picture) in enumerate(contents):
+            path = self.plugins.child_path()
+            plugin = self.writer.add(CMSPlugin(path=path, depth=1, numchild=1 if with_picture else 0,
+                                               placeholder_id=placeholder_id, position=position, language=language,
+                                               plugin_type='TextPlugin'))
+            if with_picture:
+                picture = self.writer.add(CMSPlugin(path=self.plugins.child_path(path), depth=2,
+                                                    placeholder_id=placeholder_id, parent_id=plugin.pk, position=0,
+                                                    language=language, plugin_type=PICTURE_PLUGIN))
+                self.writer.add_child(self.picture_model, picture.pk, **self.get_picture_values(picture.pk))
+                text = text + NESTED_PLUGIN_TAG.format(id=picture.pk)
+            self.writer.add_child(self.text_model, plugin.pk, body=text)
+
+    def get_picture_values(self, pk):
+        names = set(field.attname for field in self.picture_model._meta.local_concrete_fields)
+        values = {}
+        if 'external_picture' in names:
+            values['external_picture'] = 'https://picsum.photos/seed/{}/800/600'.format(pk)
+        if 'caption_text' in names:
+            values['caption_text'] = self.rng.choice(WORDS)
+        return values
+
+    def random_contents(self):
+        return {slot: [[random_text(self.rng), self.picture_model is not None and self.rng.random() < self.pictures]
+                       for i in range(self.num_plugins)] for slot in self.slots}
+
+    def add_content_page(self, site, parent_node, languages, index, parent_path='', numchild=0, version_root=None):
+        """
+        Adds a page with random contents in every language and the versions of every language
+        :return: (page, node, path of the titles)
+        """
+        title = 'Synthetic page {}'.format(index)
+        slug = 'synthetic-page-{}'.format(index)
+        page, node, placeholders = self.add_page(site, parent_node, languages, title, slug, parent_path=parent_path,
+                                                 numchild=numchild)
+        for language in languages:
+            contents = self.random_contents()
+            if version_root:
+                self.add_versions(site, page, language, title, slug, contents, version_root)
+            for slot, placeholder_id in placeholders.items():
+                self.add_plugins(placeholder_id, language, contents[slot])
+        return page, node, '{}/{}'.format(parent_path, slug) if parent_path else slug
+
+    def add_versions(self, site, draft, language, title, slug, contents, version_root):
+        """
+        Adds a chain of versions, a random plugin of every placeholder changes from one version to the next.
+        The draft gets the contents of the last version.
+        """
+        from .models import PageVersion, PageVersionCounter
+        from .storage import STORAGE_COPY
+        from .utils import get_hidden_page_slug
+
+        parent_id = None
+        root_path = version_root.get_path(language) or ''
+        for version in range(self.num_versions):
+            if version:
+                for slot_contents in contents.values():
+                    self.rng.choice(slot_contents)[0] = random_text(self.rng)
+            hidden_page, node, placeholders = self.add_page(
+                site, version_root.node, [language], title, get_hidden_page_slug(slug, language, version),
+                parent_path=root_path, in_navigation=False)
+            for slot, placeholder_id in placeholders.items():
+                self.add_plugins(placeholder_id, language, contents[slot])
+            page_version = self.writer.add(PageVersion(
+                parent_id=parent_id, hidden_page_id=hidden_page.pk, draft_id=draft.pk, language=language,
+                active=version == self.num_versions - 1, owner=self.username, storage=STORAGE_COPY,
+                created_at=self.now - datetime.timedelta(hours=self.num_versions - version),
+                changed_by=self.username, page_title=title))
+            parent_id = page_version.pk
+        if self.num_versions:
+            self.writer.add(PageVersionCounter(draft_id=draft.pk, language=language, num_versions=self.num_versions))
+
+    def add_site(self, site, pages=100, depth=4, deleted=10, buckets=1, callback=None):
+        from .utils import get_or_create_version_page_root
+
+        languages = get_language_list(site.pk)[:self.num_languages]
+        # the roots are created with the cms api
+        self.writer.sync()
+        with current_user(self.user):
+            version_root = get_or_create_version_page_root(site, self.user)
+            bin_buckets = get_bin_buckets(site, buckets) if deleted else []
+        self.nodes = TreeSteps(TreeNode)
+
+        # the shape of the tree: parents are added before their children
+        parents, depths, numchild = [], [], Counter()
+        for i in range(pages):
+            eligible = [index for index in range(max(0, i - 20), i) if depths[index] < depth]
+            parent = self.rng.choice(eligible) if eligible and self.rng.random() < 0.8 else None
+            parents.append(parent)
+            depths.append(depths[parent] + 1 if parent is not None else 1)
+            numchild[parent] += 1
+
+        added = []
+        for i, parent in enumerate(parents):
+            page, node, path = added[parent] if parent is not None else (None, None, '')
+            added.append(self.add_content_page(site, node, languages, i, parent_path=path, numchild=numchild[i],
+                                               version_root=version_root))
+            if callback and (i + 1) % 1000 == 0:
+                callback(site, self.num_pages)
+
+        per_bucket = Counter()
+        for i in range(deleted):
+            bucket = self.rng.choice(bin_buckets)
+            self.add_content_page(site, bucket.node, languages, pages + i, version_root=version_root)
+            per_bucket[bucket.node_id] += 1
+
+        self.writer.flush()
+        TreeNode.objects.filter(pk=version_root.node_id).update(
+            numchild=F('numchild') + (pages + deleted) * len(languages) * self.num_versions)
+        for node_id, num in per_bucket.items():
+            TreeNode.objects.filter(pk=node_id).update(numchild=F('numchild') + num)
+        if callback:
+            callback(site, self.num_pages)
+
+
+def generate(user, sites=1, pages=100, depth=4, languages=1, plugins=5, pictures=0.2, versions=3, deleted=10,
+             buckets=1, template=None, seed=0, batch_size=1000, callback=None):
+    """
+    Generates synthetic pages on every site
+    :param pages: number of pages per site, they form trees of up to depth levels
+    :param plugins: number of text plugins per placeholder, pictures is the share of them with a nested picture
+    :param versions: number of versions of every page and language
+    :param deleted: number of deleted pages per site, spread over the bin buckets of the last buckets days
+    :param callback: called with the site and the number of written pages from time to time
+    :return: {model label: number of rows}
+    """
+    generator = Generator(user, languages=languages, plugins=plugins, pictures=pictures, versions=versions,
+                          template=template, seed=seed, batch_size=batch_size)
+    for site in get_sites(sites):
+        generator.add_site(site, pages=pages, depth=depth, deleted=deleted, buckets=buckets, callback=callback)
+    generator.writer.sync()
+    return dict(generator.writer.counts)
@@ -0,0 +1,212 @@
+"""
+Token diff: an alternative to lxml's htmldiff which degrades gracefully on large or heavily rewritten placeholders.
+The html is split into tags, words and whitespace, which are compared with Myers' algorithm. When the edit cost
+exceeds a cutoff (or the time is up) the html is compared by blocks (paragraphs, rows, list items, ...) and when
+that fails as well the old text is shown as deleted and the new html as inserted.
+"""
+import re
+import time
+
+EQUAL = '='
+INSERT = '+'
+DELETE = '-'
+
+TOKEN = re.compile(r'<[^>]*>|\s+|[^\s<]+|<')
+BLOCK = re.compile(r'.*?(?:</(?:p|div|li|tr|table|ul|ol|h[1-6]|blockquote|pre)>|<br\s*/?>|\n)|.+$', re.S | re.I)
+TAG = re.compile(r'<[^>]*>')
+
+
+def tokenize(html):
+    return TOKEN.findall(html)
+
+
+def split_blocks(html):
+    return BLOCK.findall(html)
+
+
+def myers_diff(a, b, max_cost=None, deadline=None):
+    """
+    Compares two token sequences
+    :param max_cost: give up when more than this many tokens have to be inserted or deleted
+    :param deadline: give up at this time.time()
+    :return: list of (EQUAL|INSERT|DELETE, [tokens]) or None if the diff has been given up
+    """
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+
+    edits = _shortest_edit(a[prefix:len(a) - suffix], b[prefix:len(b) - suffix], max_cost, deadline)
+    if edits is None:
+        return None
+
+    ops = []
+    if prefix:
+        ops.append((EQUAL, list(a[:prefix])))
+    for kind, token in edits:
+        if ops and ops[-1][0] == kind:
+            ops[-1][1].append(token)
+        else:
+            ops.append((kind, [token]))
+    if suffix:
+        ops.append((EQUAL, list(a[len(a) - suffix:])))
+    return ops
+
+
+class _GiveUp(Exception):
+    pass
+
+
+def _shortest_edit(a, b, max_cost, deadline):
+    """
+    Myers' O((N+M)D) algorithm in its linear space variant: the middle snake of the shortest edit splits the
+    sequences in two halves, which are compared recursively, so only the furthest reaching paths of the current
+    cost are kept
+    :return: list of (kind, token) or None
+    """
+    edits = []
+    try:
+        _edit(a, 0, len(a), b, 0, len(b), max_cost, deadline, edits)
+    except _GiveUp:
+        return None
+    return edits
+
+
+def _edit(a, a_lo, a_hi, b, b_lo, b_hi, max_cost, deadline, edits):
+    prefix = a_lo
+    while prefix < a_hi and prefix - a_lo < b_hi - b_lo and a[prefix] == b[b_lo + prefix - a_lo]:
+        prefix += 1
+    edits.extend((EQUAL, a[i]) for i in range(a_lo, prefix))
+    b_lo += prefix - a_lo
+    a_lo = prefix
+    suffix = 0
+    while a_hi - suffix > a_lo and b_hi - suffix > b_lo and a[a_hi - 1 - suffix] == b[b_hi - 1 - suffix]:
+        suffix += 1
+    a_hi -= suffix
+    b_hi -= suffix
+
+    if a_lo == a_hi:
+        edits.extend((INSERT, b[j]) for j in range(b_lo, b_hi))
+    elif b_lo == b_hi:
+        edits.extend((DELETE, a[i]) for i in range(a_lo, a_hi))
+    else:
+        # the sequences differ at both ends, so each half has fewer edits than the whole
+        x, y, u, v = _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi, max_cost, deadline)
+        _edit(a, a_lo, a_lo + x, b, b_lo, b_lo + y, None, deadline, edits)
+        edits.extend((EQUAL, a[i]) for i in range(a_lo + x, a_lo + u))
+        _edit(a, a_lo + u, a_hi, b, b_lo + v, b_hi, None, deadline, edits)
+
+    edits.extend((EQUAL, a[i]) for i in range(a_hi, a_hi + suffix))
+
+
+def _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi, max_cost, deadline):
+    """
+    Searches the shortest edit forward from the start and backward from the end until the paths overlap
+    :return: (x, y, u, v), the snake from (x, y) to (u, v) in the middle of the shortest edit, relative to a_lo, b_lo
+    """
+    n, m = a_hi - a_lo, b_hi - b_lo
+    delta = n - m
+    odd = delta % 2
+    forward = {1: 0}
+    backward = {1: 0}
+    for d in range((n + m + 1) // 2 + 1):
+        if deadline and time.time() > deadline:
+            raise _GiveUp
+        # the forward search of cost d finds edits of cost 2d - 1, the backward search of cost 2d
+        if max_cost is not None and 2 * d - 1 > max_cost:
+            raise _GiveUp
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1]
+            else:
+                x = forward[k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            forward[k] = x
+            if odd and delta - d < k < delta + d and x + backward[delta - k] >= n:
+                return start_x, start_y, x, y
+
+        if max_cost is not None and 2 * d > max_cost:
+            raise _GiveUp
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a_hi - 1 - x] == b[b_hi - 1 - y]:
+                x += 1
+                y += 1
+            backward[k] = x
+            if not odd and -d <= delta - k <= d and x + forward[delta - k] >= n:
+                return n - x, m - y, n - start_x, m - start_y
+    raise _GiveUp
+
+
+def render_token_diff(ops):
+    """
+    Marks the inserted and deleted text with <ins> and <del>; the tags of the new html are kept and the deleted
+    tags are dropped, so the result has the structure of the new html
+    """
+    out = []
+    for kind, tokens in ops:
+        if kind == EQUAL:
+            out.extend(tokens)
+            continue
+        tag = 'ins' if kind == INSERT else 'del'
+        run = []
+        for token in tokens + ['<']:
+            if not token.startswith('<'):
+                run.append(token)
+                continue
+            text = ''.join(run)
+            if text.strip():
+                out.append('<{0}>{1}</{0}>'.format(tag, text))
+            elif kind == INSERT:
+                out.append(text)
+            run = []
+            if kind == INSERT and token != '<':
+                out.append(token)
+    return ''.join(out)
+
+
+def render_block_diff(ops):
+    out = []
+    for kind, blocks in ops:
+        html = ''.join(blocks)
+        if kind == EQUAL:
+            out.append(html)
+        elif kind == INSERT:
+            out.append('<ins>{}</ins>'.format(html))
+        else:
+            # the tags of deleted blocks might not be balanced
+            text = TAG.sub(' ', html).strip()
+            if text:
+                out.append('<del>{}</del>'.format(text))
+    return ''.join(out)
+
+
+def render_replaced(text1, text2):
+    # the tags of the old html are dropped like those of deleted blocks
+    text = ' '.join(TAG.sub(' ', text1).split())
+    return ('<del>{}</del>'.format(text) if text else '') + ('<ins>{}</ins>'.format(text2) if text2 else '')
+
+
+def block_diff(text1, text2, max_cost=None, deadline=None):
+    ops = myers_diff(split_blocks(text1), split_blocks(text2), max_cost=max_cost, deadline=deadline)
+    if ops is None:
+        return render_replaced(text1, text2)
+    return render_block_diff(ops)
+
+
+def token_diff(text1, text2, max_cost=None, deadline=None):
+    ops = myers_diff(tokenize(text1), tokenize(text2), max_cost=max_cost, deadline=deadline)
+    if ops is None:
+        return block_diff(text1, text2, max_cost=max_cost, deadline=deadline)
+    return render_token_diff(ops)
@@ -1,4 +1,3 @@
-from __future__ import absolute_import, print_function, unicode_literals
 from django.conf.urls import *  # NOQA
 
 from .views import view_revision
@@ -1,7 +1,7 @@
 
-from __future__ import unicode_literals
-
+import copy
 import datetime
+import logging
 
 from cms import api, constants
 from cms.api import publish_page
@@ -9,21 +9,78 @@ from cms.constants import PUBLISHER_STATE_DIRTY, PUBLISHER_STATE_PENDING
 from cms.exceptions import PublicIsUnmodifiable
 from cms.models import Page, Title
 from django.conf import settings
-from django.db import IntegrityError
+from django.contrib.sites.models import Site
+from django.db import transaction
+from django.db.models.base import ModelState
 from django.template.defaultfilters import slugify
 
-from .settings import VERSION_ROOT_TITLE, VERSION_START_VALUE, BIN_ROOT_TITLE, PUBLISH_HIDDEN_PAGE, \
-    ADD_VERSION_ON_PUBLISH, \
-    BATCH_ADD_UNVERSIONED_ONLY, BIN_BUCKET_NAMING, BIN_PAGE_LANGUAGE
+from . import instrumentation, registry
+from .settings import VERSION_ROOT_TITLE, BIN_ROOT_TITLE, PUBLISH_HIDDEN_PAGE, BIN_BUCKET_NAMING, \
+    BIN_PAGE_LANGUAGE
+
+logger = logging.getLogger(__name__)
+
+
+def copy_page_shell(page, parent_page, language):
+    """
+    Copy a page with its title and empty placeholders, but without any plugins
+    (a reduced version of cms.models.Page.copy)
+    """
+    new_node = parent_page.node.add_child(site=page.node.site)
+
+    new_page = copy.copy(page)
+    new_page._state = ModelState()
+    new_page._clear_internal_cache()
+    new_page.pk = None
+    new_page.node = new_node
+    # the copy of a public page is a draft as well
+    new_page.publisher_is_draft = True
+    new_page.publisher_public_id = None
+    new_page.is_home = False
+    new_page.reverse_id = None
+    new_page.publication_date = None
+    new_page.publication_end_date = None
+    new_page.languages = ''
+    new_page.save()
+    new_page.node.__dict__['item'] = new_page
+
+    # the slug and path are set by copy_page
+    translations = page.title_set.filter(language=language)
+    for title in translations:
+        title = copy.copy(title)
+        title.pk = None
+        title.page = new_page
+        title.published = False
+        title.publisher_is_draft = True
+        title.publisher_public = None
+        title.save()
+        new_page.title_cache[title.language] = title
+    new_page.update_languages([trans.language for trans in translations])
+
+    for placeholder in page.placeholders.all():
+        new_page.placeholders.create(slot=placeholder.slot, default_width=placeholder.default_width)
+
+    from cms.extensions import extension_pool
+    extension_pool.copy_extensions(page, new_page)
+    return new_page
 
 
 def copy_page(page,
               parent_page,
               version_id=None,
               language=None,
-              include_descendants=False):
-
-    if include_descendants:
+              include_descendants=False,
+              include_plugins=True):
+
+    if not include_plugins:
+        new_page = copy_page_shell(page, parent_page, language)
+    elif not page.publisher_is_draft:
+        # the published state of a page, the cms only copies drafts
+        new_page = copy_page_shell(page, parent_page, language)
+        new_placeholders = {placeholder.slot: placeholder for placeholder in new_page.placeholders.all()}
+        for placeholder in page.placeholders.all():
+            placeholder.copy_plugins(new_placeholders[placeholder.slot], language=language)
+    elif include_descendants:
         new_page = page.copy_with_descendants(target_node=parent_page.node,
                                               position='last-child',
                                               copy_permissions=False,
@@ -58,22 +115,34 @@ def copy_page(page,
     new_page.in_navigation = False
     new_page.save()
 
-    new_page.clear_cache(menu=True)
+    clear_cache_on_commit(new_page, menu=True)
 
     return new_page
 
 
+def clear_cache_on_commit(page, menu=False):
+    """
+    Clears the cms cache of a page once the current transaction has been committed, so that concurrent requests
+    cannot cache the state from before the commit again
+    """
+    transaction.on_commit(lambda: page.clear_cache(menu=menu))
+
+
 def get_or_create_version_page_root(site, user, language=settings.LANGUAGES[0][0]):
-    try:
-        version_page = Page.objects.get(title_set__title=VERSION_ROOT_TITLE,
-                                        publisher_is_draft=True,
-                                        node__site=site)
-    except Page.DoesNotExist:
-        version_page = api.create_page(VERSION_ROOT_TITLE,
-                                       constants.TEMPLATE_INHERITANCE_MAGIC,
-                                       language,
-                                       site=site)
-        version_page.clear_cache(menu=False)
+    version_page = _get_registered_page(site, registry.VERSION_ROOT)
+    if not version_page:
+        with transaction.atomic():
+            # Lock the site so that concurrent snapshots (i.e. batch workers) create only one root
+            Site.objects.select_for_update().filter(pk=site.pk).first()
+            registry.invalidate(site.pk)
+            version_page = _get_registered_page(site, registry.VERSION_ROOT)
+            if not version_page:
+                version_page = api.create_page(VERSION_ROOT_TITLE,
+                                               constants.TEMPLATE_INHERITANCE_MAGIC,
+                                               language,
+                                               site=site)
+                clear_cache_on_commit(version_page)
+                registry.register(version_page, registry.VERSION_ROOT)
 
     if PUBLISH_HIDDEN_PAGE and not version_page.get_public_object():
         # Need to publish parent page to allow child pages to be published
@@ -85,47 +154,82 @@ def get_or_create_version_page_root(site, user, language=settings.LANGUAGES[0][0
     return version_page
 
 
+def get_or_create_version_bucket(site, name, user, language=settings.LANGUAGES[0][0]):
+    """
+    Returns the child page of the version root with the given name, which holds the hidden pages of one batch
+    worker: workers adding to different buckets neither wait for each other on the version root's tree node
+    nor collide on tree paths.
+    """
+    bucket = _get_registered_page(site, registry.VERSION_BUCKET, name)
+    if bucket:
+        return bucket
+
+    version_page = get_or_create_version_page_root(site=site, user=user, language=language)
+    with transaction.atomic():
+        Site.objects.select_for_update().filter(pk=site.pk).first()
+        registry.invalidate(site.pk)
+        bucket = _get_registered_page(site, registry.VERSION_BUCKET, name)
+        if not bucket:
+            bucket = api.create_page(name, constants.TEMPLATE_INHERITANCE_MAGIC, language, parent=version_page,
+                                     site=site)
+            clear_cache_on_commit(bucket)
+            registry.register(bucket, registry.VERSION_BUCKET, name)
+
+    if PUBLISH_HIDDEN_PAGE and not bucket.get_public_object():
+        api.publish_page(bucket, user, language).clear_cache(menu=False)
+    return bucket
+
+
 def get_or_create_bin_page_root(site):
     # Retrieve the bin page or create it
-    try:
-        bin_root_page = Page.objects.get(title_set__title=BIN_ROOT_TITLE,
-                                         node__site=site)
-    except Page.DoesNotExist:
+    bin_root_page = _get_registered_page(site, registry.BIN_ROOT)
+    if not bin_root_page:
         bin_root_page = api.create_page(BIN_ROOT_TITLE,
                                         constants.TEMPLATE_INHERITANCE_MAGIC,
                                         language=BIN_PAGE_LANGUAGE,
                                         site=site)
         bin_root_page.clear_cache(menu=False)
-    except Page.MultipleObjectsReturned:
-        bin_root_page = Page.objects.filter(title_set__title=BIN_ROOT_TITLE,
-                                            node__site=site).first()
+        registry.register(bin_root_page, registry.BIN_ROOT)
 
     # Get the sub-bin page
     bucket_title = datetime.datetime.now().strftime(BIN_BUCKET_NAMING)
-    try:
-        bin_page = Page.objects.get(title_set__title=bucket_title,
-                                    node__site=site)
-    except Page.DoesNotExist:
+    bin_page = _get_registered_page(site, registry.BIN_BUCKET, bucket_title)
+    if not bin_page:
         bin_page = api.create_page(bucket_title,
                                    constants.TEMPLATE_INHERITANCE_MAGIC,
                                    BIN_PAGE_LANGUAGE,
                                    parent=bin_root_page,
                                    site=site)
         bin_page.clear_cache(menu=False)
+        registry.register(bin_page, registry.BIN_BUCKET, bucket_title)
 
     return bin_page
 
 
+def _get_registered_page(site, kind, name=''):
+    page_id = registry.get_root_page_id(site.pk, kind, name)
+    if page_id:
+        page = Page.objects.filter(pk=page_id).select_related('node').first()
+        if page:
+            return page
+        # the page has been removed behind the registry's back
+        registry.invalidate(site.pk)
+    return None
+
+
 def get_hidden_page_slug(slug, language, version_id):
     return slugify('{slug}-{lang}-{ver}'.format(slug=slug,
                                                 lang=language,
                                                 ver=str(version_id).replace('.', '-')))
 
 
-def revise_page(page, language, user, version_id=None):
+def revise_page(page, language, user, version_id=None, include_plugins=True, source=None, bucket=None):
     """
     Copy a page [ and all its descendants to a new location ]
     Doesn't checks for add page permissions anymore, this is done in PageAdmin.
+    :param source: the page which is copied instead of the draft page, i.e. its public page
+    :param bucket: name of the version bucket the copy is added to instead of the version root
+        (see get_or_create_version_bucket)
 
     Note for issue #1166: when copying pages there is no need to check for
     conflicting URLs as pages are copied unpublished.
@@ -147,63 +251,78 @@ def revise_page(page, language, user, version_id=None):
 
     # avoid muting input param
     page = Page.objects.get(pk=page.pk)
+    source = Page.objects.get(pk=source.pk) if source else page
 
     # Get Version root page
     site = page.node.site
-    version_page_root = get_or_create_version_page_root(site=site, user=user)
+    if bucket:
+        version_page_root = get_or_create_version_bucket(site, bucket, user)
+    else:
+        version_page_root = get_or_create_version_page_root(site=site, user=user)
 
     # create a copy of this page
-    new_page = copy_page(page, version_id=version_id, parent_page=version_page_root, language=language)
+    with instrumentation.instrument(instrumentation.COPY_HIDDEN_PAGE, page=page.pk, language=language):
+        new_page = copy_page(source, version_id=version_id, parent_page=version_page_root, language=language,
+                             include_plugins=include_plugins)
 
     # Publish the page if required
     if PUBLISH_HIDDEN_PAGE:
-        new_page = publish_page(new_page, user, language)
+        with instrumentation.instrument(instrumentation.PUBLISH_HIDDEN_PAGE, page=page.pk, language=language):
+            new_page = publish_page(new_page, user, language)
 
     # invalidate the menu for this site
-    new_page.clear_cache(menu=True)
+    clear_cache_on_commit(new_page, menu=True)
 
-    print('Created new version {ver} for: "{page}"'.format(ver=version_id, page=new_page.get_title(language=language)))
+    logger.info('Created new version %s for: "%s"', version_id, new_page.get_title(language=language))
 
     return new_page
 
 
 def delete_page(page):
-    # avoid muting input param
-    page = Page.objects.get(pk=page.pk)
+    with instrumentation.instrument(instrumentation.BIN_MOVE, page=page.pk):
+        # avoid muting input param
+        page = Page.objects.get(pk=page.pk)
 
-    # Get site and bucket page
-    site = page.node.site
-    bin_page_root = get_or_create_bin_page_root(site=site)
+        # Get site and bucket page
+        site = page.node.site
+        bin_page_root = get_or_create_bin_page_root(site=site)
 
-    # create a copy of this page
-    new_page = page.move_page(target_node=bin_page_root.node, position='last-child')
+        # create a copy of this page
+        new_page = page.move_page(target_node=bin_page_root.node, position='last-child')
 
-    # invalidate the menu for this site
-    new_page.in_navigation = False
-    new_page.save()
+        # invalidate the menu for this site
+        new_page.in_navigation = False
+        new_page.save()
 
-    new_page.clear_cache(menu=True)
+        new_page.clear_cache(menu=True)
 
-    print('Created copy of deleted page: "{page}"'.format(page=new_page.get_title(language=settings.LANGUAGES[0][0])))
+    logger.info('Created copy of deleted page: "%s"', new_page.get_title(language=settings.LANGUAGES[0][0]))
 
     return new_page
 
 
 def revert_page(page_version, language):
+    from .diff import invalidate_rendered_placeholders
     from .models import PageVersion
-    # copy all relevant attributes from hidden_page to draft
-    source = page_version.hidden_page
-    target = page_version.draft
+    from .storage import restore_page_contents
+    with instrumentation.instrument(instrumentation.REVERT, page_version=page_version.pk, language=language):
+        # copy all relevant attributes from hidden_page to draft
+        source = page_version.hidden_page
+        target = page_version.draft
 
-    _copy_titles(source, target, language)
-    source._copy_contents(target, language)
+        _copy_titles(source, target, language)
+        if page_version.materialized:
+            source._copy_contents(target, language)
+        else:
+            restore_page_contents(page_version, target, language)
+        invalidate_rendered_placeholders(target)
 
-    source._copy_attributes(target)
+        source._copy_attributes(target)
 
-    PageVersion.objects.filter(draft=page_version.draft, language=language).update(active=False)
-    page_version.active = True
-    page_version.dirty = False
-    page_version.save()
+        PageVersion.objects.filter(draft=page_version.draft, language=language).update(active=False)
+        page_version.active = True
+        page_version.dirty = False
+        page_version.save()
 
 
 def _copy_titles(source, target, language):
@@ -253,60 +372,12 @@ def get_draft_of_version_page(page):
     return page.page_version.draft
 
 
-def revise_all_pages():
-
-    raise Exception('''TODO - 
-                        1. French versions are not getting labels correctly??
-                        2. Copy/repace this function with a prompt for version and initial revision i.e. OAT Versions
-                        3. Spinning wheel when publishing > close modal on complete
-                        ''')
-
-
-
+def revise_all_pages(limit=None):
     """
     Revise all pages (exclude the bin and versioned pages)
+    The batch is resumable: with a limit, the next call continues where this one stopped (see batch.py)
     :return: number of created revisions
     """
-    from .models import PageVersion
-    num = 0
-    integrity_errors = 0
-
-    # Exclude Version Pages
-    get_pages_to_version = Page.objects.all().exclude(title_set__title=BIN_ROOT_TITLE).exclude(
-                                             parent__title_set__title=BIN_ROOT_TITLE).exclude(
-                                             parent__title_set__title=VERSION_ROOT_TITLE)
-    # Get published pages only
-    if ADD_VERSION_ON_PUBLISH:
-        get_pages_to_version.filter(published = True, parent__published=True)
-
-    for page in get_pages_to_version.iterator():
-        draft = page.get_draft_object()
-
-        for language in page.languages.split(','):
-
-            # Skip if the page already has a version
-            if draft.page_versions.filter(language=language).exists() and BATCH_ADD_UNVERSIONED_ONLY:
-                continue
-            try:
-                try:
-                    # this is necessary, because an IntegrityError makes a rollback necessary
-                    #with transaction.atomic():
-                    PageVersion.create_version(draft=draft,
-                                               language=language,
-                                               version_parent=None,
-                                               title='Initial',
-                                               comment='Initial Revision - batch created',
-                                               version_id=VERSION_START_VALUE)
-                except IntegrityError as e:
-                    print("Integrity Error - {}".format(e))
-                    integrity_errors += 1
-                else:
-                    print("num: {}, \ti:{}".format(num, integrity_errors))
-                    num += 1
-            except AssertionError as a:
-                print("Assertion Error - {}".format(a))
-                pass
-    print('integrity_errors: {}'.format(integrity_errors))
-    return num
-
-
+    from .batch import revise_pages
+    run = revise_pages(name='revise_all_pages', limit=limit)
+    return run.created
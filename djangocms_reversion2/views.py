@@ -1,14 +1,28 @@
+import hashlib
+from datetime import datetime, timedelta
+
+from cms.models import Page
 from cms.utils.page_permissions import user_can_view_page
 from cms.utils.permissions import get_current_user
-from django.http import Http404
-from django.shortcuts import render, redirect
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, Max, Q
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
+from django.utils import formats, timezone
+from django.views.decorators.http import condition
 # Create your views here.
 from sekizai.context import SekizaiContext
 
 from djangocms_reversion2.models import PageVersion
+from djangocms_reversion2.settings import HISTORY_PAGE_SIZE
+from djangocms_reversion2.storage import materialize
 
 VIEW_REVISION_TEMPLATE = 'djangocms_reversion2/view_revision.html'
 
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 
 def view_revision(request, **kwargs):
     # render a page for a popup in an old revision
@@ -26,6 +40,9 @@ def view_revision(request, **kwargs):
         else:
             raise Http404
 
+    # blob stored versions get their plugins back on first view
+    materialize(page_version, user)
+
     page_absolute_url = page_version.hidden_page.get_draft_url(language=language)
 
     context = SekizaiContext({
@@ -37,3 +54,93 @@ def view_revision(request, **kwargs):
     })
 
     return render(request, VIEW_REVISION_TEMPLATE, context=context.flatten())
+
+
+def get_epoch(aware=True):
+    # the creation times are naive without USE_TZ
+    return EPOCH if aware else timezone.make_naive(EPOCH, timezone.utc)
+
+
+def encode_cursor(created_at, pk):
+    delta = created_at - get_epoch(timezone.is_aware(created_at))
+    return '{}_{}'.format((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds, pk)
+
+
+def decode_cursor(cursor):
+    """
+    :return: (creation time, page version id) of the last entry of the previous page
+    :raises ValueError: for a malformed cursor
+    """
+    microseconds, pk = cursor.split('_')
+    return get_epoch(settings.USE_TZ) + timedelta(microseconds=int(microseconds)), int(pk)
+
+
+def get_history_page(versions, after=None, page_size=None):
+    """
+    Returns one page of the versions, newest first, ordered by their creation time and id
+    :param after: cursor of the last entry of the previous page (see encode_cursor)
+    :return: (list of dicts, cursor of the next page or None)
+    """
+    page_size = page_size or HISTORY_PAGE_SIZE
+    versions = versions.order_by('-created_at', '-pk')
+    if after:
+        created_at, pk = decode_cursor(after)
+        versions = versions.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    entries = list(versions.values('pk', 'title', 'comment', 'version_id', 'active', 'dirty',
+                                   'created_at')[:page_size + 1])
+    next_cursor = None
+    if len(entries) > page_size:
+        entries = entries[:page_size]
+        next_cursor = encode_cursor(entries[-1]['created_at'], entries[-1]['pk'])
+    return entries, next_cursor
+
+
+def version_history(request, **kwargs):
+    """
+    Version history of a draft for the sidebar of the diff view as JSON, paginated with ?after=<cursor>.
+    The ETag and Last-Modified headers change with every new, changed or deleted version and when the active version
+    gets dirty. The history is listed to the users who may view the diff of the page (see PageVersionAdmin.diff_view).
+    """
+    page_pk = kwargs.pop('page_pk')
+    language = request.GET.get('language')
+    draft = get_object_or_404(Page, pk=page_pk).get_draft_object()
+
+    user = get_current_user()
+    if not user_can_view_page(user, draft):
+        raise PermissionDenied
+
+    versions = PageVersion.objects.filter(draft=draft, language=language)
+    latest = versions.aggregate(count=Count('pk'), last_id=Max('pk'), last_modified=Max('changed_at'))
+    active = versions.filter(active=True).values_list('pk', 'dirty').first()
+    etag = hashlib.md5('{}:{}:{}:{}:{}'.format(
+        latest['count'], latest['last_id'], latest['last_modified'], active, request.GET.urlencode()
+    ).encode('utf-8')).hexdigest()
+
+    @condition(etag_func=lambda request: etag, last_modified_func=lambda request: latest['last_modified'])
+    def history(request):
+        try:
+            entries, next_cursor = get_history_page(versions, after=request.GET.get('after'))
+        except ValueError:
+            return HttpResponseBadRequest('invalid cursor')
+
+        diff_url = 'admin:djangocms_reversion2_diff_view'
+        data = []
+        for entry in entries:
+            created_at = entry['created_at']
+            if timezone.is_aware(created_at):
+                created_at = timezone.localtime(created_at)
+            data.append({
+                'id': entry['pk'],
+                'title': entry['title'],
+                'comment': entry['comment'],
+                'version_id': str(entry['version_id']) if entry['version_id'] else None,
+                'active': entry['active'],
+                'dirty': entry['dirty'],
+                'date': created_at.isoformat(),
+                'day': formats.date_format(created_at),
+                'time': formats.time_format(created_at),
+                'url': '{}?language={}'.format(reverse(diff_url, args=[draft.pk, entry['pk'], 0]), language),
+            })
+        return JsonResponse({'versions': data, 'next': next_cursor})
+
+    return history(request)
@@ -11,13 +11,11 @@ CLASSIFIERS = [
     'Operating System :: OS Independent',
     'Programming Language :: Python',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.4',
     'Programming Language :: Python :: 3.5',
     'Programming Language :: Python :: 3.6',
     'Programming Language :: Python :: 3.7',
     'Programming Language :: Python :: 3.8',
     'Framework :: Django',
-    'Framework :: Django :: 1.11',
     'Framework :: Django :: 2.2',
     'Topic :: Internet :: WWW/HTTP',
     'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
@@ -26,8 +24,8 @@ CLASSIFIERS = [
 ]
 
 REQUIREMENTS = [
-    'django>=1.11',
-    'django-cms>=3.4.3',
+    'django>=2.2,<3.0',
+    'django-cms>=3.7',
     'django-sekizai>=1.0.0',
     'lxml',
 ]
@@ -42,6 +40,7 @@ setup(
     url='https://github.com/mcldev/djangocms-reversion2',
     download_url='https://github.com/mcldev/djangocms-reversion2/archive/{}.zip'.format(__version__),
     install_requires=REQUIREMENTS,
+    python_requires='>=3.5',
     keywords=['django', 'Django CMS', 'version history', 'versioning',
               'reversion', 'revision', 'CMS', 'Blueshoe', 'basket', 'bin', 'revert'],
     classifiers=CLASSIFIERS,
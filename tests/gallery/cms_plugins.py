@@ -0,0 +1,10 @@
+from cms.plugin_base import CMSPluginBase
+from cms.plugin_pool import plugin_pool
+
+from .models import Gallery
+
+
+@plugin_pool.register_plugin
+class GalleryPlugin(CMSPluginBase):
+    model = Gallery
+    render_template = 'gallery/gallery.html'
@@ -0,0 +1,16 @@
+from cms.models import CMSPlugin
+from django.db import models
+
+
+class GalleryImage(models.Model):
+    title = models.CharField(max_length=255)
+
+
+class Gallery(CMSPlugin):
+    """
+    A plugin whose content is held by a m2m field
+    """
+    images = models.ManyToManyField(GalleryImage, blank=True)
+
+    def copy_relations(self, oldinstance):
+        self.images.set(oldinstance.images.all())
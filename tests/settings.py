@@ -5,6 +5,7 @@ HELPER_SETTINGS = {
     'INSTALLED_APPS': [
         'djangocms_text_ckeditor',
         'djangocms_reversion2',
+        'tests.gallery',
     ],
     'ALLOWED_HOSTS': ['localhost'],
     'CMS_LANGUAGES': {
@@ -14,6 +15,7 @@ HELPER_SETTINGS = {
         }]
     },
     'LANGUAGE_CODE': 'en',
+    'REVERSION2_ALLOW_BLANK_TITLE': True,
 }
 
 
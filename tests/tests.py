@@ -1,27 +1,66 @@
-from cms.api import create_page
-from djangocms_helper.base_test import BaseTestCase
+import importlib
+import json
+import re
+import threading
+import time
+from unittest import mock
 
-from djangocms_reversion2.models import PageVersion
-from djangocms_reversion2.utils import revert_page
+from io import StringIO
+
+from cms.api import add_plugin, create_page, publish_page
+from cms.models import CMSPlugin, TreeNode
+from cms.utils.permissions import current_user
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from djangocms_helper.base_test import BaseTestCase, BaseTransactionTestCase
+from djangocms_text_ckeditor.cms_plugins import TextPlugin
+
+from djangocms_reversion2 import registry
+from djangocms_reversion2.batch import BUCKET_NAME, get_pages_to_version, get_partitions, revise_pages, \
+    revise_pages_parallel
+from djangocms_reversion2.benchmark import compare_reports, run_benchmarks
+from djangocms_reversion2.diff import create_placeholder_contents, diff_slots, diff_texts, get_fingerprints, \
+    get_precomputed_diffs
+from djangocms_reversion2.jobs import claim_next_job, enqueue_diff, enqueue_snapshot, process_jobs, run_job
+from djangocms_reversion2.models import PageVersion, PageVersionCounter, PageVersionDiff, PluginBlob, \
+    RenderedPlaceholder, SnapshotJob
+from djangocms_reversion2.plugin_diff import diff_page_attributes, register_comparator
+from djangocms_reversion2.settings import DELTA_KEYFRAME_INTERVAL, VERSION_ROOT_TITLE
+from djangocms_reversion2.signals import handle_placeholder_change, make_page_version_dirty
+from djangocms_reversion2.storage import STORAGE_BLOB, STORAGE_DELTA, materialize, resolve_placeholders
+from djangocms_reversion2.text_diff import EQUAL, myers_diff, token_diff
+from djangocms_reversion2.utils import get_or_create_bin_page_root, get_or_create_version_page_root, revert_page
 
 from . import testutils
 
 
-class PageRevisionCreateTestCase(BaseTestCase):
+class ReversionTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ReversionTestCase, self).setUp()
+        # the registry of version and bin roots outlives the rolled back transaction of the previous test
+        cache.clear()
+
+
+class PageRevisionCreateTestCase(ReversionTestCase):
 
     def test_a_revise_page(self):
         language = 'en'
         page = create_page(title='test_a_revise_page', template='page.html', language=language)
         testutils.add_text(page, language, content=u"initial")
-        page_version = PageVersion.create_version(page.get_draft_object(), language,
-                                                  version_parent=None, comment='', title='')
+        page_version = testutils.create_version(self.user, page.get_draft_object(), language,
+                                                version_parent=None, comment='', title='')
         self.assertIsNotNone(page_version, msg='PageVersion creation failed')
 
     def test_b_revise_page(self):
         language = 'en'
         draft = create_page(title='next', template='page.html', language=language).get_draft_object()
         # create initial version
-        pv = PageVersion.create_version(draft, language, version_parent=None, comment='next', title='')
+        pv = testutils.create_version(self.user, draft, language, version_parent=None, comment='next', title='')
 
         # we have a revised page containing the text 'initial' and add the text 'next'
         testutils.add_text(draft, language, content=u"next")
@@ -35,7 +74,7 @@ class PageRevisionCreateTestCase(BaseTestCase):
 
         try:
             # now we create a new version
-            pv = PageVersion.create_version(draft, language, version_parent=None, comment='next', title='')
+            pv = testutils.create_version(self.user, draft, language, version_parent=None, comment='next', title='')
         except AssertionError:
             self.fail('Expected the page to be dirty, but it\'s clean')
 
@@ -106,3 +145,1143 @@ class PageRevisionCreateTestCase(BaseTestCase):
 #             html = self.get_current_html(placeholder)
 #             self.assertEqual(self.initial_html[slot], html, slot)
 #
+
+
+class BlobStorageTestCase(ReversionTestCase):
+
+    def create_blob_version(self, draft, language='en'):
+        return testutils.create_version(self.user, draft, language, version_parent=None, comment='', title='',
+                                        storage=STORAGE_BLOB)
+
+    def test_a_unchanged_plugins_are_stored_once(self):
+        language = 'en'
+        draft = create_page(title='blob', template='page.html', language=language).get_draft_object()
+        testutils.add_text(draft, language, content=u"first")
+        testutils.add_text(draft, language, content=u"second")
+        pv = self.create_blob_version(draft, language)
+        self.assertEqual(pv.storage, STORAGE_BLOB)
+        self.assertFalse(CMSPlugin.objects.filter(placeholder__page=pv.hidden_page).exists())
+        num_blobs = PluginBlob.objects.count()
+        self.assertEqual(num_blobs, 2)
+
+        testutils.add_text(draft, language, content=u"third")
+        self.create_blob_version(draft, language)
+        # only the new text plugin has been stored
+        self.assertEqual(PluginBlob.objects.count(), num_blobs + 1)
+
+    def test_b_materialize_and_revert(self):
+        language = 'en'
+        draft = create_page(title='blob-revert', template='page.html', language=language).get_draft_object()
+        testutils.add_text(draft, language, content=u"initial")
+        pv = self.create_blob_version(draft, language)
+        testutils.add_text(draft, language, content=u"next")
+        self.create_blob_version(draft, language)
+
+        # revert straight from the blobs
+        revert_page(pv, language)
+        html = testutils.get_html(request=self.get_page_request(draft, self.user))
+        self.assertIn('initial', html)
+        self.assertNotIn('next', html, msg='new content is still in the page')
+
+        hidden_page = materialize(pv)
+        self.assertTrue(pv.materialized)
+        html = testutils.get_html(self.get_page_request(hidden_page, self.user))
+        self.assertIn('initial', html)
+        self.assertNotIn('next', html)
+
+
+class DeltaStorageTestCase(ReversionTestCase):
+
+    def create_delta_version(self, draft, language='en'):
+        return testutils.create_version(self.user, draft, language, version_parent=None, comment='', title='',
+                                        storage=STORAGE_DELTA)
+
+    def test_a_only_changed_placeholders_are_stored(self):
+        language = 'en'
+        draft = create_page(title='delta', template='page.html', language=language).get_draft_object()
+        sidebar = draft.placeholders.create(slot='sidebar')
+        testutils.add_text(draft, language, content=u"initial")
+        v1 = self.create_delta_version(draft, language)
+        self.assertTrue(v1.keyframe)
+        self.assertEqual(v1.placeholder_snapshots.count(), 2)
+
+        add_plugin(sidebar, TextPlugin, language, body=u"sidebar")
+        make_page_version_dirty(draft, language)
+        v2 = self.create_delta_version(draft, language)
+        self.assertFalse(v2.keyframe)
+        self.assertEqual([s.slot for s in v2.placeholder_snapshots.all()], ['sidebar'])
+
+        # the replay combines the keyframe and the delta
+        self.assertEqual(set(resolve_placeholders(v2).keys()), set(['content', 'sidebar']))
+        html = testutils.get_html(self.get_page_request(materialize(v2), self.user))
+        self.assertIn('initial', html)
+        self.assertIn('sidebar', html)
+
+        # delta versions keep their contents when the version they depend on is deleted with its hidden page
+        PageVersion.objects.get(pk=v1.pk).hidden_page.delete()
+        self.assertFalse(PageVersion.objects.filter(pk=v1.pk).exists())
+        v2.refresh_from_db()
+        self.assertTrue(v2.keyframe)
+        self.assertEqual(set(resolve_placeholders(v2).keys()), set(['content', 'sidebar']))
+
+    def test_b_keyframe_interval(self):
+        language = 'en'
+        draft = create_page(title='delta-keyframe', template='page.html', language=language).get_draft_object()
+        versions = []
+        for i in range(DELTA_KEYFRAME_INTERVAL + 1):
+            testutils.add_text(draft, language, content=u"text {}".format(i))
+            versions.append(self.create_delta_version(draft, language))
+        self.assertEqual([v.keyframe for v in versions],
+                         [True] + [False] * (DELTA_KEYFRAME_INTERVAL - 1) + [True])
+
+        revert_page(versions[1], language)
+        html = testutils.get_html(request=self.get_page_request(draft, self.user))
+        self.assertIn('text 1', html)
+        self.assertNotIn('text 2', html)
+
+
+class VersionChainTestCase(ReversionTestCase):
+
+    def test_a_long_history(self):
+        from cms.models import Page
+
+        language = 'en'
+        draft = create_page(title='chain', template='page.html', language=language).get_draft_object()
+        testutils.add_text(draft, language, content=u"initial")
+        parent = testutils.create_version(self.user, draft, language, version_parent=None)
+
+        # hidden pages of the stored versions, far more than a materialized path of 255 characters could nest
+        num_versions = 2000
+        first_step = TreeNode.get_last_root_node().path
+        TreeNode.objects.bulk_create([
+            TreeNode(path=TreeNode._get_path(None, 1, TreeNode._str2int(first_step) + 1 + i), depth=1,
+                     site_id=draft.node.site_id) for i in range(num_versions)])
+        Page.objects.bulk_create([Page(node=node) for node in TreeNode.objects.filter(path__gt=first_step, depth=1)])
+        parent.deactivate()
+        for hidden_page in Page.objects.filter(node__path__gt=first_step, node__depth=1).order_by('node__path'):
+            parent = PageVersion.objects.create(parent=parent, hidden_page=hidden_page, draft=draft,
+                                                language=language)
+        parent.active = True
+        parent.save()
+
+        testutils.add_text(draft, language, content=u"latest")
+        latest = testutils.create_version(self.user, draft, language, version_parent=None)
+        self.assertEqual(latest.parent, parent)
+        self.assertTrue(latest.active)
+        self.assertEqual(len(latest.get_ancestors()), num_versions + 1)
+
+        # the chain continues at the parent of a deleted version
+        grandparent = parent.parent
+        parent.delete()
+        latest.refresh_from_db()
+        self.assertEqual(latest.parent, grandparent)
+        self.assertEqual(len(latest.get_ancestors()), num_versions)
+
+
+class ConcurrentSnapshotTestCase(BaseTransactionTestCase):
+
+    def create_versions(self, draft, language, num_threads):
+        """
+        Creates versions of the draft in parallel threads
+        :return: the created versions and the errors
+        """
+        barrier = threading.Barrier(num_threads)
+        created, errors = [], []
+
+        def publish():
+            try:
+                barrier.wait()
+                created.append(testutils.create_version(self.user, draft, language, version_parent=None))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=publish) for i in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return created, errors
+
+    def test_a_parallel_publishes(self):
+        language = 'en'
+        draft = create_page(title='concurrent', template='page.html', language=language).get_draft_object()
+        for i in range(3):
+            testutils.add_text(draft, language, content=u"round {}".format(i))
+            created, errors = self.create_versions(draft, language, num_threads=4)
+            # only one snapshot of the dirty page is created, the others find it clean
+            self.assertEqual(len(created), 1)
+            self.assertEqual([str(e) for e in errors], ['not dirty'] * 3)
+
+        versions = PageVersion.objects.filter(draft=draft, language=language)
+        self.assertEqual(versions.count(), 3)
+        self.assertEqual(versions.filter(active=True).count(), 1)
+        self.assertEqual(len(versions.get(active=True).get_ancestors()), 2)
+        self.assertEqual(PageVersionCounter.objects.get(draft=draft, language=language).num_versions, 3)
+
+
+class SnapshotJobTestCase(ReversionTestCase):
+
+    def test_a_jobs_create_versions_in_order(self):
+        language = 'en'
+        draft = create_page(title='deferred', template='page.html', language=language).get_draft_object()
+        testutils.add_text(draft, language, content=u"initial")
+        first = enqueue_snapshot(draft, language, title='first', user=self.user)
+        self.assertEqual(claim_next_job(), first)
+        second = enqueue_snapshot(draft, language, title='second', user=self.user)
+        self.assertNotEqual(second, first)
+
+        # the second job has to wait until the first one is finished
+        self.assertIsNone(claim_next_job())
+        run_job(first)
+        self.assertEqual(first.state, SnapshotJob.DONE)
+        self.assertEqual(first.page_version.title, 'first')
+
+        # a pending job is updated instead of recording another one
+        self.assertEqual(enqueue_snapshot(draft, language, title='third', user=self.user), second)
+        self.assertEqual(process_jobs(), 1)
+        second.refresh_from_db()
+        self.assertEqual(second.state, SnapshotJob.DONE)
+        self.assertEqual(list(draft.page_versions.order_by('pk').values_list('title', flat=True)),
+                         ['first', 'third'])
+
+    def test_b_management_command(self):
+        language = 'en'
+        draft = create_page(title='deferred-command', template='page.html', language=language).get_draft_object()
+        enqueue_snapshot(draft, language, title='command', user=self.user)
+        out = StringIO()
+        call_command('reversion2_process_snapshots', stdout=out)
+        self.assertIn('1 snapshot jobs processed', out.getvalue())
+        self.assertTrue(draft.page_versions.filter(title='command').exists())
+
+    def test_c_published_state(self):
+        language = 'en'
+        page = create_page(title='deferred-published', template='page.html', language=language)
+        draft = page.get_draft_object()
+        plugin = testutils.add_text(draft, language, content=u"published")[0]
+        draft = publish_page(draft, self.user, language)
+        job = enqueue_snapshot(draft, language, title='auto', user=self.user, published=True)
+
+        # the draft is edited before the worker runs the job
+        plugin.body = 'edited'
+        plugin.save()
+        run_job(job)
+        self.assertEqual(job.state, SnapshotJob.DONE, job.error)
+        hidden_page = job.page_version.hidden_page
+        self.assertTrue(hidden_page.publisher_is_draft)
+        bodies = [plugin.get_bound_plugin().body
+                  for plugin in CMSPlugin.objects.filter(placeholder__page=hidden_page, language=language)]
+        self.assertIn('published', bodies)
+        self.assertNotIn('edited', bodies)
+
+        draft = draft.reload()
+        draft.unpublish(language)
+        job = enqueue_snapshot(draft, language, title='auto', user=self.user, published=True)
+        run_job(job)
+        self.assertEqual(job.state, SnapshotJob.SKIPPED)
+
+
+class BatchVersioningTestCase(ReversionTestCase):
+
+    def test_a_resumable_batch(self):
+        language = 'en'
+        pages = [create_page(title='batch {}'.format(i), template='page.html', language=language, published=True)
+                 for i in range(3)]
+        create_page(title='unpublished', template='page.html', language=language)
+
+        with current_user(self.user):
+            run = revise_pages(name='test', chunk_size=2, limit=2)
+            self.assertIsNone(run.finished)
+            self.assertEqual(run.created, 2)
+            self.assertEqual(run.last_page_id, pages[1].pk)
+
+            # the second call continues behind the checkpoint
+            run = revise_pages(name='test', chunk_size=2)
+        self.assertIsNotNone(run.finished)
+        self.assertEqual(run.created, 3)
+        for page in pages:
+            self.assertEqual(page.get_draft_object().page_versions.count(), 1)
+        # the version root itself is never versioned
+        self.assertEqual(PageVersion.objects.count(), 3)
+
+    def test_b_management_command(self):
+        create_page(title='batch command', template='page.html', language='en', published=True)
+        out = StringIO()
+        call_command('reversion2_version_pages', user=self.user.username, stdout=out)
+        self.assertIn('Finished: 1 versions created for 1 pages', out.getvalue())
+
+    def test_c_partitions(self):
+        language = 'en'
+        parent = create_page(title='branch', template='page.html', language=language)
+        children = [create_page(title='leaf {}'.format(i), template='page.html', language=language, parent=parent)
+                    for i in range(2)]
+        other = create_page(title='other branch', template='page.html', language=language)
+        with current_user(self.user):
+            get_or_create_version_page_root(self.site_1, self.user)
+
+        partitions = get_partitions(workers=2)
+        # the large branch is split, the version root is not part of any partition
+        self.assertEqual(len(partitions), 4)
+        partitioned = []
+        for partition in partitions:
+            partitioned.extend(get_pages_to_version(partition=partition).values_list('pk', flat=True))
+        self.assertEqual(sorted(partitioned), sorted([parent.pk, other.pk] + [child.pk for child in children]))
+        self.assertEqual(sorted(partitioned), sorted(get_pages_to_version().values_list('pk', flat=True)))
+
+    def test_d_parallel_partitions(self):
+        class InlinePool(object):
+            # two workers taking turns in this process and transaction (the test database is in memory)
+            tasks = []
+
+            def imap_unordered(self, func, tasks):
+                for i, task in enumerate(tasks):
+                    self.tasks.append(task)
+                    with mock.patch('djangocms_reversion2.batch._worker_bucket', BUCKET_NAME.format(i % 2 + 1)):
+                        yield func(task)
+
+            def close(self):
+                pass
+
+            def join(self):
+                pass
+
+        language = 'en'
+        drafts = []
+        for i in range(2):
+            parent = create_page(title='parallel {}'.format(i), template='page.html', language=language,
+                                 published=True)
+            drafts.append(parent)
+            for j in range(2):
+                drafts.append(create_page(title='parallel {} {}'.format(i, j), template='page.html',
+                                          language=language, parent=parent, published=True))
+
+        with mock.patch('djangocms_reversion2.batch.get_pool', return_value=InlinePool()) as get_pool, \
+                current_user(self.user):
+            run = revise_pages_parallel(name='parallel', workers=2)
+        get_pool.assert_called_once_with(2)
+        # the branches of the site are split between the workers
+        self.assertEqual(len(InlinePool.tasks), len(get_partitions(workers=2)))
+        self.assertGreater(len(InlinePool.tasks), 2)
+        self.assertTrue(run.finished)
+        self.assertEqual((run.processed, run.created), (6, 6))
+        self.assertEqual(set(PageVersion.objects.values_list('draft', flat=True)), set(d.pk for d in drafts))
+
+        # each worker adds its hidden pages to its own bucket under the version root
+        roots = registry.get_roots(self.site_1.pk)
+        version_root_path = roots[registry.VERSION_ROOT][1]
+        bucket_paths = set(path for page_id, path in roots['version_buckets'].values())
+        self.assertEqual(len(bucket_paths), 2)
+        self.assertTrue(all(path.startswith(version_root_path) for path in bucket_paths))
+        hidden_parents = set(node_path[:-TreeNode.steplen] for node_path in
+                             PageVersion.objects.values_list('hidden_page__node__path', flat=True))
+        self.assertEqual(hidden_parents, bucket_paths)
+        self.assertTrue(all(registry.classify_path(self.site_1.pk, path) == registry.VERSION_ROOT
+                            for path in bucket_paths))
+
+
+class RegistryTestCase(ReversionTestCase):
+
+    def test_a_classify_pages(self):
+        language = 'en'
+        draft = create_page(title='registry', template='page.html', language=language)
+        testutils.add_text(draft, language, content='registry')
+        page_version = testutils.create_version(self.user, draft, language, version_parent=None)
+        with current_user(self.user):
+            bucket = get_or_create_bin_page_root(self.site_1)
+
+        hidden_page = PageVersion.objects.select_related('hidden_page__node').get(pk=page_version.pk).hidden_page
+        registry.get_roots(self.site_1.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.classify_page(hidden_page), registry.VERSION_ROOT)
+            self.assertEqual(registry.classify_page(bucket), registry.BIN_ROOT)
+            self.assertIsNone(registry.classify_page(draft))
+            self.assertTrue(registry.is_registered_page(bucket))
+            self.assertFalse(registry.is_registered_page(hidden_page))
+
+        # renaming the root does not hide the versions
+        hidden_page.parent_page.title_set.update(title='renamed')
+        with current_user(self.user):
+            self.assertEqual(get_or_create_version_page_root(self.site_1, self.user), hidden_page.parent_page)
+            self.assertEqual(get_or_create_bin_page_root(self.site_1), bucket)
+
+    def test_b_existing_roots_are_registered(self):
+        root = create_page(title=VERSION_ROOT_TITLE, template='page.html', language='en')
+        self.assertEqual(registry.get_root_page_id(self.site_1.pk, registry.VERSION_ROOT), root.pk)
+        self.assertEqual(registry.get_special_paths(self.site_1.pk), {root.node.path: registry.VERSION_ROOT})
+
+        # deleting the root page drops it from the registry
+        root.delete()
+        self.assertIsNone(registry.get_root_page_id(self.site_1.pk, registry.VERSION_ROOT))
+
+    def test_c_evicted_generation(self):
+        root = create_page(title=VERSION_ROOT_TITLE, template='page.html', language='en')
+        self.assertEqual(registry.get_root_page_id(self.site_1.pk, registry.VERSION_ROOT), root.pk)
+        process_cache = dict(registry._local_cache)
+
+        # the cache evicts the registry, then another process registers a new root and reloads the registry
+        cache.delete(registry.GENERATION_KEY.format(site=self.site_1.pk))
+        cache.delete(registry.CACHE_KEY.format(site=self.site_1.pk))
+        registry._local_cache.clear()
+        new_root = create_page(title='new root', template='page.html', language='en')
+        registry.register(new_root, registry.VERSION_ROOT)
+        registry.get_roots(self.site_1.pk)
+
+        # the in-process copy of this process is outdated
+        registry._local_cache.update(process_cache)
+        self.assertEqual(registry.get_root_page_id(self.site_1.pk, registry.VERSION_ROOT), new_root.pk)
+
+
+class PageTreeTestCase(ReversionTestCase):
+
+    def get_tree(self, node_id=None, open_nodes=()):
+        """
+        :return: the response of PageAdmin2.get_tree and the number of queries it took
+        """
+        from cms.models import Page
+        from django.contrib import admin
+        from django.http import QueryDict
+        from djangocms_reversion2.pageadmin import PageAdmin2
+
+        request = self.get_request(None, 'en', user=self.user, path='/admin/cms/page/get-tree/')
+        request.GET = QueryDict(mutable=True)
+        if node_id:
+            request.GET['nodeId'] = str(node_id)
+        request.GET.setlist('openNodes[]', [str(pk) for pk in open_nodes])
+        with CaptureQueriesContext(connection) as queries:
+            response = PageAdmin2(Page, admin.site).get_tree(request)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode('utf-8'), len(queries)
+
+    def get_row_ids(self, content):
+        return [int(pk) for pk in re.findall(r'<li class="cms-tree-node[^"]*"[^>]*?data-id="(\d+)"', content)]
+
+    def create_versions(self, num):
+        language = 'en'
+        draft = create_page(title='tree', template='page.html', language=language)
+        testutils.add_text(draft, language, content='tree')
+        for i in range(num):
+            testutils.create_version(self.user, draft, language, version_parent=None, title='tree {}'.format(i))
+            testutils.add_text(draft, language, content='tree {}'.format(i))
+        return draft, PageVersion.objects.first().hidden_page.parent_page
+
+    @mock.patch('djangocms_reversion2.pageadmin.TREE_PAGE_SIZE', 1000)
+    def test_a_version_rows_are_classified_in_one_pass(self):
+        draft, version_root = self.create_versions(3)
+
+        content, num_queries = self.get_tree(version_root.node_id, open_nodes=[version_root.node_id])
+        # published and unpublished versions and hidden pages without a page version (left over by older releases)
+        for i in range(300):
+            hidden_page = create_page(title='hidden {}'.format(i), template='page.html', language='en',
+                                      parent=version_root, published=i % 3 == 0)
+            if i % 3 != 2:
+                PageVersion.objects.create(hidden_page=hidden_page, draft=draft, language='en', active=False,
+                                           page_title='hidden {}'.format(i))
+        content, more_queries = self.get_tree(version_root.node_id, open_nodes=[version_root.node_id])
+        self.assertEqual(len(self.get_row_ids(content)), 303)
+        self.assertEqual(more_queries, num_queries)
+        self.assertIn('hidden 3 - en', content)
+        hidden_page = PageVersion.objects.get(page_title='hidden 3').hidden_page
+        self.assertIn('href="{}"'.format(hidden_page.get_public_url('en')), content)
+
+    @mock.patch('djangocms_reversion2.pageadmin.TREE_PAGE_SIZE', 2)
+    def test_b_versions_are_loaded_lazily(self):
+        from djangocms_reversion2.instrumentation import Aggregator
+
+        draft, version_root = self.create_versions(5)
+
+        # the version root stays collapsed, even if it has been open before
+        content, num_queries = self.get_tree(open_nodes=[version_root.node_id])
+        self.assertEqual(self.get_row_ids(content), [draft.pk, version_root.pk])
+
+        # expanding it loads the newest versions, the 'more' row loads the next ones
+        hidden_pages = []
+        node_id = version_root.node_id
+        with Aggregator() as aggregator:
+            while node_id:
+                content, num_queries = self.get_tree(node_id)
+                hidden_pages.extend(self.get_row_ids(content))
+                more = re.search(r'data-node-id="(more-[^"]+)"', content)
+                node_id = more.group(1) if more else None
+        expected = PageVersion.objects.order_by('-hidden_page__node__path').values_list('hidden_page', flat=True)
+        self.assertEqual(hidden_pages, list(expected))
+        # every request of a lazy node is measured once
+        self.assertEqual(aggregator.summary()['tree_render']['count'], 3)
+
+
+class RenderCacheTestCase(ReversionTestCase):
+
+    def test_a_versions_are_rendered_once(self):
+        language = 'en'
+        draft = create_page(title='render', template='page.html', language=language)
+        testutils.add_text(draft, language, content='old')
+        hidden_page = testutils.create_version(self.user, draft, language, version_parent=None).hidden_page
+        testutils.add_text(draft, language, content='new')
+        request = self.get_page_request(draft, self.user)
+
+        diffs = create_placeholder_contents(hidden_page, draft, request, language)
+        num_slots = hidden_page.placeholders.count()
+        self.assertEqual(RenderedPlaceholder.objects.filter(page=hidden_page).count(), num_slots)
+
+        with mock.patch('djangocms_reversion2.diff.placeholder_html') as render:
+            self.assertEqual(create_placeholder_contents(hidden_page, draft, request, language), diffs)
+            self.assertFalse(render.called)
+
+            # a change of the draft only invalidates the draft side
+            placeholder = draft.placeholders.first()
+            handle_placeholder_change(placeholder=placeholder, language=language)
+            render.return_value = ''
+            create_placeholder_contents(hidden_page, draft, request, language)
+            self.assertEqual(render.call_count, num_slots)
+            self.assertTrue(all(call[0][0].page == draft for call in render.call_args_list))
+
+    def test_b_query_count_does_not_depend_on_slots(self):
+        language = 'en'
+
+        def diff_queries(num_slots):
+            left = create_page(title='left', template='page.html', language=language)
+            right = create_page(title='right', template='page.html', language=language)
+            for i in range(num_slots):
+                for page in (left, right):
+                    placeholder = page.placeholders.create(slot='extra {}'.format(i))
+                    add_plugin(placeholder, TextPlugin, language, body='{} {}'.format(page.pk, i))
+            # slots which exist on one side only
+            left.placeholders.create(slot='left only')
+            add_plugin(right.placeholders.create(slot='right only'), TextPlugin, language, body='right only')
+
+            request = self.get_page_request(right, self.user)
+            with CaptureQueriesContext(connection) as queries:
+                diffs = create_placeholder_contents(left, right, request, language, mode='html')
+            self.assertIn('left only', diffs)
+            self.assertIn('right only', diffs['right only']['right'])
+            self.assertIn('extra {}'.format(num_slots - 1), diffs)
+            return len(queries)
+
+        # the first diff loads the content types and plugin pool
+        diff_queries(1)
+        self.assertEqual(diff_queries(2), diff_queries(8))
+
+    def test_c_cached_html_does_not_depend_on_the_user(self):
+        language = 'en'
+        draft = create_page(title='render', template='page.html', language=language)
+        testutils.add_text(draft, language, content='old')
+        hidden_page = testutils.create_version(self.user, draft, language, version_parent=None).hidden_page
+        testutils.add_text(draft, language, content='new')
+
+        # the html is cached for all users, it must not be rendered with the user or toolbar of an editor
+        request = self.get_page_request(draft, self.user, edit=True)
+        with mock.patch('djangocms_reversion2.diff.placeholder_html', return_value='') as render:
+            create_placeholder_contents(hidden_page, draft, request, language)
+        self.assertTrue(render.called)
+        self.assertTrue(all(call[0][1].user.is_anonymous and not hasattr(call[0][1], 'toolbar')
+                            for call in render.call_args_list))
+
+        # drafts have neither rendered rows nor stored diffs to delete
+        placeholder = draft.placeholders.first()
+        with CaptureQueriesContext(connection) as queries:
+            handle_placeholder_change(placeholder=placeholder, language=language)
+        self.assertFalse([query for query in queries if query['sql'].startswith('DELETE')])
+
+    def test_d_saved_pages_invalidate_drafts(self):
+        language = 'en'
+        draft = create_page(title='render', template='page.html', language=language)
+        testutils.add_text(draft, language, content='old')
+        hidden_page = testutils.create_version(self.user, draft, language, version_parent=None).hidden_page
+        testutils.add_text(draft, language, content='new')
+        other = create_page(title='linked', template='page.html', language=language)
+        request = self.get_page_request(draft, self.user)
+        num_slots = draft.placeholders.count()
+
+        create_placeholder_contents(hidden_page, draft, request, language)
+        for change in (lambda: other.title_set.get().save(), lambda: draft.save()):
+            with mock.patch('djangocms_reversion2.diff.placeholder_html', return_value='') as render:
+                create_placeholder_contents(hidden_page, draft, request, language)
+                self.assertFalse(render.called)
+                # e.g. a link to the other page or the menu of the draft might have changed
+                change()
+                create_placeholder_contents(hidden_page, draft, request, language)
+                # the versions stay rendered
+                self.assertEqual(render.call_count, num_slots)
+                self.assertTrue(all(call[0][0].page == draft for call in render.call_args_list))
+            create_placeholder_contents(hidden_page, draft, request, language)
+
+
+class DiffSlotsTestCase(ReversionTestCase):
+
+    def setUp(self):
+        super(DiffSlotsTestCase, self).setUp()
+        self.texts = {'slot {}'.format(i): ('<p>old {}</p>'.format(i), '<p>new {}</p>'.format(i))
+                      for i in range(6)}
+
+    def test_a_diff_slots(self):
+        diffs = diff_slots(self.texts, time_budget=0)
+        self.assertEqual(len(diffs), 6)
+        self.assertIn('<ins>new</ins>', diffs['slot 3'])
+
+    def test_b_time_budget(self):
+        def slow_diff(text1, text2, deadline=None):
+            time.sleep(0.2)
+            return text2
+
+        with mock.patch('djangocms_reversion2.diff.diff_texts', slow_diff):
+            started = time.time()
+            self.assertEqual(len(diff_slots(self.texts, time_budget=0)), 6)
+            self.assertGreater(time.time() - started, 1.2)
+            # the slot which is being diffed at the end of the budget is the last one
+            started = time.time()
+            self.assertEqual(len(diff_slots(self.texts, time_budget=0.1)), 1)
+            self.assertLess(time.time() - started, 0.5)
+
+            left = create_page(title='budget-left', template='page.html', language='en')
+            draft = create_page(title='budget', template='page.html', language='en')
+            for i in range(3):
+                add_plugin(left.placeholders.create(slot='extra {}'.format(i)), TextPlugin, 'en', body='old')
+                add_plugin(draft.placeholders.create(slot='extra {}'.format(i)), TextPlugin, 'en', body='new')
+            request = self.get_page_request(draft, self.user)
+            diffs = create_placeholder_contents(left, draft, request, 'en', time_budget=0.1)
+            diffs = [diffs['extra {}'.format(i)] for i in range(3)]
+            self.assertEqual([diff['timed_out'] for diff in diffs], [False, True, True])
+            self.assertTrue(all(diff['diff_right_to_left'] == diff['right'] for diff in diffs[1:]))
+
+    def test_c_budget_keeps_the_engine(self):
+        with mock.patch('lxml.html.diff.htmldiff', return_value='htmldiff') as htmldiff:
+            self.assertEqual(diff_slots(self.texts, time_budget=10)['slot 3'], 'htmldiff')
+        self.assertEqual(htmldiff.call_count, 6)
+
+        # the token diff stops at the end of the budget
+        with mock.patch('djangocms_reversion2.diff.REVERSION2_DIFF_ENGINE', 'tokens'), \
+                mock.patch('djangocms_reversion2.text_diff.token_diff', return_value='tokens') as token_diff:
+            self.assertEqual(diff_slots(self.texts, time_budget=10)['slot 3'], 'tokens')
+        self.assertEqual(token_diff.call_count, 6)
+        self.assertTrue(all(call[1]['deadline'] for call in token_diff.call_args_list))
+
+
+class FingerprintTestCase(ReversionTestCase):
+
+    def test_a_unchanged_placeholders_are_skipped(self):
+        language = 'en'
+        draft = create_page(title='fingerprint', template='page.html', language=language)
+        for i in range(3):
+            add_plugin(draft.placeholders.create(slot='extra {}'.format(i)), TextPlugin, language, body='old')
+        page_version = testutils.create_version(self.user, draft, language, version_parent=None)
+        hidden_page = page_version.hidden_page
+        self.assertEqual(json.loads(page_version.fingerprints), get_fingerprints(draft, language))
+        self.assertEqual(get_fingerprints(hidden_page, language), get_fingerprints(draft, language))
+
+        changed = draft.placeholders.get(slot='extra 1')
+        plugin = changed.get_plugins(language).first().get_bound_plugin()
+        plugin.body = 'new'
+        plugin.save()
+        handle_placeholder_change(placeholder=changed, language=language)
+
+        request = self.get_page_request(draft, self.user)
+        diffs = create_placeholder_contents(hidden_page, draft, request, language)
+        self.assertEqual(set(slot for slot, diff in diffs.items() if not diff.get('unchanged')), {'extra 1'})
+        self.assertIn('new', diffs['extra 1']['right'])
+        self.assertEqual(list(RenderedPlaceholder.objects.filter(page=hidden_page).values_list('slot', flat=True)),
+                         ['extra 1'])
+
+    def test_b_plugins_with_relations_are_diffed(self):
+        from tests.gallery.models import GalleryImage
+
+        language = 'en'
+        draft = create_page(title='gallery', template='page.html', language=language)
+        gallery = add_plugin(draft.placeholders.create(slot='gallery'), 'GalleryPlugin', language)
+        gallery.images.add(GalleryImage.objects.create(title='old image'))
+        page_version = testutils.create_version(self.user, draft, language, version_parent=None)
+        self.assertIsNone(json.loads(page_version.fingerprints)['gallery'])
+
+        # only the m2m relation changes, the row of the plugin stays the same
+        gallery.images.set([GalleryImage.objects.create(title='new image')])
+        request = self.get_page_request(draft, self.user)
+        diffs = create_placeholder_contents(page_version.hidden_page, draft, request, language)
+        self.assertFalse(diffs['gallery'].get('unchanged'))
+        self.assertIn('old image', diffs['gallery']['left'])
+        self.assertIn('new image', diffs['gallery']['right'])
+
+
+class DiffViewTestCase(ReversionTestCase):
+
+    def test_a_streamed_diff(self):
+        language = 'en'
+        draft = create_page(title='stream', template='page.html', language=language)
+        for i in range(3):
+            add_plugin(draft.placeholders.create(slot='extra {}'.format(i)), TextPlugin, language, body='old')
+        page_version = testutils.create_version(self.user, draft, language, version_parent=None)
+        changed = draft.placeholders.get(slot='extra 1')
+        plugin = changed.get_plugins(language).first().get_bound_plugin()
+        plugin.body = 'new'
+        plugin.save()
+        handle_placeholder_change(placeholder=changed, language=language)
+        make_page_version_dirty(draft, language)
+
+        url = '{}?language={}'.format(reverse('admin:djangocms_reversion2_diff_view',
+                                              args=[draft.pk, page_version.pk, 0]), language)
+        self.client.force_login(self.user)
+        html = self.client.get(url).content.decode('utf-8')
+        with mock.patch('djangocms_reversion2.admin.REVERSION2_STREAM_DIFFS', True):
+            response = self.client.get(url)
+            self.assertTrue(response.streaming)
+            streamed = b''.join(response.streaming_content).decode('utf-8')
+
+        self.assertIn('<ins>new</ins>', streamed)
+        self.assertEqual(streamed.count('Placeholder:'), html.count('Placeholder:'))
+        self.assertEqual(streamed.count('(unchanged)'), html.count('(unchanged)'))
+        self.assertGreater(html.count('(unchanged)'), 1)
+
+    @mock.patch('djangocms_reversion2.views.HISTORY_PAGE_SIZE', 2)
+    def test_b_history(self):
+        language = 'en'
+        draft = create_page(title='history', template='page.html', language=language)
+        for i in range(5):
+            testutils.add_text(draft, language, content='history {}'.format(i))
+            testutils.create_version(self.user, draft, language, version_parent=None, title='history {}'.format(i))
+        versions = list(PageVersion.objects.filter(draft=draft).order_by('-pk'))
+        # versions of the same time are ordered by their id
+        PageVersion.objects.filter(pk__in=[version.pk for version in versions[1:4]])\
+            .update(created_at=versions[1].created_at)
+
+        url = reverse('admin:djangocms_reversion2_history', args=[draft.pk])
+        self.client.force_login(self.user)
+        ids = []
+        after = None
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'language': language, 'after': after} if after else
+                                           {'language': language})
+            data = response.json()
+            self.assertLessEqual(len(data['versions']), 2)
+            ids.extend(version['id'] for version in data['versions'])
+            after = data['next']
+            if not after:
+                break
+            num_queries = len(queries)
+        self.assertEqual(ids, [version.pk for version in versions])
+        self.assertEqual(len(queries), num_queries)
+
+        data = {'language': language}
+        response = self.client.get(url, data)
+        self.assertEqual(self.client.get(url, data, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        testutils.add_text(draft, language, content='dirty')
+        self.assertEqual(self.client.get(url, data, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(url, dict(data, after='x')).status_code, 400)
+        # editing a version changes the history as well
+        response = self.client.get(url, data)
+        versions[1].comment = 'edited'
+        versions[1].save()
+        response = self.client.get(url, data, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['versions'][1]['comment'], 'edited')
+
+        # like the diff view, for the staff who may view the page
+        self.client.force_login(self.user_staff)
+        self.assertEqual(self.client.get(url, data).status_code, 200)
+        with mock.patch('djangocms_reversion2.views.user_can_view_page', return_value=False):
+            self.assertEqual(self.client.get(url, data).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(url, data).status_code, 302)
+
+    @override_settings(USE_TZ=False)
+    def test_c_history_without_time_zones(self):
+        language = 'en'
+        draft = create_page(title='naive history', template='page.html', language=language)
+        for i in range(3):
+            testutils.add_text(draft, language, content='naive {}'.format(i))
+            testutils.create_version(self.user, draft, language, version_parent=None)
+        url = reverse('admin:djangocms_reversion2_history', args=[draft.pk])
+        self.client.force_login(self.user)
+        ids = []
+        after = None
+        with mock.patch('djangocms_reversion2.views.HISTORY_PAGE_SIZE', 1):
+            while True:
+                response = self.client.get(url, {'language': language, 'after': after} if after else
+                                           {'language': language})
+                self.assertEqual(response.status_code, 200)
+                ids.extend(version['id'] for version in response.json()['versions'])
+                after = response.json()['next']
+                if not after:
+                    break
+        versions = PageVersion.objects.filter(draft=draft).order_by('-pk')
+        self.assertEqual(ids, list(versions.values_list('pk', flat=True)))
+
+
+class PageVersionMetadataTestCase(ReversionTestCase):
+
+    def test_a_metadata_is_copied(self):
+        from django.apps import apps
+        migration = importlib.import_module('djangocms_reversion2.migrations.0017_pageversion_metadata')
+
+        language = 'en'
+        draft = create_page(title='metadata', template='page.html', language=language)
+        page_version = testutils.create_version(self.user, draft, language, version_parent=None)
+        hidden_page = page_version.hidden_page
+        self.assertEqual(page_version.created_at, hidden_page.changed_date)
+        self.assertEqual(page_version.changed_by, hidden_page.changed_by)
+        self.assertEqual(str(page_version), 'metadata')
+
+        # versions from before the fields: the migration copies the metadata of their hidden pages
+        PageVersion.objects.update(created_at=timezone.now(), changed_by='', page_title='')
+        with mock.patch.object(migration, 'CHUNK_SIZE', 1):
+            migration.copy_hidden_page_metadata(apps, None)
+        page_version.refresh_from_db()
+        self.assertEqual(page_version.created_at, hidden_page.changed_date)
+        self.assertEqual(page_version.changed_by, hidden_page.changed_by)
+        self.assertEqual(page_version.page_title, 'metadata')
+
+
+class BenchmarkTestCase(ReversionTestCase):
+
+    def test_a_report(self):
+        report = run_benchmarks(self.site_1, self.user, pages=2, plugins=2, versions=2)
+        # the seeded versions and one version of the timed and one of the memory pass
+        self.assertEqual(PageVersion.objects.filter(draft__title_set__title='benchmark 1').count(), 4)
+        self.assertEqual(set(report['operations'].keys()),
+                         set(['create_version', 'diff_view', 'revert_page', 'template_tags', 'get_tree_rows',
+                              'search_index_queryset']))
+        self.assertEqual(report['operations']['create_version']['samples'], 2)
+        self.assertGreater(report['operations']['diff_view']['queries']['min'], 0)
+        self.assertGreater(report['operations']['revert_page']['peak_memory']['min'], 0)
+
+        # a report can be compared with the report of an earlier run after a round trip through JSON
+        comparison = compare_reports(json.loads(json.dumps(report)), report)
+        self.assertEqual(len(comparison), 6 * 3)
+        self.assertTrue(all(ratio in (None, 1.0) for name, metric, old, new, ratio in comparison))
+
+    @mock.patch('djangocms_reversion2.benchmark.BULK_SEED_PAGES', 1)
+    def test_b_bulk_seeded_report(self):
+        report = run_benchmarks(self.site_1, self.user, pages=2, plugins=2, versions=2)
+        self.assertTrue(report['size']['bulk_seed'])
+        self.assertEqual(report['operations']['create_version']['samples'], 2)
+        self.assertEqual(report['operations']['revert_page']['samples'], 2)
+        self.assertGreater(report['operations']['diff_view']['peak_memory']['min'], 0)
+
+
+class SyntheticDataTestCase(ReversionTestCase):
+
+    def test_a_generate(self):
+        from cms.models import Page
+
+        out = StringIO()
+        call_command('reversion2_generate_data', pages=20, depth=3, plugins=2, versions=3, deleted=4, buckets=2,
+                     batch_size=50, stdout=out)
+        self.assertIn('djangocms_reversion2.PageVersion', out.getvalue())
+        self.assertEqual(PageVersion.objects.count(), 24 * 3)
+        self.assertEqual(TreeNode.find_problems(), ([], [], [], [], []))
+        self.assertEqual(CMSPlugin.find_problems(), ([], [], [], [], []))
+
+        # the deleted pages are in the bin buckets
+        bin_root = Page.objects.get(pk=registry.get_root_page_id(self.site_1.pk, registry.BIN_ROOT))
+        self.assertEqual(Page.objects.filter(node__parent__parent=bin_root.node_id).count(), 4)
+
+        # the versions form a chain with the counter of the draft, they can be reverted to
+        version = PageVersion.objects.get(active=True, draft__title_set__title='Synthetic page 7')
+        self.assertEqual(len(version.get_ancestors()), 2)
+        counter = PageVersionCounter.objects.get(draft=version.draft, language=version.language)
+        self.assertEqual(counter.num_versions, 3)
+        with current_user(self.user):
+            revert_page(version.get_ancestors()[0], version.language)
+        self.assertEqual(CMSPlugin.objects.filter(placeholder__page=version.draft).count(), 2)
+
+
+class InstrumentationTestCase(ReversionTestCase):
+
+    def test_a_measurements(self):
+        from djangocms_reversion2.instrumentation import Aggregator, operation_measured
+
+        language = 'en'
+        draft = create_page(title='measured', template='page.html', language=language)
+        testutils.add_text(draft, language, content='measured')
+        received = []
+
+        def receive(sender, measurement, **kwargs):
+            received.append(measurement)
+
+        operation_measured.connect(receive)
+        try:
+            with Aggregator() as aggregator, self.assertLogs('djangocms_reversion2.instrumentation', 'INFO') as logs:
+                page_version = testutils.create_version(self.user, draft, language, version_parent=None)
+                with current_user(self.user):
+                    revert_page(page_version, language)
+                with self.assertRaises(AssertionError):
+                    testutils.create_version(self.user, draft, language, version_parent=None)
+        finally:
+            operation_measured.disconnect(receive)
+
+        # the stages are measured before the snapshot which contains them
+        self.assertEqual([measurement.operation for measurement in received],
+                         ['copy_hidden_page', 'publish_hidden_page', 'snapshot', 'revert', 'snapshot'])
+        copy, publish, snapshot = received[:3]
+        self.assertEqual(snapshot.context, {'page': draft.pk, 'language': language})
+        self.assertGreater(copy.rows_written, 0)
+        self.assertGreaterEqual(snapshot.queries, copy.queries + publish.queries)
+        self.assertGreaterEqual(snapshot.rows_written, copy.rows_written + publish.rows_written)
+        self.assertGreaterEqual(snapshot.duration, copy.duration + publish.duration)
+        self.assertIn('snapshot (language=en, page={}) took'.format(draft.pk), logs.output[2])
+
+        summary = aggregator.summary()
+        self.assertEqual((summary['snapshot']['count'], summary['snapshot']['failed']), (2, 1))
+        self.assertEqual(summary['revert']['queries'], received[3].queries)
+
+        # the aggregator only collects while it is connected
+        with current_user(self.user):
+            revert_page(page_version, language)
+        self.assertEqual(aggregator.summary(), summary)
+
+
+class VersionCounterTestCase(ReversionTestCase):
+
+    def test_a_latest_version_id(self):
+        from djangocms_reversion2.forms import PageVersionForm
+
+        language = 'en'
+        draft = create_page(title='counter', template='page.html', language=language)
+        for version_id in ('1.0.0', '1.1.0'):
+            testutils.add_text(draft, language, content=version_id)
+            testutils.create_version(self.user, draft, language, version_parent=None, version_id=version_id)
+        counter = PageVersionCounter.objects.get(draft=draft, language=language)
+        self.assertEqual((str(counter.version_id), counter.num_versions), ('1.1.0', 2))
+        with self.assertNumQueries(1):
+            self.assertEqual(str(PageVersion.get_latest_version_id(language, draft=draft)), '1.1.0')
+
+        form = PageVersionForm(initial={'draft': draft.pk, 'language': language})
+        self.assertEqual(form.fields['version_id'].initial, '1.1.0')
+        form = PageVersionForm(data={'draft': draft.pk, 'language': language, 'title': 'old', 'version_id': '1.0.5'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('Version Id is not increased', form.non_field_errors())
+
+        # the check is repeated under the lock of the counter
+        testutils.add_text(draft, language, content='1.0.5')
+        with self.assertRaisesMessage(AssertionError, 'Version Id is not increased'):
+            testutils.create_version(self.user, draft, language, version_parent=None, version_id='1.0.5')
+
+        # deleting the latest version
+        PageVersion.objects.get(version_id='1.1.0').delete()
+        counter.refresh_from_db()
+        self.assertEqual((str(counter.version_id), counter.num_versions), ('1.0.0', 1))
+
+        # drafts versioned before the counters
+        counter.delete()
+        self.assertEqual(str(PageVersion.get_latest_version_id(language, draft=draft)), '1.0.0')
+
+
+class QueryPlanTestCase(ReversionTestCase):
+    """
+    The hot PageVersion queries must be answered from an index, not by scanning the table
+    """
+    # full table scans of page versions in the EXPLAIN output of sqlite and postgresql
+    TABLE_SCAN = r'(\bSCAN( TABLE)?|Seq Scan on) djangocms_reversion2_pageversion\b'
+
+    def setUp(self):
+        super(QueryPlanTestCase, self).setUp()
+        if connection.vendor == 'postgresql':
+            # the seeded tables are small enough for a sequential scan to be cheaper
+            # (SET LOCAL ends with the transaction of the test, later tests are not affected)
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        self.language = 'en'
+        self.drafts = []
+        for i in range(3):
+            draft = create_page(title='plan {}'.format(i), template='page.html', language=self.language)
+            for j in range(3):
+                testutils.add_text(draft, self.language, content='plan {} {}'.format(i, j))
+                testutils.create_version(self.user, draft, self.language, version_parent=None)
+            self.drafts.append(draft)
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertIsNone(re.search(self.TABLE_SCAN, plan), plan)
+        return plan
+
+    def test_a_version_lookups(self):
+        draft = self.drafts[1]
+        self.assertUsesIndex(draft.page_versions.filter(active=True, dirty=False, language=self.language),
+                             'reversion2_active_idx')
+        self.assertUsesIndex(PageVersion.get_versions(self.language, draft=draft), 'reversion2_draft_lang_id_idx')
+
+        hidden_page = PageVersion.objects.filter(draft=draft).first().hidden_page
+        plan = PageVersion.objects.filter(hidden_page=hidden_page, language=self.language).explain()
+        self.assertIsNone(re.search(self.TABLE_SCAN, plan), plan)
+
+    def test_b_history(self):
+        from djangocms_reversion2.views import get_history_page
+
+        versions = PageVersion.objects.filter(draft=self.drafts[1], language=self.language)
+        with CaptureQueriesContext(connection) as queries:
+            entries, after = get_history_page(versions, page_size=1)
+            get_history_page(versions, after=after, page_size=1)
+        for query in queries.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN {}{}'.format('QUERY PLAN ' if connection.vendor == 'sqlite' else '',
+                                                     query['sql']))
+                plan = '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+            self.assertIn('reversion2_draft_lang_date_idx', plan)
+            self.assertIsNone(re.search(self.TABLE_SCAN, plan), plan)
+            # the order is the order of the index
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class TextDiffTestCase(ReversionTestCase):
+
+    def test_a_token_diff(self):
+        ops = myers_diff(list('abcabba'), list('cbabac'))
+        self.assertEqual(sum(len(tokens) for kind, tokens in ops if kind != EQUAL), 5)
+        self.assertEqual(token_diff('<p>Hello old world</p><p>x</p>', '<p>Hello new world</p><div>x</div>'),
+                         '<p>Hello <del>old</del><ins>new</ins> world</p><div>x</div>')
+        self.assertEqual(diff_texts('<p>old</p>', '<p>new</p>', engine='tokens'), '<p><del>old</del><ins>new</ins></p>')
+
+    def test_b_fallbacks(self):
+        # too many changes for the token diff: the changed blocks are marked
+        self.assertEqual(token_diff('<p>a b</p><p>c</p>', '<p>d e</p><p>c</p>', max_cost=2),
+                         '<del>a b</del><ins><p>d e</p></ins><p>c</p>')
+        # too many changed blocks: replaced entirely
+        self.assertEqual(token_diff('<p>a</p><p>b</p>', '<p>c</p><p>d</p>', max_cost=1),
+                         '<del>a b</del><ins><p>c</p><p>d</p></ins>')
+        self.assertEqual(token_diff('<p>a</p>', '<p>b</p>', deadline=time.time() - 1),
+                         '<del>a</del><ins><p>b</p></ins>')
+
+        old = ''.join('<p>paragraph {}</p>'.format(i) for i in range(100))
+        new = old.replace('paragraph 50<', 'paragraph fifty<')
+        with mock.patch('djangocms_reversion2.diff.REVERSION2_DIFF_MAX_SIZE', 1000):
+            self.assertIn('<del>paragraph 50</del><ins><p>paragraph fifty</p></ins>', diff_texts(old, new))
+
+    def test_c_memory(self):
+        import random
+        import tracemalloc
+
+        rng = random.Random(0)
+        old = ['word{} '.format(rng.randint(0, 10 ** 6)) for i in range(400)]
+        new = ['word{} '.format(rng.randint(0, 10 ** 6)) for i in range(400)]
+        tracemalloc.start()
+        try:
+            self.assertIsNone(myers_diff(old, new, max_cost=300))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # only the paths of the current cost are kept, not those of every cost up to max_cost
+        self.assertLess(peak, 512 * 1024)
+
+
+class PrecomputedDiffTestCase(ReversionTestCase):
+
+    def test_a_diff_job(self):
+        language = 'en'
+        draft = create_page(title='precomputed', template='page.html', language=language)
+        testutils.add_text(draft, language, content='old')
+        v1 = testutils.create_version(self.user, draft, language, version_parent=None)
+        testutils.add_text(draft, language, content='new')
+        with mock.patch('djangocms_reversion2.models.PRECOMPUTE_DIFFS', True), \
+                mock.patch('djangocms_reversion2.jobs.enqueue_diff_on_commit') as enqueue_diff_on_commit:
+            v2 = testutils.create_version(self.user, draft, language)
+        enqueue_diff_on_commit.assert_called_once_with(v2)
+        self.assertIsNone(get_precomputed_diffs(v1, v2))
+
+        enqueue_diff(v2)
+        self.assertEqual(process_jobs(), 1)
+        precomputed_diff = PageVersionDiff.objects.get(page_version=v2)
+        self.assertEqual(precomputed_diff.base, v1)
+        self.assertEqual(precomputed_diff.changed_slots, draft.placeholders.count())
+        self.assertGreater(precomputed_diff.insertions, 0)
+
+        diffs = get_precomputed_diffs(v1, v2)
+        for diff in diffs.values():
+            self.assertIn('new', diff['right'])
+            self.assertNotIn('new', diff['left'])
+
+
+class StructureDiffTestCase(ReversionTestCase):
+
+    def test_a_plugin_trees_are_compared(self):
+        language = 'en'
+        draft = create_page(title='structure', template='page.html', language=language)
+        testutils.add_text(draft, language, content='old')
+        hidden_page = testutils.create_version(self.user, draft, language, version_parent=None).hidden_page
+        request = self.get_page_request(draft, self.user)
+
+        # the copies have other plugin ids, but the same contents
+        self.assertEqual(create_placeholder_contents(hidden_page, draft, request, language, mode='structure'), {})
+
+        placeholder = draft.placeholders.order_by('slot').first()
+        text = CMSPlugin.objects.get(placeholder=placeholder).get_bound_plugin()
+        text.body = 'new'
+        text.save()
+        add_plugin(placeholder, TextPlugin, language, body='added')
+
+        diffs = create_placeholder_contents(hidden_page, draft, request, language, mode='structure')
+        self.assertEqual(list(diffs.keys()), [placeholder.slot])
+        self.assertEqual(diffs[placeholder.slot]['changes'], [
+            {'status': 'changed', 'plugin_type': 'TextPlugin', 'fields': ['body']},
+            {'status': 'added', 'plugin_type': 'TextPlugin', 'fields': []},
+        ])
+        self.assertIn('old', diffs[placeholder.slot]['left'])
+        self.assertIn('added', diffs[placeholder.slot]['right'])
+
+        # comparator hooks decide what a change is
+        with mock.patch.dict('djangocms_reversion2.plugin_diff._comparators'):
+            register_comparator('TextPlugin', lambda old_fields, new_fields: [])
+            diffs = create_placeholder_contents(hidden_page, draft, request, language, mode='structure')
+        self.assertEqual([change['status'] for change in diffs[placeholder.slot]['changes']], ['added'])
+
+    def test_b_page_attributes(self):
+        language = 'en'
+        draft = create_page(title='attributes', template='page.html', language=language)
+        hidden_page = testutils.create_version(self.user, draft, language, version_parent=None).hidden_page
+        draft.soft_root = True
+        draft.save()
+        self.assertEqual(diff_page_attributes(hidden_page, draft, language), [('soft_root', False, True)])
+
+    def test_c_subtrees(self):
+        from djangocms_text_ckeditor.utils import plugin_to_tag
+
+        language = 'en'
+        draft = create_page(title='subtree', template='page.html', language=language)
+        placeholder = draft.placeholders.order_by('slot').first()
+        parent = add_plugin(placeholder, TextPlugin, language, body='parent')
+        child = add_plugin(placeholder, TextPlugin, language, body='child old', target=parent)
+        parent.body = 'parent old {}'.format(plugin_to_tag(child))
+        parent.save()
+        hidden_page = testutils.create_version(self.user, draft, language, version_parent=None).hidden_page
+        request = self.get_page_request(draft, self.user)
+
+        parent.body = 'parent new {}'.format(plugin_to_tag(child))
+        parent.save()
+        child.body = 'child new'
+        child.save()
+        diffs = create_placeholder_contents(hidden_page, draft, request, language, mode='structure')
+        self.assertEqual([change['status'] for change in diffs[placeholder.slot]['changes']], ['changed', 'changed'])
+        # the changed child is shown within its changed parent only
+        self.assertEqual(diffs[placeholder.slot]['right'].count('child new'), 1)
+        self.assertEqual(diffs[placeholder.slot]['left'].count('child old'), 1)
+
+        # a removed plugin is shown with its children
+        parent.delete()
+        diffs = create_placeholder_contents(hidden_page, draft, request, language, mode='structure')
+        self.assertEqual([change['status'] for change in diffs[placeholder.slot]['changes']], ['removed'])
+        self.assertIn('child old', diffs[placeholder.slot]['left'])
+
+    def test_d_changed_grandchild_of_a_changed_plugin(self):
+        from djangocms_text_ckeditor.utils import plugin_to_tag
+
+        language = 'en'
+        draft = create_page(title='grandchild', template='page.html', language=language)
+        placeholder = draft.placeholders.order_by('slot').first()
+        grandparent = add_plugin(placeholder, TextPlugin, language, body='grandparent')
+        parent = add_plugin(placeholder, TextPlugin, language, body='parent', target=grandparent)
+        child = add_plugin(placeholder, TextPlugin, language, body='grandchild old', target=parent)
+        parent.body = 'parent {}'.format(plugin_to_tag(child))
+        parent.save()
+        grandparent.body = 'grandparent old {}'.format(plugin_to_tag(parent))
+        grandparent.save()
+        hidden_page = testutils.create_version(self.user, draft, language, version_parent=None).hidden_page
+        request = self.get_page_request(draft, self.user)
+
+        # the parent in between stays the same
+        grandparent.body = 'grandparent new {}'.format(plugin_to_tag(parent))
+        grandparent.save()
+        child.body = 'grandchild new'
+        child.save()
+        diffs = create_placeholder_contents(hidden_page, draft, request, language, mode='structure')
+        self.assertEqual([change['status'] for change in diffs[placeholder.slot]['changes']], ['changed', 'changed'])
+        self.assertEqual(diffs[placeholder.slot]['right'].count('grandchild new'), 1)
+        self.assertEqual(diffs[placeholder.slot]['left'].count('grandchild old'), 1)
@@ -1,8 +1,10 @@
 
 from cms.api import add_plugin
+from cms.utils.permissions import current_user
 from djangocms_text_ckeditor.cms_plugins import TextPlugin
 
 from djangocms_reversion2.diff import placeholder_html
+from djangocms_reversion2.models import PageVersion
 from djangocms_reversion2.signals import make_page_version_dirty
 
 
@@ -32,3 +34,11 @@ def get_html(request, language='en'):
     for p in page.placeholders.iterator():
         html += placeholder_html(p, request, language)
     return html
+
+
+def create_version(user, draft, language, **kwargs):
+    """
+    Creates a PageVersion as the given user (cms.api.create_page resets the thread local user)
+    """
+    with current_user(user):
+        return PageVersion.create_version(draft, language, **kwargs)